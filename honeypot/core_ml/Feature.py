@@ -1,13 +1,34 @@
 import logging
 from datetime import datetime
-import geoip2.database
 import os
 from collections import Counter
 import math
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from feature_schema import (
+    FEATURE_NAMES, FeatureVector, HOUR_SIN, HOUR_COS, DAY_SIN, DAY_COS, IS_NIGHT, signature_features
+)
+from geo_cache import GeoIPCache
+from command_analysis import CommandAnalyzer
+from ip_reputation import IPReputation
 
 logger = logging.getLogger(__name__)
 
+COUNTRY_RISK = {
+    'CN': 0.8, 'RU': 0.7, 'US': 0.2,
+    'RO': 0.6, 'NG': 0.55, 'BR': 0.4,
+}
+
+# Per-log fields gathered by transform_many before the vectorized pass
+_RAW_COLUMNS = (
+    'hour', 'day', 'failed', 'success', 'duration', 'unique', 'total',
+    'suspicious', 'entropy', 'ip_reputation', 'country_risk',
+)
+_HOUR_SIN, _HOUR_COS, _IS_NIGHT = np.array(HOUR_SIN), np.array(HOUR_COS), np.array(IS_NIGHT)
+_DAY_SIN, _DAY_COS = np.array(DAY_SIN), np.array(DAY_COS)
+
 class FeatureExtractor:
     """
     Extracts features from log entries for anomaly detection and classification.
@@ -18,101 +39,165 @@ class FeatureExtractor:
             logger.critical("GEOIP_PATH environment variable is not set.")
             raise ValueError("GEOIP_PATH environment variable is not set.")
         try:
-            self.geoip = geoip2.database.Reader(
-                os.path.join(geoip_path, 'GeoLite2-City.mmdb')
+            self.geoip = GeoIPCache(
+                os.path.join(geoip_path, 'GeoLite2-City.mmdb'),
+                mode=os.getenv("GEOIP_MODE", "auto"),
+                max_entries=int(os.getenv("GEOIP_CACHE_SIZE", 65536))
             )
         except Exception as e:
             logger.critical(f"Failed to load GeoIP database: {e}")
             raise
-        self.suspicious_commands = {
-            'wget', 'curl', 'chmod', 'chown', 'passwd',
-            'rm', 'mv', 'tar', 'nc', 'telnet', 'su', 'sudo', 'ssh', 'ftp', 'uname', 'id'
-        }
+        # Command signatures, matched across pipelines and chains; see command_analysis.py
+        self.commands = CommandAnalyzer.from_file(os.getenv("COMMAND_SIGNATURES") or None)
+        # Optionally add each matched signature's hit count to the features as 'sig:<name>'
+        self.signature_features = os.getenv("COMMAND_SIGNATURE_FEATURES", "false").lower() in ("1", "true", "yes")
+        # Local blocklists for ip_reputation; without them every IP keeps the neutral 0.5
+        sources = [p for p in os.getenv("REPUTATION_SOURCES", "").split(",") if p.strip()]
+        index_path = os.getenv("REPUTATION_INDEX", "")
+        self.reputation = None
+        if sources or index_path:
+            self.reputation = IPReputation(
+                sources, index_path or "ip_reputation.idx",
+                default=float(os.getenv("REPUTATION_DEFAULT", 0.0)),
+                reload_interval=float(os.getenv("REPUTATION_RELOAD_SECONDS", 300))
+            )
 
-    def transform(self, log_entry: Dict[str, Any]) -> Dict[str, float]:
+    def transform(self, log_entry: Dict[str, Any], timestamp: Optional[datetime] = None,
+                  enrichment: Optional[Dict[str, Any]] = None) -> Dict[str, float]:
         """
-        Transform a log entry into a feature vector.
+        Transform a log entry into a feature dict, with keys in FEATURE_NAMES order.
+        Pass the already parsed timestamp to avoid parsing it again, and the source IP's enrich()
+        result if the caller needs it too, so the IP is not resolved twice.
         """
-        features = {}
         try:
-            timestamp = datetime.fromisoformat(log_entry['timestamp'])
-            hour = timestamp.hour
-            features['hour_of_day'] = hour
-            features['hour_sin'] = math.sin(2 * math.pi * hour / 24)
-            features['hour_cos'] = math.cos(2 * math.pi * hour / 24)
-            features['is_night'] = int(hour >= 22 or hour < 4)
-            day = timestamp.weekday()
-            features['day_of_week'] = day
-            features['day_sin'] = math.sin(2 * math.pi * day / 7)
-            features['day_cos'] = math.cos(2 * math.pi * day / 7)
-
-            auth_attempts = log_entry.get('auth_attempts', {'failed': 0, 'success': 0})
-            failed = auth_attempts.get('failed', 0)
-            success = auth_attempts.get('success', 0)
-            features['failed_logins'] = failed
-            features['success_logins'] = success
-            features['login_attempt_ratio'] = failed / (failed + success + 1e-6)
-
-            duration = log_entry.get('duration', 0)
-            commands = log_entry.get('commands', [])
-            features['session_duration'] = duration
-            features['unique_commands'] = len(set(commands))
-            features['total_commands'] = len(commands)
-            features['suspicious_command_count'] = self._count_suspicious_commands(log_entry)
-            if features['total_commands'] > 0:
-                features['proportion_suspicious_commands'] = features['suspicious_command_count'] / features['total_commands']
-            else:
-                features['proportion_suspicious_commands'] = 0
-            if commands:
-                freq = Counter(commands)
-                total = len(commands)
-                entropy = -sum((count / total) * math.log2(count / total) for count in freq.values() if count > 0)
-                features['command_entropy'] = entropy
-            else:
-                features['command_entropy'] = 0
-
-            features['ip_reputation'] = self._get_ip_reputation(log_entry.get('source_ip', ''))
-            features['country_risk'] = self._get_country_risk(log_entry.get('source_ip', ''))
-
-            if duration > 0:
-                features['commands_per_minute'] = features['unique_commands'] / (duration / 60 + 1e-6)
-            else:
-                features['commands_per_minute'] = 0
+            values, hits = self._extract(log_entry, timestamp, enrichment)
+            features = dict(zip(FEATURE_NAMES, values))
+            if self.signature_features:
+                features.update(signature_features(hits))
+            return features
         except Exception as e:
             logger.error(f"Error extracting features: {e}")
-        return features
+            return {}
+
+    def transform_vector(self, log_entry: Dict[str, Any], timestamp: Optional[datetime] = None) -> FeatureVector:
+        """
+        Transform a log entry into a compact, array-backed FeatureVector.
+        """
+        return FeatureVector(self._extract(log_entry, timestamp)[0])
+
+    def transform_many(self, logs: List[Dict[str, Any]], timestamps: Optional[List[datetime]] = None,
+                       signature_hits: Optional[List[Counter]] = None) -> np.ndarray:
+        """
+        Transform a list of logs into an (n_logs, len(FEATURE_NAMES)) matrix.
+        Per-log fields are gathered in one pass and the derived columns are computed with
+        vectorized NumPy operations. Rows for logs that fail to parse are NaN.
+        If `signature_hits` is given, each log's per-signature hits are appended to it (empty for
+        failed rows), for signature_features() when those are enabled.
+        """
+        raw = np.full((len(logs), len(_RAW_COLUMNS)), np.nan)
+        for i, log_entry in enumerate(logs):
+            hits = Counter()
+            try:
+                raw[i], hits = self._raw_fields(log_entry, timestamps[i] if timestamps else None)
+            except Exception as e:
+                logger.error(f"Error extracting features: {e}")
+            if signature_hits is not None:
+                signature_hits.append(hits)
+        valid = ~np.isnan(raw[:, 0])
+        raw = raw[valid]
+        hour = raw[:, 0].astype(np.intp)
+        day = raw[:, 1].astype(np.intp)
+        failed, success, duration = raw[:, 2], raw[:, 3], raw[:, 4]
+        unique, total, suspicious = raw[:, 5], raw[:, 6], raw[:, 7]
+        safe_total = np.where(total > 0, total, 1)
+        safe_duration = np.where(duration > 0, duration, 0)
 
-    def _count_suspicious_commands(self, log_entry: Dict[str, Any]) -> int:
+        out = np.full((len(logs), len(FEATURE_NAMES)), np.nan)
+        out[valid] = np.column_stack([
+            hour, _HOUR_SIN[hour], _HOUR_COS[hour], _IS_NIGHT[hour],
+            day, _DAY_SIN[day], _DAY_COS[day],
+            failed, success, failed / (failed + success + 1e-6),
+            duration, unique, total,
+            suspicious, np.where(total > 0, suspicious / safe_total, 0), raw[:, 8],
+            raw[:, 9], raw[:, 10],
+            np.where(duration > 0, unique / (safe_duration / 60 + 1e-6), 0),
+        ])
+        return out
+
+    def _raw_fields(self, log_entry: Dict[str, Any], timestamp: Optional[datetime],
+                    enrichment: Optional[Dict[str, Any]] = None) -> Tuple[tuple, Counter]:
+        # Per-log inputs that need Python-level work, in _RAW_COLUMNS order, and the log's signature hits
+        if timestamp is None:
+            timestamp = datetime.fromisoformat(log_entry['timestamp'])
+        auth_attempts = log_entry.get('auth_attempts', {'failed': 0, 'success': 0})
         commands = log_entry.get('commands', [])
-        return sum(1 for cmd in commands if isinstance(cmd, str) and cmd.split()[0] in self.suspicious_commands)
+        ip = log_entry.get('source_ip', '')
+        country_risk = enrichment['country_risk'] if enrichment is not None else self._get_country_risk(ip)
+        match = self.commands.analyze(commands)
+        return (
+            timestamp.hour, timestamp.weekday(),
+            auth_attempts.get('failed', 0), auth_attempts.get('success', 0),
+            log_entry.get('duration', 0),
+            len(set(commands)), len(commands),
+            match.suspicious, self._command_entropy(commands),
+            self._get_ip_reputation(ip), country_risk,
+        ), match.hits
+
+    def _extract(self, log_entry: Dict[str, Any], timestamp: Optional[datetime],
+                 enrichment: Optional[Dict[str, Any]] = None) -> Tuple[List[float], Counter]:
+        (hour, day, failed, success, duration, unique, total,
+         suspicious, entropy, reputation, country_risk), hits = self._raw_fields(log_entry, timestamp, enrichment)
+        return [
+            hour, HOUR_SIN[hour], HOUR_COS[hour], IS_NIGHT[hour],
+            day, DAY_SIN[day], DAY_COS[day],
+            failed, success, failed / (failed + success + 1e-6),
+            duration, unique, total,
+            suspicious, suspicious / total if total > 0 else 0, entropy,
+            reputation, country_risk,
+            unique / (duration / 60 + 1e-6) if duration > 0 else 0,
+        ], hits
+
+    @staticmethod
+    def _command_entropy(commands: List[str]) -> float:
+        if not commands:
+            return 0
+        total = len(commands)
+        return -sum((count / total) * math.log2(count / total) for count in Counter(commands).values())
 
     def _get_ip_reputation(self, ip: str) -> float:
-        # Placeholder for future integration with threat intelligence feeds
-        return 0.5
+        if self.reputation is None:
+            return 0.5
+        return self.reputation.score(ip)
 
     def _get_country_risk(self, ip: str) -> float:
+        return self.enrich(ip)['country_risk']
+
+    def enrich(self, ip: str) -> Dict[str, Any]:
+        """
+        Resolve an IP once and return both its country risk and its 'City, Country' location.
+        Lookups are served from the GeoIP cache, so repeated and neighbouring IPs are cheap.
+        """
         try:
-            country = self.geoip.city(ip).country.iso_code
-            risk_scores = {
-                'CN': 0.8, 'RU': 0.7, 'US': 0.2,
-                'RO': 0.6, 'NG': 0.55, 'BR': 0.4,
-            }
-            return risk_scores.get(country, 0.5)
+            result = self.geoip.lookup(ip)
         except Exception:
-            return 0.5
+            result = None
+        if result is None:
+            return {'country_risk': 0.5, 'location': "Unknown"}
+        country, city = result
+        return {
+            'country_risk': COUNTRY_RISK.get(country, 0.5),
+            'location': f"{city or 'Unknown City'}, {country or 'Unknown Country'}",
+        }
 
     def get_location(self, ip: str) -> str:
         """
         Look up location information for a given IP address.
         Returns a string in the format 'City, Country'. If lookup fails, returns 'Unknown'.
         """
-        try:
-            geo_info = self.geoip.city(ip)
-            city = geo_info.city.name if geo_info.city.name else "Unknown City"
-            country = geo_info.country.iso_code if geo_info.country.iso_code else "Unknown Country"
-            return f"{city}, {country}"
-        except Exception:
-            return "Unknown"
-
+        return self.enrich(ip)['location']
 
+    def geoip_stats(self) -> Dict[str, float]:
+        return self.geoip.stats()
 
+    def reputation_stats(self) -> Optional[Dict[str, float]]:
+        return self.reputation.stats() if self.reputation is not None else None
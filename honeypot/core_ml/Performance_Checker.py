@@ -1,83 +1,172 @@
 import logging
-import matplotlib.pyplot as plt
-from matplotlib import dates as mdates
-import numpy as np
-from sklearn import metrics
+import threading
+from collections import deque
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
 class PerformanceMonitor:
     """
     Tracks and visualizes detection performance, including score distributions and ROC curves.
+    All statistics are streaming and use bounded memory: scores go into fixed-width histograms
+    (overall and per true label), confusion counts and the cumulative attack count are running
+    counters, and ROC/AUC are computed from the per-label histograms. Reports are rendered from
+    a snapshot of these counters, optionally on a background thread at a wall-clock cadence.
     """
-    def __init__(self):
-        self.log_entries = []
+    def __init__(self, num_bins: int = 50, score_range: tuple = (0.0, 1.0),
+                 max_series_points: int = 2000, series_resolution: float = 1.0,
+                 report_path: str = 'monitoring_report.png'):
+        self.num_bins = num_bins
+        self.score_min, self.score_max = score_range
+        self.report_path = report_path
+        self._bin_width = (self.score_max - self.score_min) / num_bins
+        self._lock = threading.Lock()
+        self.score_hist = [0] * num_bins
+        self.label_hist = {True: [0] * num_bins, False: [0] * num_bins}
+        self.total_events = 0
+        self.detected_attacks = 0
+        # Confusion counts for labeled events, keyed by (true_label, is_attack)
+        self.confusion = {(True, True): 0, (True, False): 0, (False, True): 0, (False, False): 0}
+        # Cumulative detected attacks over time, at most one point per series_resolution seconds
+        self.series_resolution = series_resolution
+        self.series = deque(maxlen=max_series_points)
+        self._reporter = None
+        self._stop_reporting = threading.Event()
+
+    def _bin(self, score: float) -> int:
+        index = int((score - self.score_min) / self._bin_width)
+        return min(max(index, 0), self.num_bins - 1)
 
     def update(self, score: float, is_attack: bool, true_label: Optional[bool] = None) -> None:
-        entry = {
-            'timestamp': datetime.now(),
-            'score': score,
-            'is_attack': is_attack,
-            'true_label': true_label
-        }
-        self.log_entries.append(entry)
-        logger.debug(f"PerformanceMonitor updated: {entry}")
+        now = datetime.now()
+        index = self._bin(score)
+        with self._lock:
+            self.total_events += 1
+            self.score_hist[index] += 1
+            if is_attack:
+                self.detected_attacks += 1
+            if true_label is not None:
+                self.label_hist[bool(true_label)][index] += 1
+                self.confusion[(bool(true_label), bool(is_attack))] += 1
+            if self.series and (now - self.series[-1][0]).total_seconds() < self.series_resolution:
+                self.series[-1] = (self.series[-1][0], self.detected_attacks)
+            else:
+                self.series.append((now, self.detected_attacks))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Copy of the current counters, safe to render while updates continue.
+        """
+        with self._lock:
+            return {
+                'score_hist': list(self.score_hist),
+                'label_hist': {k: list(v) for k, v in self.label_hist.items()},
+                'confusion': dict(self.confusion),
+                'series': list(self.series),
+                'total_events': self.total_events,
+            }
+
+    @staticmethod
+    def roc_curve(positives: List[int], negatives: List[int]) -> Dict[str, Any]:
+        """
+        ROC points and AUC from per-bin positive/negative counts, sweeping the threshold
+        from the highest bin down.
+        """
+        total_pos, total_neg = sum(positives), sum(negatives)
+        fpr, tpr = [0.0], [0.0]
+        tp = fp = 0
+        for pos, neg in zip(reversed(positives), reversed(negatives)):
+            tp += pos
+            fp += neg
+            tpr.append(tp / total_pos if total_pos else 0.0)
+            fpr.append(fp / total_neg if total_neg else 0.0)
+        auc = sum((fpr[i] - fpr[i - 1]) * (tpr[i] + tpr[i - 1]) / 2 for i in range(1, len(fpr)))
+        return {'fpr': fpr, 'tpr': tpr, 'auc': auc}
+
+    def start_reporting(self, interval: float) -> None:
+        """
+        Render the report every `interval` seconds on a background thread.
+        """
+        if self._reporter is not None:
+            return
+        self._stop_reporting.clear()
+        self._reporter = threading.Thread(target=self._report_loop, args=(interval,),
+                                          name="performance-report", daemon=True)
+        self._reporter.start()
+
+    def stop_reporting(self) -> None:
+        if self._reporter is None:
+            return
+        self._stop_reporting.set()
+        self._reporter.join()
+        self._reporter = None
+
+    def _report_loop(self, interval: float) -> None:
+        while not self._stop_reporting.wait(interval):
+            try:
+                self.generate_report()
+            except Exception as e:
+                logger.error("Error generating performance report: %s", e)
 
     def generate_report(self) -> None:
-        labeled_entries = [entry for entry in self.log_entries if entry['true_label'] is not None]
-        has_labels = len(labeled_entries) > 0
+        # matplotlib takes longer to import than the rest of the pipeline, so it waits for the first report
+        from matplotlib import dates as mdates
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        data = self.snapshot()
+        edges = [self.score_min + i * self._bin_width for i in range(self.num_bins + 1)]
+        centers = [(edges[i] + edges[i + 1]) / 2 for i in range(self.num_bins)]
+        positives, negatives = data['label_hist'][True], data['label_hist'][False]
+        has_labels = sum(positives) + sum(negatives) > 0
 
-        fig = plt.figure(1, figsize=(15, 10))
-        plt.clf()
+        # Object-oriented API only: pyplot's global state is not safe off the main thread
+        fig = Figure(figsize=(15, 10))
+        FigureCanvasAgg(fig)
 
         # Plot 1: Score distribution
         ax1 = fig.add_subplot(2, 2, 1)
-        scores = [entry['score'] for entry in self.log_entries]
-        ax1.hist(scores, bins=50, alpha=0.7)
+        ax1.hist(centers, bins=edges, weights=data['score_hist'], alpha=0.7)
         ax1.set_title('Anomaly Score Distribution')
         ax1.set_xlabel('Score')
         ax1.set_ylabel('Count')
         if has_labels:
-            true_attack_scores = [entry['score'] for entry in labeled_entries if entry['true_label']]
-            non_attack_scores = [entry['score'] for entry in labeled_entries if not entry['true_label']]
-            ax1.hist(true_attack_scores, bins=50, alpha=0.5, color='red', label='True Attacks')
-            ax1.hist(non_attack_scores, bins=50, alpha=0.5, color='green', label='Non-Attacks')
+            ax1.hist(centers, bins=edges, weights=positives, alpha=0.5, color='red', label='True Attacks')
+            ax1.hist(centers, bins=edges, weights=negatives, alpha=0.5, color='green', label='Non-Attacks')
             ax1.legend()
 
         # Plot 2: Cumulative attack counts
         ax2 = fig.add_subplot(2, 2, 2)
-        timestamps_all = [entry['timestamp'] for entry in self.log_entries]
-        detected_attacks_all = [1 if entry['is_attack'] else 0 for entry in self.log_entries]
-        cumulative_detected = np.cumsum(detected_attacks_all)
-        ax2.plot(timestamps_all, cumulative_detected, label='Detected Attacks')
+        if data['series']:
+            timestamps, cumulative_detected = zip(*data['series'])
+            ax2.plot(timestamps, cumulative_detected, label='Detected Attacks')
+            ax2.legend()
         ax2.set_title('Cumulative Attack Counts')
         ax2.set_xlabel('Time')
         ax2.set_ylabel('Count')
         ax2.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d %H:%M:%S'))
-        ax2.legend()
 
         # Plot 3: Performance metrics (if labels are available)
         if has_labels:
-            y_true = [entry['true_label'] for entry in labeled_entries]
-            y_pred = [entry['is_attack'] for entry in labeled_entries]
+            confusion = data['confusion']
+            cm = [[confusion[(False, False)], confusion[(False, True)]],
+                  [confusion[(True, False)], confusion[(True, True)]]]
             ax3 = fig.add_subplot(2, 2, 3)
-            cm = metrics.confusion_matrix(y_true, y_pred)
-            ax3.matshow(cm, cmap=plt.cm.Blues)
+            ax3.matshow(cm, cmap='Blues')
             ax3.set_title('Confusion Matrix')
             ax3.set_xticks([0, 1])
             ax3.set_yticks([0, 1])
             ax3.set_xticklabels(['Non-Attack', 'Attack'])
             ax3.set_yticklabels(['Non-Attack', 'Attack'])
-            precision = metrics.precision_score(y_true, y_pred)
-            recall = metrics.recall_score(y_true, y_pred)
+            tp, fp, fn = confusion[(True, True)], confusion[(False, True)], confusion[(True, False)]
+            precision = tp / (tp + fp) if tp + fp else 0.0
+            recall = tp / (tp + fn) if tp + fn else 0.0
             ax3.text(0, -1, f'Precision: {precision:.2f}, Recall: {recall:.2f}', ha='center', va='center', size=12)
 
             ax4 = fig.add_subplot(2, 2, 4)
-            fpr, tpr, _ = metrics.roc_curve(y_true, [entry['score'] for entry in labeled_entries])
-            roc_auc = metrics.roc_auc_score(y_true, [entry['score'] for entry in labeled_entries])
-            ax4.plot(fpr, tpr, label=f'AUC = {roc_auc:.2f}')
+            roc = self.roc_curve(positives, negatives)
+            ax4.plot(roc['fpr'], roc['tpr'], label=f"AUC = {roc['auc']:.2f}")
             ax4.set_title('ROC Curve')
             ax4.set_xlabel('False Positive Rate')
             ax4.set_ylabel('True Positive Rate')
@@ -91,11 +180,7 @@ class PerformanceMonitor:
             ax4.axis('off')
 
         try:
-            fig.savefig('monitoring_report.png', bbox_inches='tight')
-            logger.info("Performance report saved as monitoring_report.png")
+            fig.savefig(self.report_path, bbox_inches='tight')
+            logger.info("Performance report saved as %s (%d events)", self.report_path, data['total_events'])
         except Exception as e:
             logger.error(f"Error saving performance report: {e}")
-        plt.close(fig)
-
-
-
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from pipeline import detect_events, extract_events
+from sources import idle_ticks
+from telemetry import observe_batches
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+# Passed on in place of a batch that failed, so the persist stage knows where to stop committing
+_FAILED = object()
+
+# Stage names in pipeline order; each stage reads from the queue of the same name
+STAGES = ('features', 'scoring', 'response', 'persist')
+
+class StageStats:
+    """
+    Counters for one stage and the queue feeding it.
+    """
+    __slots__ = ('batches', 'events', 'busy', 'max_depth')
+
+    def __init__(self):
+        self.batches = 0
+        self.events = 0
+        self.busy = 0.0
+        self.max_depth = 0
+
+class AsyncPipeline:
+    """
+    Runs detection as asyncio stages connected by bounded queues:
+    ingest -> features -> scoring -> response -> persist.
+    Ingest reads the (blocking) log source on its own thread. Feature extraction and scoring each
+    run on a dedicated single-thread executor, so the feature extractor, per-IP state and detector
+    are only ever touched by one thread and the event loop stays free for the other stages.
+    Responses and source commits run on a third thread, as both may block on the network.
+    A full queue blocks the stage before it, back to ingest, so a slow stage slows reading instead
+    of growing memory. A batch that fails in any stage is dropped, and from then on nothing is
+    committed, so a restart reads it again rather than resuming past it. stop() (also bound to
+    SIGINT/SIGTERM) stops ingest and lets every batch already read flow through all stages before
+    run() returns; the source is only committed up to the last batch that completed.
+    """
+    def __init__(self, source, fe, model, ip_state, checkpointer, respond: Callable[[List[Dict[str, Any]]], None],
+                 on_progress: Optional[Callable[[int], bool]] = None, snapshot: Optional[Callable[[], None]] = None,
+                 queue_size: int = 8, metrics_interval: float = 30.0, retry_delay: float = 5.0, coalescer=None):
+        self.source = source
+        self.fe = fe
+        self.model = model
+        self.ip_state = ip_state
+        self.checkpointer = checkpointer
+        self.respond = respond
+        self.on_progress = on_progress
+        self.snapshot = snapshot
+        # Optional EventCoalescer, run on the feature thread ahead of feature extraction
+        self.coalescer = coalescer
+        self.queue_size = queue_size
+        self.metrics_interval = metrics_interval
+        self.retry_delay = retry_delay
+        self.stats = {stage: StageStats() for stage in STAGES}
+        self.failed_batches = 0
+        self._hold_commits = False
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = threading.Event()
+        self._feature_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-features")
+        self._model_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-scoring")
+        self._response_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-response")
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queues = {stage: asyncio.Queue(maxsize=self.queue_size) for stage in STAGES}
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not available on this platform or thread; KeyboardInterrupt then ends the run without a drain
+                pass
+        stages = [
+            asyncio.ensure_future(self._stage('features', 'scoring', self._extract, self._drain_coalescer)),
+            asyncio.ensure_future(self._stage('scoring', 'response', self._score)),
+            asyncio.ensure_future(self._stage('response', 'persist', self._respond)),
+            asyncio.ensure_future(self._stage('persist', None, self._persist)),
+        ]
+        metrics = asyncio.ensure_future(self._report_metrics())
+        threading.Thread(target=self._ingest, name="pipeline-ingest", daemon=True).start()
+        logger.info("Async pipeline started (queue size %d).", self.queue_size)
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            metrics.cancel()
+            self._feature_pool.shutdown(wait=True)
+            self._model_pool.shutdown(wait=True)
+            self._response_pool.shutdown(wait=True)
+            logger.info("Async pipeline drained. %s", self.metrics())
+
+    def stop(self) -> None:
+        """
+        Stop reading and drain the batches already in flight. Safe to call from any thread.
+        """
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        logger.info("Stopping async pipeline; draining in-flight batches...")
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._queues['features'].put(_END)))
+
+    def _ingest(self) -> None:
+        resume_token = None
+        while not self._stopping.is_set():
+            try:
+                batches = self.source.batches(resume_token)
+                if self.coalescer is not None:
+                    # Idle sources yield nothing, so tick the coalescer to close its windows on time
+                    batches = idle_ticks(batches, self.coalescer.tick_interval)
+                batches = observe_batches(batches)
+                try:
+                    for logs, token in batches:
+                        if self._stopping.is_set():
+                            # Not committed, so a restart reads it again
+                            return
+                        if token is not None:
+                            resume_token = token
+                        if logs or self.coalescer is not None:
+                            asyncio.run_coroutine_threadsafe(
+                                self._queues['features'].put((logs, token, len(logs))), self._loop).result()
+                finally:
+                    # Stop reading (and idle_ticks' reader thread) before the source is read again
+                    batches.close()
+                # A finite source has been read to the end
+                self.stop()
+                return
+            except Exception as e:
+                logger.warning("Stream interrupted: %s. Reconnecting in %g seconds...", str(e), self.retry_delay)
+                self._stopping.wait(self.retry_delay)
+
+    async def _stage(self, name: str, next_stage: Optional[str], work: Callable,
+                     drain: Optional[Callable] = None) -> None:
+        queue = self._queues[name]
+        stats = self.stats[name]
+        while True:
+            item = await queue.get()
+            if item is _END:
+                result = await drain() if drain is not None else None
+                if result is not None:
+                    await self._queues[next_stage].put(result)
+                if next_stage is not None:
+                    await self._queues[next_stage].put(_END)
+                return
+            if item is _FAILED:
+                await self._failed(next_stage)
+                continue
+            started = time.perf_counter()
+            try:
+                result = await work(*item)
+            except Exception as e:
+                logger.error("Pipeline stage '%s' failed on a batch of %d logs: %s", name, item[-1], e)
+                self.failed_batches += 1
+                await self._failed(next_stage)
+                continue
+            stats.busy += time.perf_counter() - started
+            stats.batches += 1
+            stats.events += item[-1]
+            if next_stage is not None and result is not None:
+                await self._queues[next_stage].put(result)
+
+    async def _failed(self, next_stage: Optional[str]) -> None:
+        if next_stage is not None:
+            await self._queues[next_stage].put(_FAILED)
+        elif not self._hold_commits:
+            # Batches before the failed one have been committed; later ones are not
+            self._hold_commits = True
+            logger.error("Not committing the source past a failed batch; restart to read it again.")
+
+    def _coalesce_and_extract(self, logs, token):
+        # Only tokens whose logs have all left the coalescer move on to be committed
+        if self.coalescer is not None:
+            logs = self.coalescer.add_many(logs, token=token)
+            token = self.coalescer.committable()
+        return extract_events(logs, self.fe, self.ip_state) if logs else [], token
+
+    async def _extract(self, logs, token, count):
+        events, token = await self._loop.run_in_executor(self._feature_pool, self._coalesce_and_extract, logs, token)
+        if not events and token is None:
+            return None
+        return events, token, count
+
+    async def _drain_coalescer(self):
+        # Windows still open at shutdown go through as a last batch, with nothing left to commit
+        if self.coalescer is None:
+            return None
+        logs = await self._loop.run_in_executor(self._feature_pool, self.coalescer.flush)
+        if not logs:
+            return None
+        events = await self._loop.run_in_executor(self._feature_pool, extract_events, logs, self.fe, self.ip_state)
+        return events, None, len(logs)
+
+    async def _score(self, events, token, count):
+        detections = await self._loop.run_in_executor(self._model_pool, detect_events, events, self.model)
+        return detections, token, count
+
+    async def _respond(self, detections, token, count):
+        if detections:
+            await self._loop.run_in_executor(self._response_pool, self.respond, detections)
+        return detections, token, count
+
+    async def _persist(self, detections, token, count):
+        if token is not None and not self._hold_commits:
+            await self._loop.run_in_executor(self._response_pool, self.source.commit, token)
+        if not detections:
+            return None
+        # The checkpoint pickles the detector, so it runs on the scoring thread between batches
+        saved = await self._loop.run_in_executor(self._model_pool, self.checkpointer.maybe_save, self.model,
+                                                 len(detections))
+        # Per-IP state is owned by the feature thread and is snapshotted there, with each checkpoint
+        if saved and self.snapshot is not None:
+            await self._loop.run_in_executor(self._feature_pool, self.snapshot)
+        if self.on_progress is not None:
+            await self._loop.run_in_executor(self._response_pool, self.on_progress, len(detections))
+        return None
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per-stage queue depth (now and peak), throughput counters and busy time.
+        """
+        result = {}
+        for stage in STAGES:
+            stats = self.stats[stage]
+            queue = self._queues.get(stage)
+            depth = queue.qsize() if queue is not None else 0
+            stats.max_depth = max(stats.max_depth, depth)
+            result[stage] = {
+                'depth': depth,
+                'max_depth': stats.max_depth,
+                'batches': stats.batches,
+                'events': stats.events,
+                'busy_seconds': round(stats.busy, 3),
+            }
+        return result
+
+    async def _report_metrics(self) -> None:
+        # Sample depths often for the peaks, log them every metrics_interval seconds
+        last_log = time.monotonic()
+        while True:
+            await asyncio.sleep(0.1)
+            metrics = self.metrics()
+            if self.metrics_interval > 0 and time.monotonic() - last_log >= self.metrics_interval:
+                last_log = time.monotonic()
+                logger.info("Pipeline queues: %s", ", ".join(
+                    f"{stage}={m['depth']}/{self.queue_size} (peak {m['max_depth']})" for stage, m in metrics.items()))
@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from feature_schema import FEATURE_NAMES, LOG_FIELDS, signature_features
+from ip_state import IPStateStore
+from pipeline import compute_interarrival, heuristic_label, to_epoch
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+class BootstrapProgress:
+    """
+    Position of a historical bootstrap, persisted as JSON so an interrupted run can resume.
+    The position is the (source_ip, timestamp, _id) of the last record read, in the order
+    MongoDBHandler.iter_historical_data returns records; the _id breaks ties between records
+    of one IP with the same timestamp. `read` counts records read and `processed` those
+    trained on.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.source_ip: Optional[str] = None
+        self.timestamp: Any = None
+        self.record_id: Any = None
+        self.read = 0
+        self.processed = 0
+        self.done = False
+
+    @classmethod
+    def load(cls, path: str) -> 'BootstrapProgress':
+        progress = cls(path)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return progress
+        except Exception as e:
+            logger.warning("Ignoring unreadable bootstrap progress file %s: %s", path, e)
+            return progress
+        progress.source_ip = state.get('source_ip')
+        progress.timestamp = state.get('timestamp')
+        if state.get('timestamp_is_datetime') and progress.timestamp is not None:
+            progress.timestamp = datetime.fromisoformat(progress.timestamp)
+        progress.record_id = state.get('record_id')
+        if state.get('record_id_is_objectid') and progress.record_id is not None:
+            # bson comes with pymongo, which a bootstrap needs anyway
+            from bson import ObjectId
+            progress.record_id = ObjectId(progress.record_id)
+        progress.processed = state.get('processed', 0)
+        # Files from before records read were counted only have the records trained on
+        progress.read = state.get('read', progress.processed)
+        progress.done = state.get('done', False)
+        return progress
+
+    @property
+    def started(self) -> bool:
+        return self.read > 0
+
+    @property
+    def position(self) -> Optional[Tuple[str, Any, Any]]:
+        if self.source_ip is None:
+            return None
+        return self.source_ip, self.timestamp, self.record_id
+
+    def reset(self) -> None:
+        self.source_ip = None
+        self.timestamp = None
+        self.record_id = None
+        self.read = 0
+        self.processed = 0
+        self.done = False
+
+    def save(self) -> None:
+        """
+        Write the progress file, replacing the previous one atomically.
+        """
+        is_datetime = isinstance(self.timestamp, datetime)
+        is_objectid = type(self.record_id).__name__ == 'ObjectId'
+        state = {
+            'source_ip': self.source_ip,
+            'timestamp': self.timestamp.isoformat() if is_datetime else self.timestamp,
+            'timestamp_is_datetime': is_datetime,
+            'record_id': str(self.record_id) if is_objectid else self.record_id,
+            'record_id_is_objectid': is_objectid,
+            'read': self.read,
+            'processed': self.processed,
+            'done': self.done,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+class HistoricalBootstrap:
+    """
+    Trains a detector on historical records streamed from MongoDB.
+    Records are read from a projected, batched cursor in ip_time_index order, so per-IP
+    interarrival times are computed on chronologically ordered events. A background thread
+    reads the cursor and extracts features for the next batch while the current one trains.
+    Every `checkpoint_every` records the model (through `save_model`) and then the progress
+    file are saved, so a restarted bootstrap continues after the last checkpoint instead of
+    starting over.
+    """
+    def __init__(self, db, fe, ip_state: IPStateStore, progress_path: str,
+                 batch_size: int = 1000, limit: int = 0, checkpoint_every: int = 50000,
+                 prefetch_batches: int = 2):
+        self.db = db
+        self.fe = fe
+        self.ip_state = ip_state
+        self.progress = BootstrapProgress.load(progress_path)
+        self.batch_size = batch_size
+        self.limit = limit
+        self.checkpoint_every = checkpoint_every
+        self._batches = queue.Queue(maxsize=max(1, prefetch_batches))
+        self._stop = threading.Event()
+
+    def run(self, detector, save_model=None) -> int:
+        """
+        Train detector on the remaining historical records and return how many were trained on.
+        """
+        if self.progress.done:
+            logger.info("Historical bootstrap already completed (%d records).", self.progress.processed)
+            return 0
+        if self.progress.started:
+            logger.info("Resuming historical bootstrap after %d records (last IP %s).",
+                        self.progress.processed, self.progress.source_ip)
+            # Records are grouped by IP, so only the interrupted IP needs its last-seen time back
+            self.ip_state.interarrival(self.progress.source_ip, to_epoch(self._parse(self.progress.timestamp)), 0)
+
+        reader = threading.Thread(target=self._read, name="bootstrap-reader", daemon=True)
+        reader.start()
+        trained = 0
+        since_checkpoint = 0
+        started = time.monotonic()
+        try:
+            while True:
+                batch = self._batches.get()
+                if batch is _DONE:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                features, labels, last_position, read = batch
+                if features:
+                    detector.process_batch(features)
+                    detector.train_classifier(features, labels)
+                trained += len(features)
+                since_checkpoint += len(features)
+                if last_position is not None:
+                    self.progress.source_ip, self.progress.timestamp, self.progress.record_id = last_position
+                self.progress.read += read
+                self.progress.processed += len(features)
+                if self.checkpoint_every and since_checkpoint >= self.checkpoint_every:
+                    self._checkpoint(detector, save_model)
+                    since_checkpoint = 0
+                    elapsed = time.monotonic() - started
+                    logger.info("Bootstrap trained on %d records (%.0f/s)", self.progress.processed,
+                                trained / elapsed if elapsed > 0 else 0.0)
+            self.progress.done = True
+            self._checkpoint(detector, save_model)
+            logger.info("Historical bootstrap completed: %d records this run, %d in total",
+                        trained, self.progress.processed)
+        finally:
+            self._stop.set()
+            # Unblock the reader if it is waiting on a full queue
+            while reader.is_alive():
+                try:
+                    self._batches.get_nowait()
+                except queue.Empty:
+                    reader.join(timeout=0.1)
+        return trained
+
+    def _checkpoint(self, detector, save_model) -> None:
+        # The model goes first: progress must never point past what the saved model has seen
+        if save_model is not None:
+            save_model(detector)
+        self.progress.save()
+
+    def _read(self) -> None:
+        try:
+            # The limit counts records read, including any whose features could not be extracted
+            remaining = self.limit - self.progress.read if self.limit else 0
+            if self.limit and remaining <= 0:
+                return
+            records = self.db.iter_historical_data(after=self.progress.position, fields=LOG_FIELDS,
+                                                   batch_size=self.batch_size, limit=remaining)
+            chunk = []
+            for record in records:
+                if self._stop.is_set():
+                    return
+                chunk.append(record)
+                if len(chunk) >= self.batch_size:
+                    self._put(self._prepare(chunk))
+                    chunk = []
+            if chunk:
+                self._put(self._prepare(chunk))
+        except Exception as e:
+            logger.error("Error reading historical data: %s", e)
+            self._put(e)
+        finally:
+            self._put(_DONE)
+
+    def _put(self, item) -> None:
+        while not self._stop.is_set():
+            try:
+                self._batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _prepare(self, records: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str],
+                                                               Optional[Tuple[str, Any, Any]], int]:
+        """
+        Compute interarrival times, features and heuristic labels for one batch, in record order,
+        along with the position of its last record and the number of records read.
+        """
+        logs, timestamps, interarrivals = [], [], []
+        last_position = None
+        for record in records:
+            if not record or 'source_ip' not in record:
+                continue
+            last_position = (record['source_ip'], record.get('timestamp'), record.get('_id'))
+            try:
+                timestamp = self._parse(record['timestamp'])
+                _, interarrival = compute_interarrival(record, self.ip_state, timestamp)
+            except Exception as e:
+                logger.error("Error reading historical log %s: %s", record.get('_id', 'unknown'), e)
+                continue
+            logs.append(record)
+            timestamps.append(timestamp)
+            interarrivals.append(interarrival)
+
+        features, labels = [], []
+        # The live path adds signature features too, so the bootstrapped model sees the same set
+        hits = [] if self.fe.signature_features else None
+        rows = self.fe.transform_many(logs, timestamps, hits)
+        for i, (row, interarrival) in enumerate(zip(rows, interarrivals)):
+            if row[0] != row[0]:  # NaN row: extraction failed and was already logged
+                continue
+            feature_dict = dict(zip(FEATURE_NAMES, row.tolist()))
+            if hits is not None:
+                feature_dict.update(signature_features(hits[i]))
+            feature_dict['interarrival_time'] = interarrival
+            features.append(feature_dict)
+            labels.append(heuristic_label(feature_dict, interarrival))
+        return features, labels, last_position, len(records)
+
+    @staticmethod
+    def _parse(timestamp) -> datetime:
+        return timestamp if isinstance(timestamp, datetime) else datetime.fromisoformat(timestamp)
+
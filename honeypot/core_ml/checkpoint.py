@@ -0,0 +1,169 @@
+import glob
+import gzip
+import io
+import logging
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from telemetry import MODEL_SNAPSHOT, SAVE_MODEL, stage
+
+logger = logging.getLogger(__name__)
+
+# Lean snapshots are this header followed by the pickled state_dict() of the model. Anything
+# else is a whole pickled (or joblib-dumped) model from before the format existed.
+SNAPSHOT_MAGIC = b'FLYTRAP-SNAPSHOT\n'
+GZIP_MAGIC = b'\x1f\x8b'
+
+def dump_snapshot(model: Any) -> bytes:
+    """
+    Serialize a model, as its learned state only if it has a state_dict().
+    """
+    if hasattr(model, 'state_dict'):
+        return SNAPSHOT_MAGIC + pickle.dumps(model.state_dict(), protocol=pickle.HIGHEST_PROTOCOL)
+    return pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_checkpoint(path: str, restore: Callable[[Dict[str, Any]], Any]) -> Any:
+    """
+    Load a checkpoint written by dump_snapshot (gzipped or not), rebuilding the model with
+    `restore(state)`. Whole-model checkpoints from older versions are still read, through joblib.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(GZIP_MAGIC):
+        data = gzip.decompress(data)
+    if data.startswith(SNAPSHOT_MAGIC):
+        return restore(pickle.loads(data[len(SNAPSHOT_MAGIC):]))
+    # joblib's unpickler is slow and rarely needed, so it is only imported for old checkpoints
+    import joblib
+    return joblib.load(io.BytesIO(data))
+
+class ModelCheckpointer:
+    """
+    Saves model checkpoints without stalling the detection loop.
+    The model is pickled in the caller's thread, which gives a consistent snapshot between
+    events; compression and disk I/O then happen on a background thread. Each checkpoint is
+    written to a temporary file and renamed into place, so a crash never leaves a partial model.
+    The newest checkpoint is always at `path`, and the last `keep` versions are kept beside it.
+    Checkpoints are due every `every_events` events and/or every `every_seconds` seconds.
+    """
+    def __init__(self, path: str, keep: int = 3, compress: int = 0,
+                 every_events: int = 1000, every_seconds: float = 300.0):
+        self.path = path
+        self.keep = keep
+        self.compress = compress
+        self.every_events = every_events
+        self.every_seconds = every_seconds
+        self._events_since = 0
+        self._last_save = time.monotonic()
+        self._sequence = 0
+        self._pending: Optional[bytes] = None
+        self._cond = threading.Condition()
+        self._writing = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="model-checkpointer", daemon=True)
+        self._thread.start()
+
+    def maybe_save(self, model: Any, new_events: int) -> bool:
+        """
+        Count new events and start a checkpoint if one is due. Returns True if it did.
+        """
+        self._events_since += new_events
+        due_by_events = self.every_events > 0 and self._events_since >= self.every_events
+        due_by_time = self.every_seconds > 0 and time.monotonic() - self._last_save >= self.every_seconds
+        if due_by_events or due_by_time:
+            self.save(model)
+            return True
+        return False
+
+    def save(self, model: Any, wait: bool = False) -> None:
+        """
+        Snapshot the model and queue it for writing. If an earlier snapshot is still waiting,
+        it is replaced, since only the newest state matters.
+        """
+        started = time.perf_counter()
+        snapshot = dump_snapshot(model)
+        stage(MODEL_SNAPSHOT).observe(time.perf_counter() - started)
+        self._events_since = 0
+        self._last_save = time.monotonic()
+        with self._cond:
+            self._pending = snapshot
+            self._cond.notify_all()
+        if wait:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Block until every queued checkpoint has been written.
+        """
+        with self._cond:
+            while self._pending is not None or self._writing:
+                self._cond.wait()
+
+    def close(self) -> None:
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                snapshot, self._pending = self._pending, None
+                self._writing = True
+            started = time.perf_counter()
+            try:
+                self._write(snapshot)
+                stage(SAVE_MODEL).observe(time.perf_counter() - started)
+            except Exception as e:
+                logger.error("Failed to save model: %s", str(e))
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _write(self, snapshot: bytes) -> None:
+        started = time.monotonic()
+        data = gzip.compress(snapshot, compresslevel=self.compress) if self.compress else snapshot
+        if self.keep > 0:
+            self._sequence += 1
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            root, ext = os.path.splitext(self.path)
+            version_path = f"{root}-{stamp}-{self._sequence:06d}{ext}"
+            self._atomic_write(version_path, data)
+            self._atomic_write(self.path, data)
+            self._prune()
+        else:
+            self._atomic_write(self.path, data)
+        logger.info("Model saved to %s (%d bytes in %.2fs)", self.path, len(data), time.monotonic() - started)
+
+    @staticmethod
+    def _atomic_write(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def versions(self) -> List[str]:
+        """
+        Versioned checkpoint files, newest first.
+        """
+        root, ext = os.path.splitext(self.path)
+        return sorted(glob.glob(f"{glob.escape(root)}-*-*{ext}"), reverse=True)
+
+    def _prune(self) -> None:
+        for old in self.versions()[self.keep:]:
+            try:
+                os.remove(old)
+            except OSError as e:
+                logger.warning("Could not remove old checkpoint %s: %s", old, e)
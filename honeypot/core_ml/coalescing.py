@@ -0,0 +1,213 @@
+import heapq
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from pipeline import to_epoch
+
+logger = logging.getLogger(__name__)
+
+MODES = ('tumbling', 'session')
+
+class _Window:
+    __slots__ = ('logs', 'first_ts', 'last_ts', 'end_ts', 'deadline', 'opened', 'span_end', 'seq')
+
+    def __init__(self, log: Dict[str, Any], ts: float, opened: float, seq: int):
+        self.logs = [log]
+        # The batch the window's first log came from
+        self.seq = seq
+        self.first_ts = ts
+        self.last_ts = ts
+        self.span_end = ts + (log.get('duration') or 0)
+        self.opened = opened
+        self.end_ts = 0.0
+        self.deadline = 0.0
+
+def merge_logs(logs: List[Dict[str, Any]], first_ts: float, last_ts: float, span_end: float) -> Dict[str, Any]:
+    """
+    One record standing for several from the same source, destination port and protocol.
+    Auth attempts are summed and commands unioned in order; the timestamp is the last event's and
+    the duration covers the whole window. `coalesced_events`, `first_timestamp`, `attempt_rate`
+    (attempts per second) and `mean_interarrival` describe what was merged.
+    """
+    merged = dict(logs[0])
+    failed = success = 0
+    commands: Dict[str, None] = {}
+    for log in logs:
+        attempts = log.get('auth_attempts') or {}
+        failed += attempts.get('failed', 0) or 0
+        success += attempts.get('success', 0) or 0
+        for command in log.get('commands') or []:
+            commands[command] = None
+    duration = max(span_end - first_ts, 0.0)
+    merged.update(
+        timestamp=logs[-1]['timestamp'],
+        first_timestamp=logs[0]['timestamp'],
+        auth_attempts={'failed': failed, 'success': success},
+        commands=list(commands),
+        duration=int(round(duration)),
+        coalesced_events=len(logs),
+        attempt_rate=(failed + success) / max(duration, 1.0),
+        mean_interarrival=(last_ts - first_ts) / (len(logs) - 1),
+    )
+    return merged
+
+class EventCoalescer:
+    """
+    Merges bursts of similar events before they reach the detector.
+    Events are grouped per (source_ip, protocol, destination_port). A 'tumbling' window closes
+    `window` seconds after its first event; a 'session' window closes once its key has been quiet
+    for `window` seconds, or `max_span` seconds after its first event. A window also closes at
+    `max_events` events. Closing is driven by event time (the newest timestamp seen), so replays
+    coalesce the same way at any speed, and by arrival time, so a live window is not held past
+    its deadline while events for other keys keep coming. A closed window becomes one merged
+    record (see merge_logs), or the original record if it holds just one event.
+    Events with commands are never merged: they close their key's window and pass through as-is,
+    so command-bearing sessions keep their own detection. Events without a usable timestamp also
+    pass through.
+    Sources only yield when logs arrive, so an idle caller should call add_many([]) about every
+    `tick_interval` seconds (see sources.idle_ticks) for windows to close on time. Each batch's
+    resume token can be handed to add_many(); committable() then returns the newest one whose
+    logs have all left the coalescer, so a restart never skips logs still held in a window.
+    """
+    def __init__(self, window: float = 5.0, mode: str = 'tumbling', max_span: float = 60.0,
+                 max_events: int = 1000):
+        if mode not in MODES:
+            raise ValueError(f"Unknown coalescing mode '{mode}', expected one of {MODES}")
+        self.window = window
+        self.mode = mode
+        self.max_span = max(max_span, window)
+        self.max_events = max_events
+        self._windows: Dict[Tuple[Any, ...], _Window] = {}
+        # (event-time end, key) and (arrival deadline, key); stale entries are skipped when popped
+        self._by_end: List[Tuple[float, Tuple[Any, ...]]] = []
+        self._by_deadline: List[Tuple[float, Tuple[Any, ...]]] = []
+        self._watermark = float('-inf')
+        # (first batch, key) of open windows, and (batch, token) not yet returned by committable()
+        self._by_seq: List[Tuple[int, Tuple[Any, ...]]] = []
+        self._tokens: Deque[Tuple[int, Any]] = deque()
+        self._seq = 0
+        self.tick_interval = min(1.0, max(window / 4, 0.05))
+        self.stats = {'events_in': 0, 'events_out': 0, 'merged': 0, 'passed_through': 0}
+
+    def pending(self) -> int:
+        return sum(len(w.logs) for w in self._windows.values())
+
+    def add_many(self, logs: List[Dict[str, Any]], now: Optional[float] = None,
+                 token: Any = None) -> List[Dict[str, Any]]:
+        """
+        Add a batch of logs and return the records ready for the detector: pass-through events and
+        every window that has closed. Calling it with an empty batch just closes due windows.
+        `token` is the source position just after the batch, for committable().
+        """
+        now = time.monotonic() if now is None else now
+        out: List[Dict[str, Any]] = []
+        if logs:
+            self._seq += 1
+            if token is not None:
+                self._tokens.append((self._seq, token))
+        for log in logs:
+            self.stats['events_in'] += 1
+            key = (log.get('source_ip'), log.get('protocol'), log.get('destination_port'))
+            try:
+                ts = to_epoch(log['timestamp'])
+            except Exception:
+                self._pass(log, out)
+                continue
+            self._watermark = max(self._watermark, ts)
+            if log.get('commands'):
+                self._close(key, out)
+                self._pass(log, out)
+                continue
+            window = self._windows.get(key)
+            if window is not None and ts >= window.end_ts:
+                # Past the window's end in event time: it closes and this event opens the next one
+                self._close(key, out)
+                window = None
+            if window is None:
+                window = self._windows[key] = _Window(log, ts, now, self._seq)
+                heapq.heappush(self._by_seq, (self._seq, key))
+            else:
+                window.logs.append(log)
+                window.last_ts = max(window.last_ts, ts)
+                window.span_end = max(window.span_end, ts + (log.get('duration') or 0))
+            self._schedule(key, window, now)
+            if self.max_events and len(window.logs) >= self.max_events:
+                self._close(key, out)
+        self._close_due(now, out)
+        return out
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """
+        Close every open window, e.g. at shutdown.
+        """
+        out: List[Dict[str, Any]] = []
+        for key in list(self._windows):
+            self._close(key, out)
+        self._by_end, self._by_deadline, self._by_seq = [], [], []
+        return out
+
+    def committable(self) -> Any:
+        """
+        The newest resume token whose logs have all left the coalescer, or None if there is no new
+        one since the last call.
+        """
+        while self._by_seq:
+            seq, key = self._by_seq[0]
+            window = self._windows.get(key)
+            if window is not None and window.seq == seq:
+                break
+            heapq.heappop(self._by_seq)
+        oldest_open = self._by_seq[0][0] if self._by_seq else self._seq + 1
+        token = None
+        while self._tokens and self._tokens[0][0] < oldest_open:
+            token = self._tokens.popleft()[1]
+        return token
+
+    def summary(self) -> Dict[str, Any]:
+        events_in = self.stats['events_in']
+        return dict(self.stats, open_windows=len(self._windows),
+                    reduction=round(1 - self.stats['events_out'] / events_in, 4) if events_in else 0.0)
+
+    def _schedule(self, key: Tuple[Any, ...], window: _Window, now: float) -> None:
+        if self.mode == 'tumbling':
+            end_ts = window.first_ts + self.window
+            deadline = window.opened + self.window
+        else:
+            end_ts = min(window.last_ts + self.window, window.first_ts + self.max_span)
+            deadline = min(now + self.window, window.opened + self.max_span)
+        if end_ts != window.end_ts:
+            window.end_ts = end_ts
+            heapq.heappush(self._by_end, (end_ts, key))
+        if deadline != window.deadline:
+            window.deadline = deadline
+            heapq.heappush(self._by_deadline, (deadline, key))
+
+    def _close_due(self, now: float, out: List[Dict[str, Any]]) -> None:
+        while self._by_end and self._by_end[0][0] <= self._watermark:
+            end_ts, key = heapq.heappop(self._by_end)
+            window = self._windows.get(key)
+            if window is not None and window.end_ts == end_ts:
+                self._close(key, out)
+        while self._by_deadline and self._by_deadline[0][0] <= now:
+            deadline, key = heapq.heappop(self._by_deadline)
+            window = self._windows.get(key)
+            if window is not None and window.deadline == deadline:
+                self._close(key, out)
+
+    def _close(self, key: Tuple[Any, ...], out: List[Dict[str, Any]]) -> None:
+        window = self._windows.pop(key, None)
+        if window is None:
+            return
+        if len(window.logs) == 1:
+            out.append(window.logs[0])
+        else:
+            out.append(merge_logs(window.logs, window.first_ts, window.last_ts, window.span_end))
+            self.stats['merged'] += len(window.logs)
+        self.stats['events_out'] += 1
+
+    def _pass(self, log: Dict[str, Any], out: List[Dict[str, Any]]) -> None:
+        out.append(log)
+        self.stats['passed_through'] += 1
+        self.stats['events_out'] += 1
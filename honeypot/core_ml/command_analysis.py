@@ -0,0 +1,237 @@
+import logging
+import os
+import shlex
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIGNATURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'command_signatures.txt')
+
+# Tokens that end one simple command and start the next
+_SEPARATORS = {'|', '||', '&&', ';', '&', '(', ')', '|&', ';;'}
+_REDIRECTS = {'>', '>>', '<', '<<', '<<<', '>&', '<&', '&>', '&>>', '>|'}
+# Programs that run the command given after them, and shells whose -c script is a command line
+_WRAPPERS = {'sudo', 'nohup', 'env', 'timeout', 'nice', 'xargs', 'busybox', 'exec', 'command', 'time', 'doas'}
+_SHELLS = {'sh', 'bash', 'dash', 'zsh', 'ash', 'ksh'}
+# Wrapper options that take the next word as their value, which is not the wrapped command
+_WRAPPER_VALUE_OPTIONS = {
+    'sudo': {'-u', '-g', '-h', '-p', '-r', '-t', '-C', '-D', '-T', '-U', '--user', '--group', '--host',
+             '--prompt', '--role', '--type', '--close-from', '--chdir', '--command-timeout', '--other-user'},
+    'doas': {'-u', '-C'},
+    'env': {'-u', '-C', '-S', '--unset', '--chdir', '--split-string'},
+    'nice': {'-n', '--adjustment'},
+    'timeout': {'-s', '-k', '--signal', '--kill-after'},
+    'xargs': {'-a', '-d', '-E', '-I', '-L', '-n', '-P', '-s', '--arg-file', '--delimiter', '--max-args',
+              '--max-lines', '--max-procs', '--max-chars'},
+    'time': {'-f', '-o', '--format', '--output'},
+}
+# Plain arguments a wrapper takes before the command, e.g. the duration of `timeout 10 cmd`
+_WRAPPER_ARGUMENTS = {'timeout': 1}
+_MAX_DEPTH = 3
+
+def _lex(command: str) -> List[str]:
+    lexer = shlex.shlex(command.replace('`', ' ; '), posix=True, punctuation_chars=';&|()<>')
+    lexer.whitespace_split = True
+    try:
+        return list(lexer)
+    except ValueError:
+        # Unbalanced quotes are common in attacker input; fall back to plain words
+        return command.replace('`', ' ; ').split()
+
+def tokenize(command: str, depth: int = 0) -> List[List[str]]:
+    """
+    Split a shell command line into the argument lists of its simple commands, across pipes,
+    `;`/`&&`/`||` chains, subshells and backticks. Redirection targets are dropped, and the
+    script of `sh -c '...'` (and other shells) is tokenized in turn.
+    """
+    commands: List[List[str]] = []
+    argv: List[str] = []
+    tokens = _lex(command)
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in _SEPARATORS or token == '$':
+            if argv:
+                commands.append(argv)
+                argv = []
+        elif token in _REDIRECTS:
+            # The next token is a file name, not an argument
+            i += 1
+        else:
+            argv.append(token)
+        i += 1
+    if argv:
+        commands.append(argv)
+    if depth < _MAX_DEPTH:
+        for argv in list(commands):
+            if os.path.basename(argv[0]) in _SHELLS and '-c' in argv[1:-1]:
+                commands.extend(tokenize(argv[argv.index('-c') + 1], depth + 1))
+    return commands
+
+class Signature(NamedTuple):
+    """
+    A rule: `program` signatures match a command name, `substring` ones any text in the command line.
+    """
+    name: str
+    kind: str
+    pattern: str
+
+def load_signatures(path: str) -> List[Signature]:
+    """
+    Read a signature file. Each non-blank line not starting with `#` is `kind:pattern` or
+    `kind:pattern<TAB>name`, with kind `program` or `substring`; a line without a known kind
+    is a substring. Substrings are matched case-insensitively.
+    """
+    signatures = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.rstrip('\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            rule, _, name = line.partition('\t')
+            kind, sep, pattern = rule.partition(':')
+            if not sep or kind not in ('program', 'substring'):
+                kind, pattern = 'substring', rule
+            if not pattern:
+                logger.warning("Skipping empty signature on line %d of %s", number, path)
+                continue
+            signatures.append(Signature(name or f"{kind}:{pattern}", kind, pattern))
+    return signatures
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher: every pattern is found in one pass over the text, so the
+    cost per text depends on its length and the matches, not on the number of patterns.
+    """
+    def __init__(self, patterns: Iterable[Tuple[str, int]]):
+        # Trie as parallel lists: goto[state] maps a character to the next state
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        for pattern, value in patterns:
+            state = 0
+            for char in pattern:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (value,)
+        # Breadth-first failure links; outputs of the fallback state are merged in
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def search(self, text: str) -> List[int]:
+        """
+        Values of every pattern occurrence in `text` (repeated for repeated occurrences).
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        found: List[int] = []
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.extend(out[state])
+        return found
+
+class CommandMatch(NamedTuple):
+    suspicious: int
+    hits: Counter
+
+class CommandAnalyzer:
+    """
+    Matches attacker commands against a signature set. Each command line is tokenized into its
+    simple commands; program signatures are looked up by command name (also behind sudo, env,
+    busybox and similar wrappers), and substring signatures are found by one Aho-Corasick pass
+    over the lower-cased command line. `hit_counts` accumulates per-signature hits over the
+    analyzer's lifetime.
+    """
+    def __init__(self, signatures: List[Signature]):
+        self.signatures = signatures
+        self._programs: Dict[str, List[int]] = {}
+        substrings = []
+        for i, signature in enumerate(signatures):
+            if signature.kind == 'program':
+                self._programs.setdefault(signature.pattern, []).append(i)
+            else:
+                substrings.append((signature.pattern.lower(), i))
+        self._matcher = AhoCorasick(substrings)
+        self.hit_counts: Counter = Counter()
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> 'CommandAnalyzer':
+        path = path or DEFAULT_SIGNATURES
+        signatures = load_signatures(path)
+        logger.info("Loaded %d command signatures from %s", len(signatures), path)
+        return cls(signatures)
+
+    def match(self, command: str) -> Counter:
+        """
+        Per-signature hit counts for one command line.
+        """
+        hits: Counter = Counter()
+        if not isinstance(command, str) or not command.strip():
+            return hits
+        for argv in tokenize(command):
+            wrapper = None
+            skip = arguments = 0
+            for word in argv:
+                if skip:
+                    skip -= 1
+                    continue
+                if wrapper is not None:
+                    # Behind a wrapper, skip its options (and their values), env-style assignments
+                    # and leading arguments, up to the command it runs
+                    if word in _WRAPPER_VALUE_OPTIONS.get(wrapper, ()):
+                        skip = 1
+                        continue
+                    if word.startswith('-') or '=' in word:
+                        continue
+                    if arguments:
+                        arguments -= 1
+                        continue
+                name = os.path.basename(word)
+                for i in self._programs.get(name, ()):
+                    hits[self.signatures[i].name] += 1
+                if name not in _WRAPPERS:
+                    break
+                wrapper = name
+                arguments = _WRAPPER_ARGUMENTS.get(name, 0)
+        for i in self._matcher.search(command.lower()):
+            hits[self.signatures[i].name] += 1
+        return hits
+
+    def analyze(self, commands: Iterable[str]) -> CommandMatch:
+        """
+        Number of commands matching at least one signature, and the summed hits of all of them.
+        """
+        suspicious = 0
+        hits: Counter = Counter()
+        for command in commands or ():
+            command_hits = self.match(command)
+            if command_hits:
+                suspicious += 1
+                hits.update(command_hits)
+        if hits:
+            self.hit_counts.update(hits)
+        return CommandMatch(suspicious, hits)
+
+    def top_signatures(self, n: int = 10) -> List[Tuple[str, int]]:
+        return self.hit_counts.most_common(n)
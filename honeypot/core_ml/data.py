@@ -2,8 +2,11 @@ import logging
 from pymongo import MongoClient, ASCENDING, DESCENDING
 from dotenv import load_dotenv
 import os
+import time
 import certifi
 
+from feature_schema import LOG_FIELDS
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -37,6 +40,13 @@ class MongoDBHandler:
                 name="ip_time_index",
                 background=True
             )
+            # Adds _id as a tiebreaker, so a resumed bootstrap can continue between records
+            # of one IP that share a timestamp
+            self.db.records.create_index(
+                [("source_ip", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+                name="ip_time_id_index",
+                background=True
+            )
             logger.info("Indexes created on records collection.")
         except Exception as e:
             logger.error(f"Error creating indexes: {e}")
@@ -48,15 +58,100 @@ class MongoDBHandler:
             logger.error(f"Error fetching historical data: {e}")
             return []
 
-    def stream_logs(self, resume_token=None):
+    def iter_historical_data(self, after=None, fields=None, batch_size=1000, limit=0):
+        """
+        Stream historical records in ip_time_id_index order: grouped by source IP, oldest first
+        within each IP, which is the order per-IP interarrival times need. The cursor fetches
+        batch_size documents per round-trip and only the given fields. `after` is a
+        (source_ip, timestamp, _id) position to resume from; records up to and including it are
+        skipped. Records of one IP with the same timestamp are ordered by _id, so none are skipped
+        when a run stops between them.
+        """
+        query = {}
+        if after is not None:
+            ip, timestamp, record_id = after
+            later = [
+                {'source_ip': {'$lt': ip}},
+                {'source_ip': ip, 'timestamp': {'$gt': timestamp}},
+            ]
+            if record_id is not None:
+                later.append({'source_ip': ip, 'timestamp': timestamp, '_id': {'$gt': record_id}})
+            query = {'$or': later}
+        projection = dict.fromkeys(fields, 1) if fields else None
+        # The exact reverse of the index order, so the sort is served by the index without a scan
+        cursor = (self.db.records.find(query, projection)
+                  .sort([("source_ip", DESCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)])
+                  .hint("ip_time_id_index")
+                  .batch_size(batch_size))
+        if limit:
+            cursor = cursor.limit(limit)
         try:
-            with self.db.records.watch(resume_after=resume_token) as stream:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _change_pipeline(fields):
+        # Filter and trim change events on the server: only inserts, and only the fields we read.
+        # The event _id is the resume token, so it is always kept.
+        pipeline = [{'$match': {'operationType': 'insert'}}]
+        if fields:
+            projection = {'operationType': 1, 'fullDocument._id': 1}
+            projection.update({f'fullDocument.{field}': 1 for field in fields})
+            pipeline.append({'$project': projection})
+        return pipeline
+
+    def stream_logs(self, resume_token=None, batch_size=None, max_await_ms=None, fields=LOG_FIELDS):
+        """
+        Yield inserted records from the change stream as {'log', 'token'}, projected to `fields`.
+        batch_size and max_await_ms tune each server round-trip (None leaves the server defaults).
+        """
+        try:
+            with self.db.records.watch(self._change_pipeline(fields), resume_after=resume_token,
+                                       batch_size=batch_size, max_await_time_ms=max_await_ms) as stream:
                 for change in stream:
                     yield {'log': change['fullDocument'], 'token': stream.resume_token}
         except Exception as e:
             logger.error(f"Error streaming logs: {e}")
             raise
 
+    def stream_log_batches(self, resume_token=None, batch_size=100, max_linger=0.5, max_await_ms=None,
+                           fields=LOG_FIELDS):
+        """
+        Yield lists of up to batch_size changes, in the same {'log', 'token'} form as stream_logs.
+        A partial batch is yielded once its oldest change has waited max_linger seconds.
+        max_await_ms bounds each server round-trip; by default it follows max_linger, and a larger
+        value can hold a partial batch back by up to that long. A round-trip that returns nothing
+        while no batch is pending yields an empty list, so an idle stream still yields regularly.
+        """
+        if max_await_ms is None:
+            # Bound each server round-trip by the linger so partial batches are not held back
+            max_await_ms = max(1, min(1000, int(max_linger * 1000)))
+        try:
+            # One change per round-trip would be slow, so batches of one leave the cursor batch to the server
+            with self.db.records.watch(self._change_pipeline(fields), resume_after=resume_token,
+                                       batch_size=batch_size if batch_size > 1 else None,
+                                       max_await_time_ms=max_await_ms) as stream:
+                batch = []
+                deadline = None
+                while stream.alive:
+                    change = stream.try_next()
+                    if change is not None:
+                        batch.append({'log': change['fullDocument'], 'token': stream.resume_token})
+                        if deadline is None:
+                            deadline = time.monotonic() + max_linger
+                    if batch and (len(batch) >= batch_size or time.monotonic() >= deadline):
+                        yield batch
+                        batch = []
+                        deadline = None
+                    elif change is None and not batch:
+                        yield []
+                if batch:
+                    yield batch
+        except Exception as e:
+            logger.error(f"Error streaming log batches: {e}")
+            raise
+
 if __name__ == "__main__":
     try:
         db_handler = MongoDBHandler()
@@ -0,0 +1,254 @@
+import atexit
+import heapq
+import ipaddress
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Actions from ResponseEngine that are enforced
+TEMP_BLOCK = 'temp_block'
+PERM_BLOCK = 'perm_block'
+
+_STOP = object()
+
+class Block(NamedTuple):
+    """
+    A network to block, for `timeout` seconds or permanently if it is None.
+    """
+    network: str
+    timeout: Optional[int]
+
+class BlockBackend:
+    """
+    Where block-list updates go. apply() receives everything that changed since the last call.
+    """
+    def apply(self, adds: List[Block], removes: List[str]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+class MemoryBlockBackend(BlockBackend):
+    """
+    Keeps the block list in memory, e.g. for tests and replays. `updates` counts apply() calls.
+    """
+    def __init__(self):
+        self.blocked: Dict[str, Optional[int]] = {}
+        self.updates = 0
+
+    def apply(self, adds: List[Block], removes: List[str]) -> None:
+        self.updates += 1
+        for network in removes:
+            self.blocked.pop(network, None)
+        for block in adds:
+            self.blocked[block.network] = block.timeout
+
+class FileBlockBackend(BlockBackend):
+    """
+    Writes each update as its own file of firewall commands, `<path>.<seq>`, ready for
+    `ipset -exist restore < file` or `nft -f file`. Files are numbered in write order (zero-padded,
+    so they sort by name) and appear atomically; the consumer applies them in order and deletes each
+    one it has applied, so a block is only ever loaded once and temp blocks expire on time.
+    Numbering continues after the highest file left over from an earlier run.
+    Temporary and permanent blocks go to separate sets, `<set_name>_temp` and `<set_name>_perm`
+    (`<set_name>6_...` for IPv6), which must exist; temp sets need timeout support, so the kernel
+    expires their entries itself and expiries are not written.
+    """
+    def __init__(self, path: str, set_name: str = 'flytrap'):
+        self.path = path
+        self.set_name = set_name
+        self.lines_written = 0
+        self.files_written = 0
+        self._seq = self._last_seq()
+
+    def _last_seq(self) -> int:
+        directory, prefix = os.path.split(os.path.abspath(self.path))
+        prefix += '.'
+        seqs = [int(name[len(prefix):]) for name in os.listdir(directory)
+                if name.startswith(prefix) and name[len(prefix):].isdigit()]
+        return max(seqs, default=0)
+
+    def set_for(self, block: Block) -> str:
+        family = '6' if ':' in block.network else ''
+        return f"{self.set_name}{family}_{'perm' if block.timeout is None else 'temp'}"
+
+    def apply(self, adds: List[Block], removes: List[str]) -> None:
+        if not adds:
+            return
+        lines = [self._format(block) for block in adds]
+        self._seq += 1
+        path = f"{self.path}.{self._seq:010d}"
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("".join(line + "\n" for line in lines))
+        os.replace(tmp_path, path)
+        self.lines_written += len(lines)
+        self.files_written += 1
+
+    def _format(self, block: Block) -> str:
+        raise NotImplementedError
+
+class IpsetFileBackend(FileBlockBackend):
+    """
+    ipset restore format, e.g. `add flytrap_temp 198.51.100.7/32 timeout 600`.
+    """
+    def _format(self, block: Block) -> str:
+        timeout = f" timeout {block.timeout}" if block.timeout is not None else ""
+        return f"add {self.set_for(block)} {block.network}{timeout}"
+
+class NftFileBackend(FileBlockBackend):
+    """
+    nftables script format, e.g. `add element inet filter flytrap_temp { 198.51.100.7/32 timeout 600s }`.
+    The sets live in `table` (default `inet filter`) and need the interval flag for CIDR entries.
+    """
+    def __init__(self, path: str, set_name: str = 'flytrap', table: str = 'inet filter'):
+        super().__init__(path, set_name)
+        self.table = table
+
+    def _format(self, block: Block) -> str:
+        timeout = f" timeout {block.timeout}s" if block.timeout is not None else ""
+        return f"add element {self.table} {self.set_for(block)} {{ {block.network}{timeout} }}"
+
+BACKENDS = {
+    'memory': MemoryBlockBackend,
+    'ipset': IpsetFileBackend,
+    'nft': NftFileBackend,
+}
+
+def create_backend(name: str, **kwargs) -> BlockBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown enforcement backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
+
+class EnforcementEngine:
+    """
+    Turns temp_block/perm_block actions into block-list updates for a BlockBackend.
+    Source IPs are widened to their /prefix_v4 or /prefix_v6 network, and a network that is already
+    blocked is not blocked again: a brute-force source repeating temp_block thousands of times a
+    minute costs one entry until its block expires. A perm_block upgrades a temporary block.
+    Temporary blocks expire after `temp_block_seconds`, tracked in a heap. Changes are collected for
+    `window` seconds and applied in one backend call by a background thread, so the detection loop
+    never waits on the backend. close() applies everything pending and is also run at exit.
+    """
+    def __init__(self, backend: BlockBackend, window: float = 1.0, temp_block_seconds: int = 600,
+                 prefix_v4: int = 32, prefix_v6: int = 128):
+        self.backend = backend
+        self.window = window
+        self.temp_block_seconds = temp_block_seconds
+        self.prefix_v4 = prefix_v4
+        self.prefix_v6 = prefix_v6
+        # network -> expiry (monotonic seconds), or None for permanent blocks
+        self.active: Dict[str, Optional[float]] = {}
+        self._expiries: List[Tuple[float, str]] = []
+        self._adds: Dict[str, Block] = {}
+        self._removes: Dict[str, None] = {}
+        self.stats = {'actions': 0, 'coalesced': 0, 'added': 0, 'expired': 0, 'updates': 0}
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="enforcement", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, ip: str, actions: Iterable[str]) -> None:
+        self.submit_many([(ip, actions)])
+
+    def submit_many(self, decisions: List[Tuple[str, Iterable[str]]]) -> None:
+        """
+        Queue (ip, actions) decisions; those without a block action are ignored.
+        """
+        blocks = [(ip, PERM_BLOCK if PERM_BLOCK in actions else TEMP_BLOCK)
+                  for ip, actions in decisions if TEMP_BLOCK in actions or PERM_BLOCK in actions]
+        if blocks:
+            self._queue.put(blocks)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self.backend.close()
+        logger.info("Enforcement stopped: %s", self.summary())
+
+    def summary(self) -> Dict[str, Any]:
+        return dict(self.stats, active=len(self.active))
+
+    def network_for(self, ip: str) -> str:
+        address = ipaddress.ip_address(ip)
+        prefix = self.prefix_v4 if address.version == 4 else self.prefix_v6
+        return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+    def _block(self, ip: str, action: str, now: float) -> None:
+        self.stats['actions'] += 1
+        try:
+            network = self.network_for(ip)
+        except ValueError:
+            logger.warning("Not enforcing %s for invalid IP %r", action, ip)
+            return
+        permanent = action == PERM_BLOCK
+        if network in self.active and (self.active[network] is None or not permanent):
+            self.stats['coalesced'] += 1
+            return
+        if permanent:
+            self.active[network] = None
+            self._adds[network] = Block(network, None)
+        else:
+            expiry = now + self.temp_block_seconds
+            self.active[network] = expiry
+            heapq.heappush(self._expiries, (expiry, network))
+            self._adds[network] = Block(network, self.temp_block_seconds)
+        self._removes.pop(network, None)
+        self.stats['added'] += 1
+
+    def _expire(self, now: float) -> None:
+        while self._expiries and self._expiries[0][0] <= now:
+            expiry, network = heapq.heappop(self._expiries)
+            # Skip entries superseded by a perm_block or a later temp_block
+            if self.active.get(network) != expiry:
+                continue
+            del self.active[network]
+            if self._adds.pop(network, None) is None:
+                self._removes[network] = None
+            self.stats['expired'] += 1
+
+    def _flush(self) -> None:
+        if not self._adds and not self._removes:
+            return
+        adds, removes = list(self._adds.values()), list(self._removes)
+        self._adds, self._removes = {}, {}
+        try:
+            self.backend.apply(adds, removes)
+            self.stats['updates'] += 1
+            logger.debug("Applied %d blocks and %d expiries", len(adds), len(removes))
+        except Exception as e:
+            logger.error("Error applying %d blocks and %d expiries: %s", len(adds), len(removes), e)
+
+    def _run(self) -> None:
+        deadline = None
+        while True:
+            now = time.monotonic()
+            wake = [t for t in (deadline, self._expiries[0][0] if self._expiries else None) if t is not None]
+            timeout = max(0.0, min(wake) - now) if wake else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            now = time.monotonic()
+            if item is _STOP:
+                self._expire(now)
+                self._flush()
+                return
+            if item is not None:
+                for ip, action in item:
+                    self._block(ip, action, now)
+            self._expire(now)
+            if (self._adds or self._removes) and deadline is None:
+                deadline = now + self.window
+            if deadline is not None and now >= deadline:
+                self._flush()
+                deadline = None
@@ -0,0 +1,63 @@
+import math
+from array import array
+from typing import Dict, Iterable, Iterator, Tuple
+
+# Column order of every feature vector produced by FeatureExtractor
+FEATURE_NAMES: Tuple[str, ...] = (
+    'hour_of_day', 'hour_sin', 'hour_cos', 'is_night',
+    'day_of_week', 'day_sin', 'day_cos',
+    'failed_logins', 'success_logins', 'login_attempt_ratio',
+    'session_duration', 'unique_commands', 'total_commands',
+    'suspicious_command_count', 'proportion_suspicious_commands', 'command_entropy',
+    'ip_reputation', 'country_risk', 'commands_per_minute',
+)
+FEATURE_INDEX: Dict[str, int] = {name: i for i, name in enumerate(FEATURE_NAMES)}
+
+# Fields of a log record that feature extraction, labelling and coalescing read
+LOG_FIELDS: Tuple[str, ...] = ('source_ip', 'timestamp', 'auth_attempts', 'commands', 'duration',
+                               'protocol', 'destination_port')
+
+# Cyclical encodings for every possible hour and weekday, computed once
+HOUR_SIN = tuple(math.sin(2 * math.pi * h / 24) for h in range(24))
+HOUR_COS = tuple(math.cos(2 * math.pi * h / 24) for h in range(24))
+DAY_SIN = tuple(math.sin(2 * math.pi * d / 7) for d in range(7))
+DAY_COS = tuple(math.cos(2 * math.pi * d / 7) for d in range(7))
+IS_NIGHT = tuple(int(h >= 22 or h < 4) for h in range(24))
+
+def signature_features(hits: Dict[str, int]) -> Dict[str, int]:
+    """
+    Optional extra features after FEATURE_NAMES: each matched command signature's hit count, as 'sig:<name>'.
+    """
+    return {f"sig:{name}": count for name, count in hits.items()}
+
+class FeatureVector:
+    """
+    Compact feature vector in FEATURE_NAMES order, backed by a flat array of doubles.
+    Supports read-only mapping access by feature name; use to_dict() where a river model
+    needs a plain dict.
+    """
+    __slots__ = ('values',)
+
+    def __init__(self, values: Iterable[float]):
+        self.values = array('d', values)
+
+    def __getitem__(self, name: str) -> float:
+        return self.values[FEATURE_INDEX[name]]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(FEATURE_NAMES)
+
+    def keys(self) -> Tuple[str, ...]:
+        return FEATURE_NAMES
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        return zip(FEATURE_NAMES, self.values)
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(zip(FEATURE_NAMES, self.values))
+
+    def __repr__(self) -> str:
+        return f"FeatureVector({self.to_dict()})"
@@ -0,0 +1,102 @@
+import ipaddress
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import maxminddb
+
+logger = logging.getLogger(__name__)
+
+# Reader open modes: 'memory' loads the whole database into RAM, 'mmap' maps it from disk
+OPEN_MODES = {
+    'auto': maxminddb.MODE_AUTO,
+    'mmap_ext': maxminddb.MODE_MMAP_EXT,
+    'mmap': maxminddb.MODE_MMAP,
+    'file': maxminddb.MODE_FILE,
+    'memory': maxminddb.MODE_MEMORY,
+}
+
+GeoResult = Optional[Tuple[Optional[str], Optional[str]]]
+
+# Cache marker for lookups that have not been made, as None is a valid (not found) result
+_ABSENT = object()
+
+class GeoIPCache:
+    """
+    Bounded LRU cache in front of a MaxMind City database.
+    Lookups return (country ISO code, city name), or None for addresses not in the database.
+    Each database answer covers a whole network, so results are cached both per IP and per
+    returned network prefix: once one address in a network (typically a /24 or wider) has been
+    resolved, every other address in it is served without touching the reader.
+    """
+    def __init__(self, db_path: str, mode: str = 'auto', max_entries: int = 65536):
+        if mode not in OPEN_MODES:
+            raise ValueError(f"Unknown GeoIP open mode '{mode}', expected one of {sorted(OPEN_MODES)}")
+        self.reader = maxminddb.open_database(db_path, OPEN_MODES[mode])
+        self.max_entries = max_entries
+        self._by_ip = OrderedDict()
+        self._by_network = OrderedDict()
+        # Prefix lengths seen so far, per IP version; the database uses only a handful of them
+        self._prefix_lengths = {4: set(), 6: set()}
+        self.hits = 0
+        self.network_hits = 0
+        self.misses = 0
+
+    def lookup(self, ip: str) -> GeoResult:
+        """
+        Resolve an IP, raising ValueError if it is not a valid address.
+        """
+        cached = self._by_ip.get(ip, _ABSENT)
+        if cached is not _ABSENT:
+            self._by_ip.move_to_end(ip)
+            self.hits += 1
+            return cached
+
+        addr = ipaddress.ip_address(ip)
+        value = int(addr)
+        bits = addr.max_prefixlen
+        for prefix_len in self._prefix_lengths[addr.version]:
+            key = (addr.version, prefix_len, value >> (bits - prefix_len))
+            cached = self._by_network.get(key, _ABSENT)
+            if cached is not _ABSENT:
+                self._by_network.move_to_end(key)
+                self.network_hits += 1
+                self._remember(self._by_ip, ip, cached)
+                return cached
+
+        record, prefix_len = self.reader.get_with_prefix_len(addr)
+        result = self._summarize(record)
+        self.misses += 1
+        self._remember(self._by_ip, ip, result)
+        self._prefix_lengths[addr.version].add(prefix_len)
+        self._remember(self._by_network, (addr.version, prefix_len, value >> (bits - prefix_len)), result)
+        return result
+
+    @staticmethod
+    def _summarize(record: Optional[dict]) -> GeoResult:
+        # Keep only the two fields we use instead of the full nested record
+        if not record:
+            return None
+        country = (record.get('country') or {}).get('iso_code')
+        city = ((record.get('city') or {}).get('names') or {}).get('en')
+        return country, city
+
+    def _remember(self, cache: OrderedDict, key, value: GeoResult) -> None:
+        cache[key] = value
+        if len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.network_hits + self.misses
+        return {
+            'lookups': lookups,
+            'ip_hits': self.hits,
+            'network_hits': self.network_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.network_hits) / lookups if lookups else 0.0,
+            'cached_ips': len(self._by_ip),
+            'cached_networks': len(self._by_network),
+        }
+
+    def close(self) -> None:
+        self.reader.close()
@@ -0,0 +1,320 @@
+import argparse
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import socket
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b'FLYTRAP-IPREP\x00\x00\x01'
+# Magic, IPv4 and IPv6 interval counts, source fingerprint
+_HEADER = struct.Struct('<16sQQ16s')
+_HEADER_SIZE = 64
+_MASK64 = (1 << 64) - 1
+
+Interval = Tuple[int, int, float]
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+def source_files(sources: List[str]) -> List[str]:
+    """
+    The list files named by `sources`; a directory stands for every file directly inside it.
+    """
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files.extend(sorted(os.path.join(source, name) for name in os.listdir(source)
+                                if os.path.isfile(os.path.join(source, name)) and not name.startswith('.')))
+        elif os.path.exists(source):
+            files.append(source)
+        else:
+            logger.warning("IP reputation source %s does not exist", source)
+    return files
+
+def fingerprint(files: List[str]) -> bytes:
+    """
+    Identifies a set of list files by path, size and modification time, so a compiled index can
+    tell whether it is still current without reading them.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in files:
+        st = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return digest.digest()
+
+def parse_network(text: str) -> Tuple[int, int, int]:
+    """
+    (IP version, first address, last address) of an address or CIDR network, as integers.
+    """
+    address, _, prefix = text.partition('/')
+    if ':' not in address:
+        # inet_aton accepts forms like '10.1' that are not addresses
+        if address.count('.') != 3:
+            raise ValueError(f"Invalid IPv4 address {address!r}")
+        start = int.from_bytes(socket.inet_aton(address), 'big')
+        bits, version = 32, 4
+    else:
+        start = int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+        bits, version = 128, 6
+    length = int(prefix) if prefix else bits
+    if not 0 <= length <= bits:
+        raise ValueError(f"Invalid prefix length in {text!r}")
+    host_bits = bits - length
+    start = (start >> host_bits) << host_bits
+    return version, start, start + (1 << host_bits) - 1
+
+def read_list(path: str, intervals: Dict[int, List[Interval]], default_score: float = 1.0) -> int:
+    """
+    Add the networks of one list file to `intervals` and return how many were read.
+    Each line is an address or CIDR network, optionally followed by a score in [0, 1]
+    (default `default_score`). Anything after `#` or `;` is a comment, as in most public
+    blocklists (e.g. Spamhaus DROP, FireHOL).
+    """
+    count = 0
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split(';', 1)[0].split()
+            if not fields:
+                continue
+            try:
+                version, start, end = parse_network(fields[0])
+                score = min(max(float(fields[1]), 0.0), 1.0) if len(fields) > 1 else default_score
+            except (OSError, ValueError):
+                logger.debug("Skipping invalid entry on line %d of %s: %r", number, path, line.strip())
+                continue
+            intervals[version].append((start, end, score))
+            count += 1
+    return count
+
+def flatten(intervals: List[Interval]) -> List[Interval]:
+    """
+    Sorted, non-overlapping intervals covering the same addresses, where overlapping entries take
+    the highest score and adjacent ones with equal scores are merged.
+    """
+    intervals.sort()
+    out: List[Interval] = []
+    active: List[Tuple[float, int]] = []  # (-score, end)
+    i, n = 0, len(intervals)
+    position = 0
+    while i < n or active:
+        if not active:
+            position = intervals[i][0]
+        while i < n and intervals[i][0] <= position:
+            start, end, score = intervals[i]
+            heapq.heappush(active, (-score, end))
+            i += 1
+        while active and active[0][1] < position:
+            heapq.heappop(active)
+        if not active:
+            continue
+        score, end = -active[0][0], active[0][1]
+        if i < n:
+            end = min(end, intervals[i][0] - 1)
+        if out and out[-1][1] == position - 1 and out[-1][2] == score:
+            out[-1] = (out[-1][0], end, score)
+        else:
+            out.append((position, end, score))
+        position = end + 1
+    return out
+
+def compile_index(sources: List[str], path: str, default_score: float = 1.0) -> Dict[str, int]:
+    """
+    Read the list files in `sources` and write the compiled index to `path`, atomically.
+    The index holds, per IP version, the interval starts, ends and scores as flat arrays
+    (IPv6 addresses split into high and low 64-bit halves), ready to be memory-mapped.
+    """
+    files = source_files(sources)
+    intervals: Dict[int, List[Interval]] = {4: [], 6: []}
+    entries = sum(read_list(file, intervals, default_score) for file in files)
+    v4, v6 = flatten(intervals[4]), flatten(intervals[6])
+    sections = [
+        array('I', [s for s, _, _ in v4]), array('I', [e for _, e, _ in v4]), array('f', [sc for _, _, sc in v4]),
+        array('Q', [s >> 64 for s, _, _ in v6]), array('Q', [s & _MASK64 for s, _, _ in v6]),
+        array('Q', [e >> 64 for _, e, _ in v6]), array('Q', [e & _MASK64 for _, e, _ in v6]),
+        array('f', [sc for _, _, sc in v6]),
+    ]
+    # Per-process name, as detector shards may compile the same index at once
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(INDEX_MAGIC, len(v4), len(v6), fingerprint(files)).ljust(_HEADER_SIZE, b'\0'))
+        for section in sections:
+            if sys.byteorder != 'little':
+                section.byteswap()
+            data = section.tobytes()
+            f.write(data + b'\0' * (_pad8(len(data)) - len(data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.info("Compiled IP reputation index %s: %d entries from %d files -> %d IPv4 and %d IPv6 ranges",
+                path, entries, len(files), len(v4), len(v6))
+    return {'files': len(files), 'entries': entries, 'ipv4_ranges': len(v4), 'ipv6_ranges': len(v6)}
+
+class ReputationIndex:
+    """
+    A compiled index, memory-mapped read-only. Lookups are a binary search over the mapped arrays,
+    so opening costs nothing per entry and the pages are shared between processes.
+    """
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n4, n6, self.fingerprint = _HEADER.unpack_from(self._mmap)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not an IP reputation index")
+        if sys.byteorder != 'little':
+            raise ValueError("IP reputation indexes are little-endian; rebuild them on this host")
+        self.path = path
+        self.size = n4 + n6
+        view = memoryview(self._mmap)
+        offset = _HEADER_SIZE
+        sections = []
+        for count, fmt, width in ((n4, 'I', 4), (n4, 'I', 4), (n4, 'f', 4),
+                                  (n6, 'Q', 8), (n6, 'Q', 8), (n6, 'Q', 8), (n6, 'Q', 8), (n6, 'f', 4)):
+            sections.append(view[offset:offset + count * width].cast(fmt))
+            offset += _pad8(count * width)
+        if offset > len(self._mmap):
+            raise ValueError(f"{path} is truncated")
+        (self._v4_starts, self._v4_ends, self._v4_scores,
+         self._v6_start_hi, self._v6_start_lo, self._v6_end_hi, self._v6_end_lo, self._v6_scores) = sections
+
+    def lookup(self, ip: str) -> Optional[float]:
+        """
+        Score of the range containing `ip`, or None if it is not listed. Raises ValueError
+        (or OSError) for invalid addresses.
+        """
+        if ':' not in ip:
+            value = int.from_bytes(socket.inet_aton(ip), 'big')
+            i = bisect_right(self._v4_starts, value) - 1
+            if i >= 0 and value <= self._v4_ends[i]:
+                return self._v4_scores[i]
+            return None
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+        hi, lo = value >> 64, value & _MASK64
+        # Starts with a smaller high half come first; among equal ones, compare the low halves
+        right = bisect_right(self._v6_start_hi, hi)
+        left = bisect_left(self._v6_start_hi, hi, 0, right)
+        i = bisect_right(self._v6_start_lo, lo, left, right) - 1
+        if i >= 0 and (hi, lo) <= (self._v6_end_hi[i], self._v6_end_lo[i]):
+            return self._v6_scores[i]
+        return None
+
+class IPReputation:
+    """
+    IP reputation scores from local blocklists, for the ip_reputation feature.
+    The lists in `sources` are compiled into an index at `index_path` (see compile_index) the first
+    time, and again whenever they change; otherwise startup just maps the existing index. A daemon
+    thread checks the lists every `reload_interval` seconds, recompiles the index if they changed,
+    and swaps the new one in with a single reference assignment, so lookups never see a partly
+    built index. An index replaced by another process (e.g. `python ip_reputation.py compile`)
+    is picked up the same way. Unlisted addresses score `default`.
+    Scores of recently seen IPs are cached, as honeypot traffic repeats a small set of sources;
+    the cache is swapped together with the index and emptied whenever it reaches `cache_size`.
+    """
+    def __init__(self, sources: List[str], index_path: str, default: float = 0.0,
+                 reload_interval: float = 300.0, cache_size: int = 65536):
+        self.sources = sources
+        self.index_path = index_path
+        self.default = default
+        self.reload_interval = reload_interval
+        self.cache_size = cache_size
+        self.lookups = 0
+        self.listed = 0
+        self.reloads = 0
+        self._index_mtime = None
+        # (index, its score cache), replaced as a whole on reload
+        self._current: Tuple[ReputationIndex, Dict[str, float]] = (self._load(), {})
+        self._stopping = threading.Event()
+        if reload_interval > 0:
+            threading.Thread(target=self._watch, name="ip-reputation", daemon=True).start()
+
+    def score(self, ip: str) -> float:
+        self.lookups += 1
+        index, cache = self._current
+        score = cache.get(ip)
+        if score is None:
+            try:
+                score = index.lookup(ip)
+            except (OSError, ValueError):
+                score = None
+            score = self.default if score is None else score
+            if len(cache) >= self.cache_size:
+                cache.clear()
+            cache[ip] = score
+        if score != self.default:
+            self.listed += 1
+        return score
+
+    def stats(self) -> Dict[str, float]:
+        return {'ranges': self._current[0].size, 'lookups': self.lookups, 'listed': self.listed, 'reloads': self.reloads}
+
+    def close(self) -> None:
+        self._stopping.set()
+
+    def reload(self) -> bool:
+        """
+        Recompile and swap in the index if the lists or the index file changed. Returns True if it did.
+        """
+        try:
+            unchanged = os.stat(self.index_path).st_mtime_ns == self._index_mtime
+            if unchanged and self.sources:
+                unchanged = self._current[0].fingerprint == fingerprint(source_files(self.sources))
+            if unchanged:
+                return False
+            index = self._load()
+        except Exception as e:
+            logger.error("Error reloading IP reputation index %s: %s", self.index_path, e)
+            return False
+        self._current = (index, {})
+        self.reloads += 1
+        logger.info("Reloaded IP reputation index: %d ranges", index.size)
+        return True
+
+    def _load(self) -> ReputationIndex:
+        index = None
+        if os.path.exists(self.index_path):
+            try:
+                index = ReputationIndex(self.index_path)
+            except ValueError as e:
+                logger.warning("Rebuilding IP reputation index: %s", e)
+        if index is None or (self.sources and index.fingerprint != fingerprint(source_files(self.sources))):
+            compile_index(self.sources, self.index_path)
+            index = ReputationIndex(self.index_path)
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+        return index
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(self.reload_interval):
+            self.reload()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compile and query the IP reputation index.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('compile', help="compile blocklist files into an index")
+    build.add_argument('sources', nargs='+', help="list files or directories of them")
+    build.add_argument('-o', '--output', required=True, help="index file to write")
+    build.add_argument('--default-score', type=float, default=1.0, help="score of entries without one (default 1)")
+    query = commands.add_parser('lookup', help="look up addresses in an index")
+    query.add_argument('index', help="compiled index file")
+    query.add_argument('ips', nargs='+', help="addresses to look up")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == 'compile':
+        compile_index(args.sources, args.output, args.default_score)
+    else:
+        index = ReputationIndex(args.index)
+        for ip in args.ips:
+            print(f"{ip}\t{index.lookup(ip)}")
+
+if __name__ == "__main__":
+    main()
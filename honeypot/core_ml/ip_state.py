@@ -0,0 +1,181 @@
+import logging
+import os
+import pickle
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Rough bytes held per tracked IP: OrderedDict node and slot int, the key string, and one slot in each column
+_ENTRY_OVERHEAD = 104 + sys.getsizeof('255.255.255.255') + 3 * 8
+
+class IPStateStore:
+    """
+    Bounded per-IP state for interarrival and other per-source aggregates.
+    Each IP maps to a slot in a set of flat arrays holding epoch seconds and counters, so an
+    entry costs a few dozen bytes instead of a datetime object. Entries are kept in least
+    recently seen order and evicted once idle for longer than the TTL or when the store is full.
+    """
+    def __init__(self, max_entries: int = 1_000_000, ttl: float = 24 * 3600.0,
+                 max_memory_mb: Optional[float] = None):
+        if max_memory_mb is not None:
+            max_entries = min(max_entries, int(max_memory_mb * 1024 * 1024 / _ENTRY_OVERHEAD))
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._slots = OrderedDict()
+        self._free = []
+        self._last_seen = array('d')
+        self._first_seen = array('d')
+        self._event_count = array('L')
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, ip: str) -> bool:
+        return ip in self._slots
+
+    def interarrival(self, ip: str, timestamp: float, default: float) -> float:
+        """
+        Record an event from ip at the given epoch time and return the seconds since its previous
+        event, or default if the IP is new or was evicted.
+        """
+        slot = self._slots.get(ip)
+        if slot is None:
+            self._evict(timestamp)
+            slot = self._allocate(timestamp)
+            self._slots[ip] = slot
+            return default
+        self._slots.move_to_end(ip)
+        interarrival = timestamp - self._last_seen[slot]
+        self._last_seen[slot] = timestamp
+        self._event_count[slot] += 1
+        return interarrival
+
+    def get(self, ip: str) -> Optional[Dict[str, float]]:
+        slot = self._slots.get(ip)
+        if slot is None:
+            return None
+        return {
+            'last_seen': self._last_seen[slot],
+            'first_seen': self._first_seen[slot],
+            'event_count': self._event_count[slot],
+        }
+
+    def _allocate(self, timestamp: float) -> int:
+        if self._free:
+            slot = self._free.pop()
+            self._last_seen[slot] = timestamp
+            self._first_seen[slot] = timestamp
+            self._event_count[slot] = 1
+            return slot
+        self._last_seen.append(timestamp)
+        self._first_seen.append(timestamp)
+        self._event_count.append(1)
+        return len(self._last_seen) - 1
+
+    def _evict(self, now: float) -> None:
+        # The oldest entries are at the front, so stop at the first one still live
+        cutoff = now - self.ttl
+        while self._slots:
+            ip, slot = next(iter(self._slots.items()))
+            if len(self._slots) < self.max_entries and self._last_seen[slot] >= cutoff:
+                break
+            del self._slots[ip]
+            self._free.append(slot)
+            self.evictions += 1
+
+    def state_dict(self) -> Dict[str, Any]:
+        """
+        A copy of the live entries, as written by snapshot().
+        """
+        slots = list(self._slots.values())
+        return {
+            'ips': list(self._slots.keys()),
+            'last_seen': array('d', (self._last_seen[s] for s in slots)),
+            'first_seen': array('d', (self._first_seen[s] for s in slots)),
+            'event_count': array('L', (self._event_count[s] for s in slots)),
+        }
+
+    def snapshot(self, path: str) -> None:
+        """
+        Write the live entries to path, replacing any previous snapshot atomically.
+        """
+        write_state(self.state_dict(), path)
+
+    def restore(self, path: str) -> bool:
+        """
+        Load entries from a snapshot written by snapshot(). Returns False if there is none.
+        """
+        try:
+            with open(path, 'rb') as f:
+                state: Dict[str, Any] = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        self._slots = OrderedDict((ip, i) for i, ip in enumerate(state['ips']))
+        self._free = []
+        self._last_seen = state['last_seen']
+        self._first_seen = state['first_seen']
+        self._event_count = state['event_count']
+        # Honour the configured cap if the snapshot came from a larger store
+        while len(self._slots) > self.max_entries:
+            _, slot = self._slots.popitem(last=False)
+            self._free.append(slot)
+        logger.info("Restored state for %d IPs from %s", len(self._slots), path)
+        return True
+
+def write_state(state: Dict[str, Any], path: str) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    logger.info("Saved state for %d IPs to %s", len(state['ips']), path)
+
+class IPStateWriter:
+    """
+    Saves per-IP state snapshots without stalling the detection loop, like ModelCheckpointer:
+    save() copies the live entries in the caller's thread, and pickling and disk I/O happen on
+    a background thread. A snapshot still waiting to be written is replaced by a newer one.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._pending: Optional[Dict[str, Any]] = None
+        self._cond = threading.Condition()
+        self._writing = False
+        self._thread = threading.Thread(target=self._run, name="ip-state-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, store: IPStateStore, wait: bool = False) -> None:
+        state = store.state_dict()
+        with self._cond:
+            self._pending = state
+            self._cond.notify_all()
+        if wait:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Block until every queued snapshot has been written.
+        """
+        with self._cond:
+            while self._pending is not None or self._writing:
+                self._cond.wait()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                state, self._pending = self._pending, None
+                self._writing = True
+            try:
+                write_state(state, self.path)
+            except Exception as e:
+                logger.error("Failed to save per-IP state: %s", str(e))
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
@@ -0,0 +1,133 @@
+import csv
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_INT_FIELDS = ('source_port', 'destination_port', 'duration')
+
+def _timestamp(value: Any) -> str:
+    """
+    Normalize a timestamp to the ISO string form stored in the records collection.
+    Accepts ISO strings, datetimes, epoch milliseconds and mongoexport's {"$date": ...}.
+    """
+    if isinstance(value, dict) and '$date' in value:
+        value = value['$date']
+        if isinstance(value, dict) and '$numberLong' in value:
+            value = int(value['$numberLong'])
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=' ', timespec='milliseconds')
+
+def _common(raw: Dict[str, Any]) -> Dict[str, Any]:
+    record = {
+        'timestamp': _timestamp(raw['timestamp']),
+        'source_ip': raw.get('source_ip', 'unknown'),
+    }
+    for key in ('session_id', 'source_port', 'destination_ip', 'destination_port', 'protocol'):
+        if raw.get(key) not in (None, ''):
+            record[key] = raw[key]
+    for key in _INT_FIELDS:
+        if key in record:
+            try:
+                record[key] = int(record[key])
+            except (TypeError, ValueError):
+                pass
+    return record
+
+def normalize_record(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    A document already in the records schema, e.g. from mongoexport or logsrunner.
+    """
+    record = dict(raw)
+    record.pop('_id', None)
+    record.update(_common(raw))
+    record.setdefault('auth_attempts', {'failed': 0, 'success': 0})
+    record.setdefault('commands', [])
+    record.setdefault('duration', 0)
+    return record
+
+def normalize_heralding_auth(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    One row of Heralding's log_auth.csv. Every attempt against the honeypot fails.
+    """
+    record = _common(raw)
+    record.update(duration=0, auth_attempts={'failed': 1, 'success': 0}, commands=[], log_type='heralding_auth')
+    return record
+
+def normalize_heralding_session(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    One line of Heralding's log_session.json, which summarizes a whole session.
+    """
+    record = _common(raw)
+    attempts = raw.get('num_auth_attempts')
+    if attempts is None:
+        attempts = len(raw.get('auth_attempts') or [])
+    record.update(
+        duration=int(raw.get('duration') or 0),
+        auth_attempts={'failed': int(attempts), 'success': 0},
+        commands=[],
+        log_type='heralding_session',
+    )
+    return record
+
+NORMALIZERS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    'record': normalize_record,
+    'heralding_auth': normalize_heralding_auth,
+    'heralding_session': normalize_heralding_session,
+}
+
+def detect_format(raw: Dict[str, Any]) -> str:
+    """
+    Guess which normalizer applies to a raw event from its fields.
+    """
+    if isinstance(raw.get('auth_attempts'), dict):
+        return 'record'
+    if 'num_auth_attempts' in raw or isinstance(raw.get('auth_attempts'), list):
+        return 'heralding_session'
+    if 'auth_id' in raw or 'username' in raw:
+        return 'heralding_auth'
+    return 'record'
+
+def _raw_events(path: str) -> Iterator[Dict[str, Any]]:
+    if os.path.splitext(path)[1].lower() == '.csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+        return
+    with open(path, encoding='utf-8') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            # mongoexport --jsonArray
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def read_events(path: str, fmt: str = 'auto') -> Iterator[Dict[str, Any]]:
+    """
+    Yield the events in a JSONL, JSON array or CSV file, normalized to the records schema.
+    With fmt='auto' the format is detected from the first event. Events that cannot be
+    normalized are logged and skipped.
+    """
+    if fmt != 'auto' and fmt not in NORMALIZERS:
+        raise ValueError(f"Unknown log format '{fmt}', expected 'auto' or one of {sorted(NORMALIZERS)}")
+    normalize: Optional[Callable] = None if fmt == 'auto' else NORMALIZERS[fmt]
+    for line_no, raw in enumerate(_raw_events(path), 1):
+        if normalize is None:
+            normalize = NORMALIZERS[detect_format(raw)]
+            logger.info("Reading %s as %s events", path, normalize.__name__[len('normalize_'):])
+        try:
+            yield normalize(raw)
+        except Exception as e:
+            logger.warning("Skipping unreadable event %d in %s: %s", line_no, path, e)
@@ -0,0 +1,128 @@
+import csv
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# CSV columns parsed as integers; empty cells become None
+NUMERIC_COLUMNS = {'source_port', 'destination_port'}
+
+def _convert(column: str, value: str) -> Any:
+    if value == '':
+        return None
+    if column in NUMERIC_COLUMNS and value.isdigit():
+        return int(value)
+    return value
+
+class TailFollower:
+    """
+    Follows one log file from a byte offset, returning only complete lines added since the last read.
+    Each read() takes at most `chunk_size` new bytes, so a large backlog is worked through over
+    several calls; a line cut off at the end of a chunk is carried over to the next one.
+    A new inode at the path means the file was rotated: the rest of the old file is read through
+    the still-open handle before switching to the new one. A file shorter than the offset was
+    truncated and is read again from the start.
+    """
+    def __init__(self, path: str, offset: int = 0, inode: Optional[int] = None, chunk_size: int = 1024 * 1024):
+        self.path = path
+        self.is_csv = path.lower().endswith('.csv')
+        self.offset = offset
+        self.inode = inode
+        self.chunk_size = chunk_size
+        self.header: Optional[List[str]] = None
+        self._file = None
+        # Bytes read past `offset` that do not yet end in a newline
+        self._partial = b''
+
+    def _open(self) -> bool:
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        inode = os.fstat(f.fileno()).st_ino
+        if self.inode is not None and inode != self.inode:
+            logger.info("%s was replaced; reading the new file from the start", self.path)
+            self.offset = 0
+        self._file, self.inode = f, inode
+        self.header = None
+        self._partial = b''
+        if self.is_csv:
+            header = f.readline()
+            if header.endswith(b'\n'):
+                self.header = next(csv.reader([header.decode('utf-8')]))
+                self.offset = max(self.offset, len(header))
+        return True
+
+    def _current_inode(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def read(self) -> List[Tuple[Dict[str, Any], bytes, int, int]]:
+        """
+        Return (document, raw line, offset after the line, inode of its file) for each new complete
+        line. The offset and inode together are the position to resume from after that line.
+        """
+        if self._file is None and not self._open():
+            return []
+        if self.is_csv and self.header is None:
+            # The header line itself was still incomplete
+            self._file.close()
+            self._file = None
+            return []
+        lines, at_end = self._read_lines()
+        if not at_end:
+            # More of this file is waiting; rotation and truncation are checked once it is read
+            return lines
+        if self._current_inode() != self.inode:
+            # Rotated: the old file is finished, so start on the new one next time
+            logger.info("%s was rotated", self.path)
+            if self._partial:
+                logger.warning("Dropping an incomplete last line of %d bytes from the rotated %s",
+                               len(self._partial), self.path)
+            self.close()
+            self.offset = 0
+            self.inode = None
+        elif os.fstat(self._file.fileno()).st_size < self.offset:
+            logger.warning("%s was truncated; reading it again from the start", self.path)
+            self.close()
+            self.offset = 0
+        return lines
+
+    def _read_lines(self) -> Tuple[List[Tuple[Dict[str, Any], bytes, int, int]], bool]:
+        # Returns the complete lines in the next chunk, and whether the chunk reached the end of the file
+        self._file.seek(self.offset + len(self._partial))
+        data = self._file.read(self.chunk_size)
+        chunk = self._partial + data
+        end = chunk.rfind(b'\n') + 1
+        self._partial = chunk[end:]
+        results = []
+        offset = self.offset
+        for line in chunk[:end].splitlines(keepends=True):
+            offset += len(line)
+            text = line.strip()
+            if not text:
+                continue
+            try:
+                doc = self._parse(text.decode('utf-8'))
+            except Exception as e:
+                logger.warning("Skipping unreadable line at offset %d of %s: %s", offset - len(line), self.path, e)
+                continue
+            results.append((doc, text, offset, self.inode))
+        self.offset += end
+        return results, len(data) < self.chunk_size
+
+    def _parse(self, text: str) -> Dict[str, Any]:
+        if self.is_csv:
+            row = next(csv.reader([text]))
+            return {k: _convert(k, v) for k, v in zip(self.header, row)}
+        return json.loads(text)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._partial = b''
@@ -0,0 +1,125 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Optional
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `burst` records per message template every `interval` seconds.
+    Records are keyed by logger name and unformatted message, so every call site that logs
+    per event gets its own budget. When a window closes with records dropped, one summary line
+    with the suppressed count is emitted in their place. Records at or above `max_level`
+    (WARNING by default) are never dropped.
+    """
+    def __init__(self, handler: logging.Handler, burst: int = 5, interval: float = 10.0,
+                 max_level: int = logging.WARNING):
+        super().__init__()
+        self.handler = handler
+        self.burst = burst
+        self.interval = interval
+        self.max_level = max_level
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.max_level or self.burst <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                return True
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            self._emit_summary(record, suppressed)
+        return True
+
+    def _emit_summary(self, record: logging.LogRecord, suppressed: int) -> None:
+        summary = logging.LogRecord(
+            record.name, record.levelno, record.pathname, record.lineno,
+            "Suppressed %d more '%s' messages in the last %gs", (suppressed, record.msg, self.interval), None)
+        self.handler.handle_unfiltered(summary)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    In-process queue handler that leaves message formatting to the listener thread,
+    so the logging call itself only builds a record and enqueues it.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def handle_unfiltered(self, record: logging.LogRecord) -> None:
+        self.enqueue(record)
+
+class _WorkerQueueHandler(logging.handlers.QueueHandler):
+    # Records cross a process boundary, so they are formatted (and made picklable) before sending
+    def handle_unfiltered(self, record: logging.LogRecord) -> None:
+        self.enqueue(self.prepare(record))
+
+class _QueueListener(logging.handlers.QueueListener):
+    # Safe to stop more than once, e.g. explicitly and again at exit
+    def stop(self) -> None:
+        if self._thread is not None:
+            super().stop()
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure_logging(log_file: str = "attack_detection.log", level: int = logging.INFO,
+                      burst: int = 5, interval: float = 10.0) -> logging.handlers.QueueListener:
+    """
+    Route all logging through a queue to a background thread that writes to log_file and stderr.
+    Per-event INFO chatter is rate limited per message template before it is queued.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    formatter = logging.Formatter(LOG_FORMAT)
+    targets = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for target in targets:
+        target.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(handler, burst=burst, interval=interval))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _listener = _QueueListener(log_queue, *targets, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+def configure_worker_logging(log_queue, level: int = logging.INFO, burst: int = 5, interval: float = 10.0) -> None:
+    """
+    Send a child process's logging to the parent through a multiprocessing queue,
+    applying the same rate limiting as the parent.
+    """
+    handler = _WorkerQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(handler, burst=burst, interval=interval))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+def forward_worker_logs(log_queue) -> logging.handlers.QueueListener:
+    """
+    Start a listener that passes records from worker processes to this process's handlers.
+    """
+    listener = _QueueListener(log_queue, *logging.getLogger().handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,193 +1,523 @@
 import time 
-import joblib
+# Taken before the other imports so --measure-startup includes them
+_PROCESS_START = time.perf_counter()
+import argparse
 from dotenv import load_dotenv
 import os
 import logging
-from datetime import datetime
+from collections import Counter
 
-from data import MongoDBHandler
 from Feature import FeatureExtractor
 from model import AdaptiveAttackDetector
 from response import ResponseEngine
+from response_sink import create_sink
+from enforcement import EnforcementEngine, create_backend
 from Performance_Checker import PerformanceMonitor
+from checkpoint import ModelCheckpointer, load_checkpoint
+from ip_state import IPStateStore, IPStateWriter
+from logging_setup import configure_logging
+from pipeline import score_logs
+from sharding import ShardError, ShardedDetector
+from bootstrap import BootstrapProgress, HistoricalBootstrap
+from sources import create_source, idle_ticks
+from coalescing import EventCoalescer
+from resume_tokens import FileResumeTokenStore, MongoResumeTokenStore, NullResumeTokenStore
+from telemetry import EVENTS_PROCESSED, observe_batches, start_metrics_server
 
 # Configuration
 load_dotenv()
 # We force threshold to 0 so every log is classified by our heuristics
 THRESHOLD = float(os.getenv("THRESHOLD", 0.0))
-# Report every 10 logs
+# Log a progress summary and snapshot per-IP state every 10 logs
 REPORT_INTERVAL = int(os.getenv("REPORT_INTERVAL", 10))
+# Render monitoring_report.png on a background thread every REPORT_EVERY_SECONDS
+REPORT_EVERY_SECONDS = float(os.getenv("REPORT_EVERY_SECONDS", 60))
 MODEL_PATH = os.getenv("MODEL_PATH", "model.pkl")
+# One StandardScaler shared by all detectors and the classifier; set to false for per-member scalers
+SHARED_PREPROCESSING = os.getenv("SHARED_PREPROCESSING", "true").lower() in ("1", "true", "yes")
+# Per-event ensemble score+learn budget in milliseconds; slow, redundant detectors are parked
+# while it is exceeded and restored when load drops (0 disables)
+LATENCY_BUDGET_MS = float(os.getenv("LATENCY_BUDGET_MS", 0))
+# On drift, train a fresh ensemble on the last RETRAIN_BUFFER_SIZE events in the background and swap
+# it in once caught up (0 disables); a retrain waits until RETRAIN_MIN_EVENTS events are buffered
+RETRAIN_BUFFER_SIZE = int(os.getenv("RETRAIN_BUFFER_SIZE", 5000))
+RETRAIN_MIN_EVENTS = int(os.getenv("RETRAIN_MIN_EVENTS", 500))
+# Checkpoint the model every N events and/or T seconds (0 disables a trigger), in the background.
+# The last CHECKPOINT_KEEP versions are kept; CHECKPOINT_COMPRESS is a gzip level (0 = none).
+CHECKPOINT_EVERY_EVENTS = int(os.getenv("CHECKPOINT_EVERY_EVENTS", 1000))
+CHECKPOINT_EVERY_SECONDS = float(os.getenv("CHECKPOINT_EVERY_SECONDS", 300))
+CHECKPOINT_KEEP = int(os.getenv("CHECKPOINT_KEEP", 3))
+CHECKPOINT_COMPRESS = int(os.getenv("CHECKPOINT_COMPRESS", 0))
+# Where logs come from: mongo (the records change stream), heralding (tail Heralding's log files
+# directly), jsonl (tail a local JSONL file) or socket (newline-delimited JSON over TCP).
+# Only 'mongo' requires MongoDB; file sources resume from the offsets in LOG_SOURCE_STATE_PATH.
+LOG_SOURCE = os.getenv("LOG_SOURCE", "mongo")
+LOG_SOURCE_PATHS = [p for p in os.getenv("LOG_SOURCE_PATHS", "").split(",") if p.strip()]
+LOG_SOURCE_ADDRESS = os.getenv("LOG_SOURCE_ADDRESS", "127.0.0.1:5140")
+LOG_SOURCE_STATE_PATH = os.getenv("LOG_SOURCE_STATE_PATH", "source_state.json")
+# Change stream resume token: kept in a file (RESUME_TOKEN_PATH), a MongoDB document or nowhere
+# ('none'), saved every RESUME_TOKEN_SAVE_EVERY batches or RESUME_TOKEN_SAVE_SECONDS seconds
+RESUME_TOKEN_STORE = os.getenv("RESUME_TOKEN_STORE", "file")
+RESUME_TOKEN_PATH = os.getenv("RESUME_TOKEN_PATH", "resume_token.json")
+RESUME_TOKEN_SAVE_EVERY = int(os.getenv("RESUME_TOKEN_SAVE_EVERY", 100))
+RESUME_TOKEN_SAVE_SECONDS = float(os.getenv("RESUME_TOKEN_SAVE_SECONDS", 5))
+# Longest the server holds an empty change stream read before returning, in milliseconds
+# (0: the server default, or BATCH_MAX_LINGER when batching)
+CHANGE_STREAM_MAX_AWAIT_MS = int(os.getenv("CHANGE_STREAM_MAX_AWAIT_MS", 0)) or None
+# Micro-batching: process up to BATCH_SIZE logs together, waiting at most BATCH_MAX_LINGER seconds
+# for a batch to fill. A batch size of 1 keeps the original one-log-at-a-time loop.
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 1))
+BATCH_MAX_LINGER = float(os.getenv("BATCH_MAX_LINGER", 0.5))
+# Historical bootstrap for a new model: records are streamed BOOTSTRAP_BATCH_SIZE at a time, up to
+# BOOTSTRAP_LIMIT (0 = all), checkpointing model and progress every BOOTSTRAP_CHECKPOINT_EVERY records
+BOOTSTRAP_BATCH_SIZE = int(os.getenv("BOOTSTRAP_BATCH_SIZE", 1000))
+BOOTSTRAP_LIMIT = int(os.getenv("BOOTSTRAP_LIMIT", 0))
+BOOTSTRAP_CHECKPOINT_EVERY = int(os.getenv("BOOTSTRAP_CHECKPOINT_EVERY", 50000))
+BOOTSTRAP_PROGRESS_PATH = os.getenv("BOOTSTRAP_PROGRESS_PATH", "bootstrap_progress.json")
+# Per-IP state: entries idle for IP_STATE_TTL seconds are dropped, and the store is capped in size
+IP_STATE_MAX_ENTRIES = int(os.getenv("IP_STATE_MAX_ENTRIES", 1_000_000))
+IP_STATE_MAX_MEMORY_MB = float(os.getenv("IP_STATE_MAX_MEMORY_MB", 256))
+IP_STATE_TTL = float(os.getenv("IP_STATE_TTL", 24 * 3600))
+IP_STATE_PATH = os.getenv("IP_STATE_PATH", "")
+# Where non-alert responses are recorded: format (csv, jsonl or parquet), path, and rotation limits
+RESPONSE_SINK_FORMAT = os.getenv("RESPONSE_SINK_FORMAT", "csv")
+RESPONSE_SINK_PATH = os.getenv("RESPONSE_SINK_PATH", "malicious_attempts.csv")
+RESPONSE_ROTATE_BYTES = int(os.getenv("RESPONSE_ROTATE_BYTES", 0))
+RESPONSE_ROTATE_SECONDS = float(os.getenv("RESPONSE_ROTATE_SECONDS", 0))
+# Block-list enforcement of temp_block/perm_block actions: backend (none, ipset, nft or memory) and
+# where the ipset/nft commands go, one numbered file per update (ENFORCEMENT_PATH.<seq>). Blocks cover the source's /ENFORCEMENT_PREFIX_V4
+# (or _V6) network, temporary ones last TEMP_BLOCK_SECONDS, and changes are applied every ENFORCEMENT_WINDOW seconds.
+ENFORCEMENT_BACKEND = os.getenv("ENFORCEMENT_BACKEND", "none")
+ENFORCEMENT_PATH = os.getenv("ENFORCEMENT_PATH", "blocklist.rules")
+ENFORCEMENT_SET = os.getenv("ENFORCEMENT_SET", "flytrap")
+ENFORCEMENT_WINDOW = float(os.getenv("ENFORCEMENT_WINDOW", 1.0))
+ENFORCEMENT_PREFIX_V4 = int(os.getenv("ENFORCEMENT_PREFIX_V4", 32))
+ENFORCEMENT_PREFIX_V6 = int(os.getenv("ENFORCEMENT_PREFIX_V6", 128))
+TEMP_BLOCK_SECONDS = int(os.getenv("TEMP_BLOCK_SECONDS", 600))
+# Number of detector processes; logs are partitioned across them by source IP
+NUM_SHARDS = int(os.getenv("NUM_SHARDS", 1))
+# 'sync' handles one batch at a time; 'async' overlaps reading, feature extraction, scoring and
+# response as stages joined by queues of PIPELINE_QUEUE_SIZE batches (single process only)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sync").lower()
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 8))
+# Merge command-less events per (source IP, protocol, destination port) over COALESCE_WINDOW seconds
+# (0 disables) before scoring: 'tumbling' windows close COALESCE_WINDOW after their first event,
+# 'session' windows after COALESCE_WINDOW of quiet, up to COALESCE_MAX_SPAN; at most COALESCE_MAX_EVENTS each
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 0))
+COALESCE_MODE = os.getenv("COALESCE_MODE", "tumbling")
+COALESCE_MAX_SPAN = float(os.getenv("COALESCE_MAX_SPAN", 60))
+COALESCE_MAX_EVENTS = int(os.getenv("COALESCE_MAX_EVENTS", 1000))
+
+# Logging goes through a background writer; per-event INFO lines are limited to LOG_SAMPLE_BURST
+# per message every LOG_SAMPLE_INTERVAL seconds, with a count of the suppressed ones
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 5))
+LOG_SAMPLE_INTERVAL = float(os.getenv("LOG_SAMPLE_INTERVAL", 10))
+
+# Serve Prometheus metrics at http://METRICS_ADDRESS:METRICS_PORT/metrics (0 disables)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_ADDRESS = os.getenv("METRICS_ADDRESS", "127.0.0.1")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler("attack_detection.log"), logging.StreamHandler()]
-)
 logger = logging.getLogger(__name__)
 
-# Global dictionary to track last seen time per IP for interarrival calculation
-last_seen = {}
+# Counts behind the periodic summary line
+attack_type_counts = Counter()
+_last_summary = {'time': time.monotonic(), 'events': 0}
+
+def create_ip_state():
+    ip_state = IPStateStore(max_entries=IP_STATE_MAX_ENTRIES, ttl=IP_STATE_TTL,
+                            max_memory_mb=IP_STATE_MAX_MEMORY_MB)
+    if IP_STATE_PATH:
+        try:
+            ip_state.restore(IP_STATE_PATH)
+        except Exception as e:
+            logger.warning("Could not restore per-IP state from %s: %s", IP_STATE_PATH, str(e))
+    return ip_state
+
+_ip_state_writer = None
 
-def initialize_model(feature_extractor):
-    detector = AdaptiveAttackDetector(threshold=THRESHOLD)
+def save_ip_state(ip_state, wait=False):
+    """
+    Snapshot per-IP state and write it in the background; it is saved alongside model checkpoints.
+    """
+    global _ip_state_writer
+    if not IP_STATE_PATH:
+        return
+    if _ip_state_writer is None:
+        _ip_state_writer = IPStateWriter(IP_STATE_PATH)
     try:
-        with open(MODEL_PATH, 'rb') as f:
-            detector = joblib.load(f)
-        logger.info("Loaded existing model from %s", MODEL_PATH)
-    except (FileNotFoundError, EOFError) as e:
-        logger.warning("Error loading saved model: %s. Initializing new model.", str(e))
+        _ip_state_writer.save(ip_state, wait=wait)
+    except Exception as e:
+        logger.error("Failed to save per-IP state: %s", str(e))
+
+def create_checkpointer(path=MODEL_PATH):
+    return ModelCheckpointer(path, keep=CHECKPOINT_KEEP, compress=CHECKPOINT_COMPRESS,
+                             every_events=CHECKPOINT_EVERY_EVENTS, every_seconds=CHECKPOINT_EVERY_SECONDS)
+
+def load_model(checkpointer):
+    """
+    Load the latest checkpoint, falling back to older versions if it is missing or unreadable.
+    """
+    for path in [checkpointer.path] + checkpointer.versions():
         try:
-            db = MongoDBHandler()
-            historical_logs = db.get_historical_data(limit=1000)
-            if not historical_logs:
-                logger.warning("No historical logs available for initial training.")
-            else:
-                valid_logs = [log for log in historical_logs if log and isinstance(log, dict) and 'source_ip' in log]
-                logger.info("Training with %d valid historical logs", len(valid_logs))
-                for log in valid_logs:
-                    try:
-                        ip = log.get('source_ip', 'unknown')
-                        current_time = datetime.fromisoformat(log['timestamp'])
-                        if ip in last_seen:
-                            interarrival = (current_time - last_seen[ip]).total_seconds()
-                        else:
-                            interarrival = 100  # assume high if first occurrence
-                        last_seen[ip] = current_time
-                        
-                        features = feature_extractor.transform(log)
-                        features['interarrival_time'] = interarrival
-                        
-                        # Heuristic labeling:
-                        if features.get('commands') and len(features.get('commands')) > 0:
-                            label = 'command_injection'
-                        else:
-                            if features.get('interarrival_time', 100) < 3:
-                                label = 'brute_force'
-                            else:
-                                label = 'suspicious'
-                        
-                        detector.process_log(features)
-                        detector.train_classifier([features], [label])
-                    except Exception as e:
-                        logger.error("Error training on historical log %s: %s", log.get('_id', 'unknown'), str(e))
-                logger.info("Initial training completed with %d logs", len(valid_logs))
+            detector = load_checkpoint(path, AdaptiveAttackDetector.from_state_dict)
+            logger.info("Loaded existing model from %s", path)
+            return detector
+        except FileNotFoundError:
+            continue
         except Exception as e:
-            logger.error("Failed to initialize with historical data: %s", str(e))
-    return detector
+            logger.warning("Error loading saved model from %s: %s", path, str(e))
+    return None
+
+def save_checkpoint(model, checkpointer, ip_state):
+    checkpointer.save(model, wait=True)
+    save_ip_state(ip_state, wait=True)
+
+def initialize_model(feature_extractor, ip_state, checkpointer, db=None):
+    """
+    Load the saved model, training a new one on historical records if there is none.
+    A bootstrap interrupted part way is resumed on top of its last checkpoint.
+    """
+    detector = load_model(checkpointer)
+    if detector is not None:
+        detector.set_latency_budget(LATENCY_BUDGET_MS)
+        progress = BootstrapProgress.load(BOOTSTRAP_PROGRESS_PATH)
+        if not progress.started or progress.done:
+            # Nothing to resume, so restarts do not wait on MongoDB here
+            return detector
+    try:
+        if db is None:
+            from data import MongoDBHandler
+            db = MongoDBHandler()
+        bootstrap = HistoricalBootstrap(db, feature_extractor, ip_state, BOOTSTRAP_PROGRESS_PATH,
+                                        batch_size=BOOTSTRAP_BATCH_SIZE, limit=BOOTSTRAP_LIMIT,
+                                        checkpoint_every=BOOTSTRAP_CHECKPOINT_EVERY)
+    except Exception as e:
+        logger.error("Failed to initialize with historical data: %s", str(e))
+        bootstrap = None
+
+    if detector is not None:
+        if bootstrap is None:
+            return detector
+    else:
+        detector = AdaptiveAttackDetector(threshold=THRESHOLD, shared_preprocessing=SHARED_PREPROCESSING,
+                                          latency_budget_ms=LATENCY_BUDGET_MS)
+        logger.warning("No usable saved model found. Initializing new model.")
+        if bootstrap is None:
+            return detector
+        # Progress without a model to match it cannot be resumed
+        bootstrap.progress.reset()
 
-def save_model(detector):
     try:
-        with open(MODEL_PATH, 'wb') as f:
-            joblib.dump(detector, f)
-        logger.info("Model saved to %s", MODEL_PATH)
+        bootstrap.run(detector, save_model=lambda model: save_checkpoint(model, checkpointer, ip_state))
+        if not bootstrap.progress.processed:
+            logger.warning("No historical logs available for initial training.")
     except Exception as e:
-        logger.error("Failed to save model: %s", str(e))
+        logger.error("Failed to initialize with historical data: %s", str(e))
+    return detector
+
+def respond(detections, responder, monitor):
+    """
+    Feed scored detections (as returned by score_logs) to the monitor and response engine.
+    """
+    for detection in detections:
+        is_attack = True  # All logs are malicious in this scenario
+        monitor.update(detection['score'], is_attack, true_label=None)
+    EVENTS_PROCESSED.inc(len(detections))
 
-def main():
+    all_actions = responder.determine_responses([
+        (d['attack_type'], d['score'], {"ip": d['ip'], "location": d['location'], "top_features": d['top_features']})
+        for d in detections
+    ])
+    success_rate = 0.75
+    for detection, actions in zip(detections, all_actions):
+        logger.info("Detected attack from %s (score: %.2f, type: %s, interarrival: %.2f). Actions: %s",
+                    detection['ip'], detection['score'], detection['attack_type'], detection['interarrival'], actions)
+        responder.update_strategy(detection['attack_type'], success_rate)
+        attack_type_counts[detection['attack_type']] += 1
+
+def log_summary(monitor, extra=""):
+    """
+    Periodic summary line standing in for the rate-limited per-event logs.
+    """
+    now = time.monotonic()
+    elapsed = now - _last_summary['time']
+    rate = (monitor.total_events - _last_summary['events']) / elapsed if elapsed > 0 else 0.0
+    logger.info("Processed %d logs (%.1f/s). Attack types since last summary: %s%s",
+                monitor.total_events, rate, dict(attack_type_counts), extra)
+    attack_type_counts.clear()
+    _last_summary.update(time=now, events=monitor.total_events)
+
+def report_due(monitor, new_events, interval=REPORT_INTERVAL):
+    processed = monitor.total_events
+    return interval > 0 and new_events > 0 and processed // interval != (processed - new_events) // interval
+
+def process_batch(logs, fe, model, responder, monitor, ip_state, checkpointer):
+    """
+    Run a batch of logs through feature extraction, detection and response, returning the detections.
+    """
+    detections = score_logs(logs, fe, model, ip_state)
+    if not detections:
+        return detections
+    respond(detections, responder, monitor)
+    if checkpointer.maybe_save(model, len(detections)):
+        save_ip_state(ip_state)
+    report_progress(fe, model, monitor, len(detections))
+    return detections
+
+def report_progress(fe, model, monitor, new_events):
+    """
+    Log the periodic summary if one is due. Returns True when it was.
+    """
+    if not report_due(monitor, new_events):
+        return False
+    log_summary(monitor, f". GeoIP cache: {fe.geoip_stats()}. IP reputation: {fe.reputation_stats()}. "
+                         f"Detectors: {model.member_summary()}. Retraining: {model.retraining_summary()}. "
+                         f"Top command signatures: {fe.commands.top_signatures(5)}")
+    return True
+
+def process_sharded_batch(logs, sharded, responder, monitor, token=None):
+    """
+    Hand a batch to the detector shards and respond to whatever detections have come back.
+    """
+    sharded.submit(logs, token)
+    detections = sharded.collect()
+    if not detections:
+        return
+    respond(detections, responder, monitor)
+
+    if report_due(monitor, len(detections)):
+        log_summary(monitor)
+    if report_due(monitor, len(detections), CHECKPOINT_EVERY_EVENTS):
+        sharded.checkpoint()
+        logger.info("Checkpointing detector shards after %d logs.", monitor.total_events)
+
+def shard_config():
+    return {
+        'threshold': THRESHOLD,
+        'model_path': MODEL_PATH,
+        'shared_preprocessing': SHARED_PREPROCESSING,
+        'latency_budget_ms': LATENCY_BUDGET_MS,
+        'retrain_buffer_size': RETRAIN_BUFFER_SIZE,
+        'retrain_min_events': RETRAIN_MIN_EVENTS,
+        'checkpoint_keep': CHECKPOINT_KEEP,
+        'checkpoint_compress': CHECKPOINT_COMPRESS,
+        'ip_state_max_entries': IP_STATE_MAX_ENTRIES,
+        'ip_state_max_memory_mb': IP_STATE_MAX_MEMORY_MB,
+        'ip_state_ttl': IP_STATE_TTL,
+        'ip_state_path': IP_STATE_PATH,
+        'log_level': LOG_LEVEL,
+        'log_sample_burst': LOG_SAMPLE_BURST,
+        'log_sample_interval': LOG_SAMPLE_INTERVAL,
+    }
+
+def create_coalescer():
+    if COALESCE_WINDOW <= 0:
+        return None
+    return EventCoalescer(window=COALESCE_WINDOW, mode=COALESCE_MODE, max_span=COALESCE_MAX_SPAN,
+                          max_events=COALESCE_MAX_EVENTS)
+
+def create_enforcer():
+    if ENFORCEMENT_BACKEND == 'none':
+        return None
+    if ENFORCEMENT_BACKEND == 'memory':
+        backend = create_backend('memory')
+    else:
+        backend = create_backend(ENFORCEMENT_BACKEND, path=ENFORCEMENT_PATH, set_name=ENFORCEMENT_SET)
+    return EnforcementEngine(backend, window=ENFORCEMENT_WINDOW, temp_block_seconds=TEMP_BLOCK_SECONDS,
+                             prefix_v4=ENFORCEMENT_PREFIX_V4, prefix_v6=ENFORCEMENT_PREFIX_V6)
+
+def create_token_store(db):
+    kwargs = dict(every_updates=RESUME_TOKEN_SAVE_EVERY, every_seconds=RESUME_TOKEN_SAVE_SECONDS)
+    if RESUME_TOKEN_STORE == 'file':
+        return FileResumeTokenStore(RESUME_TOKEN_PATH, **kwargs)
+    if RESUME_TOKEN_STORE == 'mongo':
+        return MongoResumeTokenStore(db.db.stream_state, **kwargs)
+    return NullResumeTokenStore()
+
+def create_log_source(db):
+    if LOG_SOURCE == 'mongo':
+        return create_source('mongo', db=db, batch_size=BATCH_SIZE, max_linger=BATCH_MAX_LINGER,
+                             max_await_ms=CHANGE_STREAM_MAX_AWAIT_MS, token_store=create_token_store(db))
+    if LOG_SOURCE == 'socket':
+        return create_source('socket', address=LOG_SOURCE_ADDRESS, batch_size=BATCH_SIZE, max_linger=BATCH_MAX_LINGER)
+    return create_source(LOG_SOURCE, paths=LOG_SOURCE_PATHS or None, state_path=LOG_SOURCE_STATE_PATH,
+                         batch_size=BATCH_SIZE, max_linger=BATCH_MAX_LINGER)
+
+def create_pipeline(source, fe, model, ip_state, checkpointer, responder, monitor, coalescer=None):
+    # asyncio is only imported in async mode
+    from async_pipeline import AsyncPipeline
+    return AsyncPipeline(source, fe, model, ip_state, checkpointer,
+                         respond=lambda detections: respond(detections, responder, monitor),
+                         on_progress=lambda new_events: report_progress(fe, model, monitor, new_events),
+                         snapshot=lambda: save_ip_state(ip_state),
+                         queue_size=PIPELINE_QUEUE_SIZE, metrics_interval=REPORT_EVERY_SECONDS,
+                         coalescer=coalescer)
+
+def measure_first_event(source, fe, model, responder, monitor, ip_state, checkpointer, timings):
+    """
+    Process logs until the first detection and print how long each part of getting there took.
+    Nothing is committed to the source, so the measured logs are read again on the next start.
+    """
+    waited = 0.0
+    started = time.perf_counter()
+    for logs, _ in source.batches():
+        scoring = time.perf_counter()
+        waited += scoring - started
+        if logs and process_batch(logs, fe, model, responder, monitor, ip_state, checkpointer):
+            timings['waiting for logs'] = waited
+            timings['first batch'] = time.perf_counter() - scoring
+            break
+        started = time.perf_counter()
+    total = time.perf_counter() - _PROCESS_START
+    print("Startup (time to first scored event):")
+    for phase, seconds in timings.items():
+        print(f"  {phase:<20}{seconds * 1000:>10.1f} ms")
+    print(f"  {'total':<20}{total * 1000:>10.1f} ms ({(total - waited) * 1000:.1f} ms excluding the wait for logs)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Real-time attack detection on honeypot logs.")
+    parser.add_argument('--measure-startup', action='store_true',
+                        help="start in-process, score the first log from the source, report the time each "
+                             "startup phase took and exit without saving anything")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    timings = {'imports': time.perf_counter() - _PROCESS_START}
+    configure_logging("attack_detection.log", level=LOG_LEVEL, burst=LOG_SAMPLE_BURST, interval=LOG_SAMPLE_INTERVAL)
+    sharded = None
+    pipeline = None
+    metrics_server = None
     try:
         logger.info("Starting system initialization...")
-        db = MongoDBHandler()
-        logger.info("MongoDBHandler initialized.")
-        fe = FeatureExtractor()
-        logger.info("FeatureExtractor initialized.")
-        model = initialize_model(fe)
-        logger.info("AdaptiveAttackDetector initialized.")
-        responder = ResponseEngine()
+        if METRICS_PORT and not args.measure_startup:
+            metrics_server = start_metrics_server(METRICS_PORT, METRICS_ADDRESS)
+        phase_start = time.perf_counter()
+        # Other sources run without MongoDB; it is then only tried for the historical bootstrap
+        db = None
+        if LOG_SOURCE == 'mongo':
+            from data import MongoDBHandler
+            db = MongoDBHandler()
+            logger.info("MongoDBHandler initialized.")
+        source = create_log_source(db)
+        logger.info("Log source '%s' initialized.", LOG_SOURCE)
+        timings['log source'] = time.perf_counter() - phase_start
+        phase_start = time.perf_counter()
+        if NUM_SHARDS > 1 and not args.measure_startup:
+            # Each shard builds its own FeatureExtractor, detector and per-IP state
+            sharded = ShardedDetector(NUM_SHARDS, shard_config())
+            sharded.start()
+            logger.info("ShardedDetector initialized with %d shards.", NUM_SHARDS)
+        else:
+            fe = FeatureExtractor()
+            logger.info("FeatureExtractor initialized.")
+            ip_state = create_ip_state()
+            checkpointer = create_checkpointer()
+            model = initialize_model(fe, ip_state, checkpointer, db)
+            # Enabled after the bootstrap, so historical training is never swapped out part way
+            model.set_retraining(RETRAIN_BUFFER_SIZE, RETRAIN_MIN_EVENTS)
+            logger.info("AdaptiveAttackDetector initialized.")
+        timings['model'] = time.perf_counter() - phase_start
+        phase_start = time.perf_counter()
+        responder = ResponseEngine(sink=create_sink(
+            RESPONSE_SINK_FORMAT, RESPONSE_SINK_PATH,
+            max_bytes=RESPONSE_ROTATE_BYTES, rotate_seconds=RESPONSE_ROTATE_SECONDS), enforcer=create_enforcer())
         logger.info("ResponseEngine initialized.")
         monitor = PerformanceMonitor()
+        monitor.start_reporting(REPORT_EVERY_SECONDS)
         logger.info("PerformanceMonitor initialized.")
+        coalescer = create_coalescer()
+        if PIPELINE_MODE == 'async' and not args.measure_startup:
+            if sharded:
+                logger.warning("PIPELINE_MODE=async is not supported with NUM_SHARDS > 1; using the sync loop.")
+            else:
+                pipeline = create_pipeline(source, fe, model, ip_state, checkpointer, responder, monitor, coalescer)
+        timings['responder/monitor'] = time.perf_counter() - phase_start
         resume_token = None
         logger.info("System initialized successfully.")
     except Exception as e:
         logger.critical("Failed to initialize system: %s", str(e))
         raise
 
+    if args.measure_startup:
+        try:
+            measure_first_event(source, fe, model, responder, monitor, ip_state, checkpointer, timings)
+        except KeyboardInterrupt:
+            pass
+        checkpointer.close()
+        source.close()
+        responder.close()
+        monitor.stop_reporting()
+        return
+
     try:
-        while True:
-            try:
-                for change in db.stream_logs(resume_token):
-                    if change is None:
-                        logger.warning("Received None from stream, skipping.")
-                        continue
-                    if not isinstance(change, dict):
-                        logger.error("Unexpected data structure from stream_logs: %s", type(change))
-                        continue
-                    log = change.get('log')
-                    resume_token = change.get('token')
-                    if log is None:
-                        logger.warning("Received log entry with missing 'log' field: %s", change)
-                        continue
+        if pipeline:
+            import asyncio
+            # Returns once SIGINT/SIGTERM has drained the in-flight batches
+            asyncio.run(pipeline.run())
+        else:
+            while True:
+                try:
+                    batches = source.batches(resume_token)
+                    if coalescer or sharded:
+                        # Idle sources yield nothing, so tick to close coalescing windows and collect
+                        # shard results on time
+                        batches = idle_ticks(batches, coalescer.tick_interval if coalescer else 0.5)
+                    batches = observe_batches(batches)
                     try:
-                        ip = log.get('source_ip', 'unknown')
-                        current_time = datetime.fromisoformat(log['timestamp'])
-                        if ip in last_seen:
-                            interarrival = (current_time - last_seen[ip]).total_seconds()
-                        else:
-                            interarrival = 100
-                        last_seen[ip] = current_time
-                        
-                        features = fe.transform(log)
-                        features['interarrival_time'] = interarrival
-                        
-                        # Use improved model: get anomaly score, attack type, and feature importance
-                        score, attack_type, feature_importance = model.process_log(features)
-                        is_attack = True  # All logs are malicious in this scenario
-                        monitor.update(score, is_attack, true_label=None)
-                        
-                        # Log top features for this anomaly
-                        top_features = list(feature_importance.items())[:5]
-                        logger.info(f"Top contributing features: {top_features}")
-                        
-                        try:
-                            location = fe.get_location(ip)
-                        except Exception as e:
-                            logger.warning("GeoIP lookup failed for IP %s: %s", ip, str(e))
-                            location = "Unknown"
-                        context = {"ip": ip, "location": location, "top_features": top_features}
-                        
-                        # Determine heuristic label
-                        if features.get('commands') and len(features.get('commands')) > 0:
-                            heuristic_label = 'command_injection'
-                        else:
-                            if interarrival < 3:
-                                heuristic_label = 'brute_force'
-                            else:
-                                heuristic_label = 'suspicious'
-                        
-                        # Override classifier prediction if it returns None or "normal"
-                        if attack_type is None or attack_type.lower() == "normal":
-                            attack_type = heuristic_label
-                        
-                        # Automatically update the classifier if it doesn't match the heuristic label
-                        if attack_type.lower() != heuristic_label.lower():
-                            model.train_classifier([features], [heuristic_label])
-                            logger.info("Auto-updated classifier: changed %s to %s for log from %s", 
-                                        attack_type, heuristic_label, ip)
-                            attack_type = heuristic_label
-                        
-                        actions = responder.determine_response(attack_type, score, context)
-                        logger.info("Detected attack from %s (score: %.2f, type: %s, interarrival: %.2f). Actions: %s",
-                                    ip, score, attack_type, interarrival, actions)
-                        success_rate = 0.75
-                        responder.update_strategy(attack_type, success_rate)
-                        
-                        if len(monitor.log_entries) % REPORT_INTERVAL == 0 and len(monitor.log_entries) > 0:
-                            save_model(model)
-                            monitor.generate_report()
-                            logger.info("Generated performance report after %d logs.", len(monitor.log_entries))
-                    except Exception as e:
-                        logger.error("Error processing log from %s: %s", log.get('source_ip', 'unknown') if log else 'unknown', str(e))
-                        continue
-            except Exception as e:
-                logger.warning("Stream interrupted: %s. Reconnecting in 5 seconds...", str(e))
-                time.sleep(5)
+                        for logs, token in batches:
+                            if token is not None:
+                                resume_token = token
+                            if coalescer:
+                                logs = coalescer.add_many(logs, token=token)
+                                token = coalescer.committable()
+                            if sharded:
+                                # Shards score asynchronously; commit only what all of them have answered for
+                                process_sharded_batch(logs, sharded, responder, monitor, token)
+                                token = sharded.committable()
+                            elif logs:
+                                process_batch(logs, fe, model, responder, monitor, ip_state, checkpointer)
+                            if token is not None:
+                                source.commit(token)
+                    finally:
+                        # Stop reading (and idle_ticks' reader thread) before the source is read again
+                        batches.close()
+                except ShardError:
+                    raise
+                except Exception as e:
+                    logger.warning("Stream interrupted: %s. Reconnecting in 5 seconds...", str(e))
+                    time.sleep(5)
     except KeyboardInterrupt:
-        logger.info("Received shutdown signal. Saving final state...")
-        save_model(model)
-        monitor.generate_report()
-        logger.info("Final performance report generated. System shutting down.")
+        pass
+
+    logger.info("Received shutdown signal. Saving final state...")
+    if coalescer:
+        if not pipeline:
+            remaining = coalescer.flush()
+            if remaining and sharded:
+                process_sharded_batch(remaining, sharded, responder, monitor)
+            elif remaining:
+                process_batch(remaining, fe, model, responder, monitor, ip_state, checkpointer)
+        logger.info("Event coalescing: %s", coalescer.summary())
+    if sharded:
+        remaining = sharded.stop()
+        if remaining:
+            respond(remaining, responder, monitor)
+        token = sharded.committable()
+        if token is not None:
+            source.commit(token)
+    else:
+        checkpointer.save(model)
+        checkpointer.close()
+        save_ip_state(ip_state, wait=True)
+    source.close()
+    responder.close()
+    monitor.stop_reporting()
+    monitor.generate_report()
+    if metrics_server:
+        metrics_server.shutdown()
+    logger.info("Final performance report generated. System shutting down.")
 
 if __name__ == "__main__":
     main()
-
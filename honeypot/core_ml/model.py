@@ -1,68 +1,366 @@
 import logging
-from typing import Any, Dict, List, Tuple
-from river import anomaly, compose, preprocessing, drift, tree, ensemble, metrics
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from river import anomaly, compose, preprocessing, drift, tree
+
+import telemetry
+from retraining import ShadowRetrainer
+
+class MemberStats:
+    """
+    Running cost and contribution figures for one ensemble member.
+    Times are exponentially weighted per-event averages in seconds; `disagreement` is the
+    weighted mean distance between the member's normalized score and the ensemble score,
+    so a member that always agrees with the ensemble adds little to it. `score_min` and
+    `score_max` are the recent range of the member's raw scores, which its scores are
+    normalized against: a new extreme widens the range at once, and each later score pulls both
+    bounds a RANGE_DECAY fraction towards itself, so one outlier does not squash every later score.
+    """
+    __slots__ = ('name', 'active', 'score_time', 'learn_time', 'disagreement',
+                 'score_calls', 'learn_calls', 'total_score_time', 'total_learn_time', 'skipped',
+                 'score_min', 'score_max')
+    ALPHA = 0.05
+    RANGE_DECAY = 0.001
+
+    def __init__(self, name: str):
+        self.name = name
+        self.active = True
+        self.score_time = 0.0
+        self.learn_time = 0.0
+        self.disagreement = 0.0
+        self.score_calls = 0
+        self.learn_calls = 0
+        self.total_score_time = 0.0
+        self.total_learn_time = 0.0
+        self.skipped = 0
+        self.score_min = float('inf')
+        self.score_max = float('-inf')
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        # Stats pickled before score ranges were tracked start with an empty range
+        self.score_min = float('inf')
+        self.score_max = float('-inf')
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    def record_score(self, elapsed: float) -> None:
+        self.score_calls += 1
+        self.total_score_time += elapsed
+        self.score_time += self.ALPHA * (elapsed - self.score_time)
+
+    def record_learn(self, elapsed: float) -> None:
+        self.learn_calls += 1
+        self.total_learn_time += elapsed
+        self.learn_time += self.ALPHA * (elapsed - self.learn_time)
+
+    def observe(self, score: float) -> None:
+        """
+        Update the member's recent score range with `score`.
+        """
+        if score <= self.score_min:
+            self.score_min = score
+        else:
+            self.score_min += self.RANGE_DECAY * (score - self.score_min)
+        if score >= self.score_max:
+            self.score_max = score
+        else:
+            self.score_max += self.RANGE_DECAY * (score - self.score_max)
+
+    def scale(self, score: float) -> float:
+        """
+        `score` scaled to [0, 1] within the member's recent range, without changing it. Until the
+        range has any width the raw score is used, clamped to [0, 1].
+        """
+        spread = self.score_max - self.score_min
+        if spread > 1e-6:
+            score = (score - self.score_min) / spread
+        return min(max(score, 0.0), 1.0)
+
+    def normalize(self, score: float) -> float:
+        """
+        observe() then scale(), as live scoring does.
+        """
+        self.observe(score)
+        return self.scale(score)
+
+    def record_agreement(self, distance: float) -> None:
+        self.disagreement += self.ALPHA * (distance - self.disagreement)
+
+    @property
+    def cost(self) -> float:
+        return self.score_time + self.learn_time
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'active': self.active,
+            'score_ms': round(self.score_time * 1000, 3),
+            'learn_ms': round(self.learn_time * 1000, 3),
+            'disagreement': round(self.disagreement, 4),
+            'score_calls': self.score_calls,
+            'learn_calls': self.learn_calls,
+            'skipped': self.skipped,
+        }
 
 class AdaptiveAttackDetector:
     """
     Advanced adaptive anomaly detector and classifier for cyber attack detection.
     Features:
     - Ensemble voting of multiple anomaly detectors (HalfSpaceTrees, IsolationForest, OneClassSVM)
-    - Advanced drift detection (ADWIN, DDM)
+    - One shared running StandardScaler feeding every ensemble member and the classifier
+      (per-member scalers are available with shared_preprocessing=False)
+    - Advanced drift detection (ADWIN, DDM), optionally followed by retraining a fresh ensemble
+      on recent events in the background and swapping it in (see set_retraining)
     - Online feature importance tracking
+    - Per-member score/learn timing and agreement tracking, with an optional per-event latency
+      budget that parks slow, redundant members while load is high
     - Robust classifier with online learning
     - Rich logging and error handling
     """
-    def __init__(self, threshold: float = 0.8):
+    # Budget checks run every BUDGET_CHECK_EVERY events; parked members still learn every
+    # PARKED_LEARN_EVERY events so they are current when brought back
+    BUDGET_CHECK_EVERY = 50
+    PARKED_LEARN_EVERY = 10
+    MIN_ACTIVE_MEMBERS = 2
+    # Version of the state_dict() layout; bump it when learned state is added or changed
+    STATE_VERSION = 2
+    STATE_FIELDS = ('threshold', 'scaler', 'detectors', 'classifier', 'classifier_scaler', 'drift_detectors',
+                    'member_stats', 'latency_budget', '_events', 'feature_importance')
+
+    def __init__(self, threshold: float = 0.8, shared_preprocessing: bool = True,
+                 latency_budget_ms: Optional[float] = None):
         self.threshold = threshold
-        logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
         # Ensemble of anomaly detectors
-        self.detectors = [
-            compose.Pipeline(preprocessing.StandardScaler(), anomaly.HalfSpaceTrees(n_trees=10, seed=1)),
-            compose.Pipeline(preprocessing.StandardScaler(), anomaly.HalfSpaceTrees(n_trees=15, seed=2)),
-            compose.Pipeline(preprocessing.StandardScaler(), anomaly.HalfSpaceTrees(n_trees=20, seed=3)),
-            compose.Pipeline(preprocessing.StandardScaler(), anomaly.IsolationForest(n_trees=25, seed=4)),
+        members = [
+            anomaly.HalfSpaceTrees(n_trees=10, seed=1),
+            anomaly.HalfSpaceTrees(n_trees=15, seed=2),
+            anomaly.HalfSpaceTrees(n_trees=20, seed=3),
+            anomaly.IsolationForest(n_trees=25, seed=4),
         ]
+        classifier = tree.HoeffdingTreeClassifier()
+        if shared_preprocessing:
+            # Standardize each event once and feed the same scaled features to every member
+            self.scaler = preprocessing.StandardScaler()
+            self.detectors = members
+            self.classifier = classifier
+        else:
+            self.scaler = None
+            self.detectors = [compose.Pipeline(preprocessing.StandardScaler(), m) for m in members]
+            self.classifier = compose.Pipeline(preprocessing.StandardScaler(), classifier)
+        # Set when a retrain swapped the shared scaler but kept the classifier, which goes on being
+        # fed features scaled the way it learned them
+        self.classifier_scaler = None
         # Drift detectors
         self.drift_detectors = [
             drift.ADWIN(),
             drift.DDM()
         ]
-        # Online classifier
-        self.classifier = compose.Pipeline(
-            preprocessing.StandardScaler(),
-            tree.HoeffdingTreeClassifier()
-        )
+        self.member_stats = [MemberStats(f"{type(m).__name__}[{i}]") for i, m in enumerate(members)]
+        self.set_latency_budget(latency_budget_ms)
+        self._events = 0
         # Feature importance tracker
         self.feature_importance = {}
-        self.metric = metrics.Accuracy()
+        self.retrainer = None
         self.logger.info("Advanced AdaptiveAttackDetector initialized with threshold: %s", threshold)
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # The retrainer holds a thread and a buffer of recent events, neither of which is model state
+        state = self.__dict__.copy()
+        state['retrainer'] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # Models pickled before shared preprocessing had per-member pipelines and no scaler
+        state.setdefault('scaler', None)
+        if 'member_stats' not in state:
+            state['member_stats'] = [MemberStats(f"member[{i}]") for i in range(len(state['detectors']))]
+        state.setdefault('latency_budget', None)
+        state.setdefault('_events', 0)
+        state.setdefault('retrainer', None)
+        state.setdefault('classifier_scaler', None)
+        # Older models carried an accuracy metric that nothing updated
+        state.pop('metric', None)
+        self.__dict__.update(state)
+
+    def state_dict(self) -> Dict[str, Any]:
+        """
+        Learned state only, for lean snapshots: no logger or other process-local objects.
+        """
+        state = {name: getattr(self, name) for name in self.STATE_FIELDS}
+        state['version'] = self.STATE_VERSION
+        return state
+
+    @classmethod
+    def from_state_dict(cls, state: Dict[str, Any]) -> 'AdaptiveAttackDetector':
+        """
+        Rebuild a detector from state_dict() output without constructing fresh members first.
+        """
+        version = state.get('version')
+        if version not in (1, cls.STATE_VERSION):
+            raise ValueError(f"Unsupported detector state version {version}, expected {cls.STATE_VERSION}")
+        if version == 1:
+            # Version 1 had no separate classifier scaler
+            state = dict(state, classifier_scaler=None)
+        detector = cls.__new__(cls)
+        detector.__dict__.update({name: state[name] for name in cls.STATE_FIELDS})
+        detector.logger = logging.getLogger(__name__)
+        detector.retrainer = None
+        return detector
+
+    def set_latency_budget(self, latency_budget_ms: Optional[float]) -> None:
+        """
+        Set the per-event ensemble score+learn budget in milliseconds; None or 0 disables it
+        and brings every member back.
+        """
+        self.latency_budget = latency_budget_ms / 1000 if latency_budget_ms else None
+        if self.latency_budget is None:
+            for stats in self.member_stats:
+                stats.active = True
+
+    def set_retraining(self, buffer_size: int, min_events: int = 500) -> None:
+        """
+        Keep the last `buffer_size` events and, when drift is detected, train a fresh ensemble on
+        them in the background and swap it in once it has caught up (see ShadowRetrainer).
+        A buffer size of 0 turns this off.
+        """
+        self.retrainer = ShadowRetrainer(self._build_shadow, self._adopt, buffer_size=buffer_size,
+                                         min_events=min_events) if buffer_size > 0 else None
+
+    def retraining_summary(self) -> Optional[Dict[str, Any]]:
+        return self.retrainer.summary() if self.retrainer is not None else None
+
+    def _build_shadow(self) -> 'AdaptiveAttackDetector':
+        return AdaptiveAttackDetector(threshold=self.threshold, shared_preprocessing=self.scaler is not None,
+                                      latency_budget_ms=self.latency_budget * 1000 if self.latency_budget else None)
+
+    def warm_one(self, features: Dict[str, Any], label: Optional[str] = None) -> None:
+        """
+        Learn from one event as live processing would, without predicting or logging.
+        Used to train a shadow detector on buffered events.
+        """
+        x = self._scale(features)
+        score = self._ensemble_anomaly_score(x)
+        self._learn_members(x)
+        if self.scaler is not None:
+            self.scaler.learn_one(features)
+        for detector in self.drift_detectors:
+            detector.update(score)
+        if label is not None:
+            self.classifier.learn_one(x, label)
+
+    def _adopt(self, shadow: 'AdaptiveAttackDetector') -> None:
+        # Runs on the scoring thread between two events, so no event sees a mix of old and new members.
+        # The classifier is only replaced if the shadow had labels to learn from; otherwise the old
+        # one keeps the scaler it learned with.
+        labeled = any(label is not None for _, label in self.retrainer.recent)
+        if labeled:
+            self.classifier = shadow.classifier
+            self.classifier_scaler = shadow.classifier_scaler
+        elif self.classifier_scaler is None:
+            self.classifier_scaler = self.scaler
+        self.scaler = shadow.scaler
+        self.detectors = shadow.detectors
+        self.member_stats = shadow.member_stats
+        self.drift_detectors = shadow.drift_detectors
+
+    def member_summary(self) -> List[Dict[str, Any]]:
+        return [stats.summary() for stats in self.member_stats]
+
+    def _scale(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        if self.scaler is None:
+            return features
+        return self.scaler.transform_one(features)
+
+    def _scale_for_classifier(self, features: Dict[str, Any], x: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        # `x` is the event already scaled by the shared scaler, if at hand
+        if self.classifier_scaler is not None:
+            return self.classifier_scaler.transform_one(features)
+        return x if x is not None else self._scale(features)
+
     def train_classifier(self, X: List[Dict[str, Any]], y: List[str]) -> None:
         for x, y_i in zip(X, y):
             try:
-                self.classifier.learn_one(x, y_i)
+                self.classifier.learn_one(self._scale_for_classifier(x), y_i)
                 self.logger.debug("Classifier trained on sample with label %s", y_i)
             except Exception as e:
                 self.logger.error("Error training classifier with features %s: %s", x, e)
 
-    def _ensemble_anomaly_score(self, features: Dict[str, Any]) -> float:
+    def score_one(self, features: Dict[str, Any]) -> float:
+        """
+        Ensemble anomaly score for raw features, without learning from them or updating any
+        member statistics.
+        """
+        return self._ensemble_anomaly_score(self._scale(features), update_stats=False)
+
+    def _ensemble_anomaly_score(self, x: Dict[str, Any], update_stats: bool = True) -> float:
         scores = []
+        scored = []
         for i, detector in enumerate(self.detectors):
+            stats = self.member_stats[i]
+            if not stats.active:
+                if update_stats:
+                    stats.skipped += 1
+                continue
             try:
-                score = detector.score_one(features)
+                start = time.perf_counter()
+                score = detector.score_one(x)
+                if update_stats:
+                    stats.record_score(time.perf_counter() - start)
                 scores.append(score)
+                scored.append(stats)
             except Exception as e:
                 self.logger.error("Detector %s failed to score: %s", i, e)
         if not scores:
             return 0.0
-        # Voting: mean of normalized scores
-        min_score, max_score = min(scores), max(scores)
-        if max_score - min_score > 1e-6:
-            norm_scores = [(s - min_score) / (max_score - min_score) for s in scores]
-        else:
-            norm_scores = scores
-        return sum(norm_scores) / len(norm_scores)
+        # Voting: mean of the scores, each normalized against its own member's recent range.
+        # Normalizing across members instead would turn two active members into {0, 1} -> 0.5.
+        if not update_stats:
+            norm_scores = [stats.scale(s) for stats, s in zip(scored, scores)]
+            return sum(norm_scores) / len(norm_scores)
+        norm_scores = [stats.normalize(s) for stats, s in zip(scored, scores)]
+        ensemble_score = sum(norm_scores) / len(norm_scores)
+        for stats, norm_score in zip(scored, norm_scores):
+            stats.record_agreement(abs(norm_score - ensemble_score))
+        return ensemble_score
+
+    def _learn_members(self, x: Dict[str, Any]) -> None:
+        for i, detector in enumerate(self.detectors):
+            stats = self.member_stats[i]
+            if not stats.active and self._events % self.PARKED_LEARN_EVERY:
+                continue
+            try:
+                start = time.perf_counter()
+                detector.learn_one(x)
+                stats.record_learn(time.perf_counter() - start)
+            except Exception as e:
+                self.logger.error("Detector %s failed to learn: %s", i, e)
+        self._events += 1
+        if self.latency_budget is not None and self._events % self.BUDGET_CHECK_EVERY == 0:
+            self._apply_latency_budget()
+
+    def _apply_latency_budget(self) -> None:
+        """
+        Park the member with the worst cost per unit of contribution while the active ensemble
+        is over budget, and bring parked members back once there is room for them again.
+        """
+        active = [s for s in self.member_stats if s.active]
+        parked = [s for s in self.member_stats if not s.active]
+        cost = sum(s.cost for s in active)
+        if cost > self.latency_budget and len(active) > self.MIN_ACTIVE_MEMBERS:
+            victim = max(active, key=lambda s: s.cost / (s.disagreement + 1e-3))
+            victim.active = False
+            self.logger.warning("Ensemble over latency budget (%.2fms > %.2fms); parking %s",
+                                cost * 1000, self.latency_budget * 1000, victim.name)
+        elif parked:
+            # Bring back the cheapest parked member if it fits with headroom to spare
+            candidate = min(parked, key=lambda s: s.cost)
+            if cost + candidate.cost < 0.8 * self.latency_budget:
+                candidate.active = True
+                self.logger.info("Ensemble back within latency budget; restoring %s", candidate.name)
 
     def _update_drift_detectors(self, score: float) -> bool:
         drift_detected = False
@@ -71,6 +369,7 @@ class AdaptiveAttackDetector:
                 detector.update(score)
                 if hasattr(detector, 'drift_detected') and detector.drift_detected:
                     self.logger.warning(f"Drift detected by {type(detector).__name__}")
+                    telemetry.DRIFT_EVENTS.labels(type(detector).__name__).inc()
                     drift_detected = True
             except Exception as e:
                 self.logger.error("Drift detector %s failed: %s", i, e)
@@ -90,6 +389,57 @@ class AdaptiveAttackDetector:
     def get_feature_importance(self) -> Dict[str, float]:
         return dict(sorted(self.feature_importance.items(), key=lambda x: -x[1]))
 
+    def _process_one(self, features: Dict[str, Any]) -> Tuple[float, str, Dict[str, Any], bool]:
+        # Score, learn, drift and importance updates, then classifier prediction for one event.
+        # With shared preprocessing the event is scaled once, with the scaler's state before this
+        # event, and the same scaled features are used to score, learn and classify (unless a retrain
+        # kept the classifier, which then has its own scaler).
+        started = time.perf_counter()
+        x = self._scale(features)
+        x_classifier = self._scale_for_classifier(features, x)
+        anomaly_score = self._ensemble_anomaly_score(x)
+        scored = time.perf_counter()
+        telemetry.stage(telemetry.ENSEMBLE_SCORE).observe(scored - started)
+        self.logger.info("Ensemble anomaly score: %.2f", anomaly_score)
+
+        # Update all detectors
+        self._learn_members(x)
+        if self.scaler is not None:
+            self.scaler.learn_one(features)
+        if self.classifier_scaler is not None:
+            self.classifier_scaler.learn_one(features)
+        telemetry.stage(telemetry.ENSEMBLE_LEARN).observe(time.perf_counter() - scored)
+
+        # Update drift detectors
+        drift_detected = self._update_drift_detectors(anomaly_score)
+        if drift_detected and self.retrainer is None:
+            self.logger.warning("Concept drift detected! Model may need retraining.")
+
+        # Update feature importance
+        self._update_feature_importance(features, anomaly_score)
+
+        # Predict attack type
+        try:
+            started = time.perf_counter()
+            attack_type = self.classifier.predict_one(x_classifier)
+            telemetry.stage(telemetry.CLASSIFIER_PREDICT).observe(time.perf_counter() - started)
+            if attack_type is None or (isinstance(attack_type, str) and attack_type.lower() == "normal"):
+                attack_type = "generic_attack"
+            self.logger.info("Attack detected: type %s, score %.2f", attack_type, anomaly_score)
+        except Exception as e:
+            self.logger.error("Classifier prediction failed with features %s: %s", features, e)
+            attack_type = "generic_attack"
+        return anomaly_score, attack_type, x_classifier, drift_detected
+
+    def _after_event(self, features: Dict[str, Any], label: Optional[str], drift_detected: bool) -> None:
+        # Buffer the event for retraining, and start or finish a retrain if one is due
+        if self.retrainer is None:
+            return
+        self.retrainer.observe(features, label)
+        if drift_detected:
+            self.retrainer.on_drift()
+        self.retrainer.poll()
+
     def process_log(self, features: Dict[str, Any]) -> Tuple[float, str, Dict[str, float]]:
         """
         Process a single log entry, returning anomaly score, predicted attack type, and feature importances.
@@ -98,40 +448,42 @@ class AdaptiveAttackDetector:
             if not isinstance(features, dict):
                 self.logger.error("Features must be a dictionary, got: %s", type(features))
                 return 0.0, 'unknown', {}
-
-            # Compute ensemble anomaly score
-            anomaly_score = self._ensemble_anomaly_score(features)
-            self.logger.info("Ensemble anomaly score: %.2f", anomaly_score)
-
-            # Update all detectors
-            for i, detector in enumerate(self.detectors):
-                try:
-                    detector.learn_one(features)
-                except Exception as e:
-                    self.logger.error("Detector %s failed to learn: %s", i, e)
-
-            # Update drift detectors
-            drift_detected = self._update_drift_detectors(anomaly_score)
-            if drift_detected:
-                self.logger.warning("Concept drift detected! Model may need retraining.")
-
-            # Update feature importance
-            self._update_feature_importance(features, anomaly_score)
-
-            # Predict attack type
-            try:
-                attack_type = self.classifier.predict_one(features)
-                if attack_type is None or (isinstance(attack_type, str) and attack_type.lower() == "normal"):
-                    attack_type = "generic_attack"
-                self.logger.info("Attack detected: type %s, score %.2f", attack_type, anomaly_score)
-            except Exception as e:
-                self.logger.error("Classifier prediction failed with features %s: %s", features, e)
-                attack_type = "generic_attack"
-
+            anomaly_score, attack_type, _, drift_detected = self._process_one(features)
+            self._after_event(features, None, drift_detected)
             return anomaly_score, attack_type, self.get_feature_importance()
         except Exception as e:
             self.logger.error("Unexpected error in process_log: %s", e)
             return 0.0, 'unknown', {}
 
-
-
+    def process_batch(self, batch: List[Dict[str, Any]],
+                      labels: Optional[List[str]] = None) -> List[Tuple[float, str, Dict[str, float]]]:
+        """
+        Process a micro-batch of log entries in arrival order.
+        Each event is scored, learned and classified exactly as process_log would, so later
+        events see the state left by earlier ones. When heuristic labels are given, the classifier
+        is retrained on any mismatching prediction before the next event is classified.
+        Feature importances are sorted once for the whole batch.
+        """
+        results = []
+        for i, features in enumerate(batch):
+            try:
+                if not isinstance(features, dict):
+                    self.logger.error("Features must be a dictionary, got: %s", type(features))
+                    results.append((0.0, 'unknown'))
+                    continue
+                anomaly_score, attack_type, x, drift_detected = self._process_one(features)
+                if labels is not None and attack_type.lower() != labels[i].lower():
+                    # Reuse the already scaled features rather than scaling the event again
+                    try:
+                        started = time.perf_counter()
+                        self.classifier.learn_one(x, labels[i])
+                        telemetry.stage(telemetry.CLASSIFIER_LEARN).observe(time.perf_counter() - started)
+                    except Exception as e:
+                        self.logger.error("Error training classifier with features %s: %s", features, e)
+                self._after_event(features, labels[i] if labels is not None else None, drift_detected)
+                results.append((anomaly_score, attack_type))
+            except Exception as e:
+                self.logger.error("Unexpected error in process_batch: %s", e)
+                results.append((0.0, 'unknown'))
+        importance = self.get_feature_importance()
+        return [(score, attack_type, importance) for score, attack_type in results]
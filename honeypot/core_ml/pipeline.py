@@ -0,0 +1,123 @@
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from ip_state import IPStateStore
+from telemetry import RELABELS, TRANSFORM, stage
+
+logger = logging.getLogger(__name__)
+
+# Interarrival assumed for the first event seen from an IP
+DEFAULT_INTERARRIVAL = 100
+
+_EPOCH = datetime(1970, 1, 1)
+
+def to_epoch(timestamp: Union[str, datetime]) -> float:
+    """
+    Convert an ISO timestamp or datetime to epoch seconds. Naive timestamps are treated as UTC
+    so that differences match plain datetime subtraction.
+    """
+    dt = timestamp if isinstance(timestamp, datetime) else datetime.fromisoformat(timestamp)
+    if dt.tzinfo is not None:
+        return dt.timestamp()
+    return (dt - _EPOCH).total_seconds()
+
+def compute_interarrival(log: Dict[str, Any], ip_state: IPStateStore,
+                         timestamp: Optional[datetime] = None) -> Tuple[str, float]:
+    """
+    Return the source IP of a log and the seconds since the previous log from that IP,
+    recording the log in the per-IP state store. Pass the parsed timestamp if already known.
+    """
+    ip = log.get('source_ip', 'unknown')
+    interarrival = ip_state.interarrival(ip, to_epoch(timestamp or log['timestamp']), DEFAULT_INTERARRIVAL)
+    if log.get('coalesced_events', 1) > 1:
+        # A merged record (see coalescing.py) stands for a burst; its pace is the gap inside it
+        interarrival = log['mean_interarrival']
+    return ip, interarrival
+
+def heuristic_label(features: Dict[str, Any], interarrival: float) -> str:
+    """
+    Label a log from its features: commands mean injection, rapid repeats mean brute force.
+    """
+    if features.get('commands') and len(features.get('commands')) > 0:
+        return 'command_injection'
+    if interarrival < 3:
+        return 'brute_force'
+    return 'suspicious'
+
+def extract_events(logs: List[Dict[str, Any]], fe, ip_state: IPStateStore,
+                   timings: Optional[Dict[str, List[float]]] = None) -> List[tuple]:
+    """
+    First half of score_logs: per-IP interarrival, features, heuristic label and location for
+    each log, in arrival order. Logs that fail are logged and dropped. Uses the feature
+    extractor and per-IP state, but not the detector.
+    """
+    events = []
+    transform = stage(TRANSFORM)
+    for log in logs:
+        started = time.perf_counter()
+        try:
+            # Parse the timestamp once for both interarrival and time-of-day features
+            timestamp = datetime.fromisoformat(log['timestamp'])
+            ip, interarrival = compute_interarrival(log, ip_state, timestamp)
+            transform_started = time.perf_counter()
+            # One GeoIP resolution serves both the country risk feature and the event's location
+            enrichment = fe.enrich(ip)
+            features = fe.transform(log, timestamp=timestamp, enrichment=enrichment)
+            transform.observe(time.perf_counter() - transform_started)
+            features['interarrival_time'] = interarrival
+            events.append((ip, interarrival, features, heuristic_label(features, interarrival), enrichment['location']))
+        except Exception as e:
+            logger.error("Error processing log from %s: %s", log.get('source_ip', 'unknown'), str(e))
+        if timings is not None:
+            timings['features'].append(time.perf_counter() - started)
+    return events
+
+def detect_events(events: List[tuple], model, timings: Optional[Dict[str, List[float]]] = None) -> List[Dict[str, Any]]:
+    """
+    Second half of score_logs: run extracted events through the detector and build detections.
+    Uses only the detector.
+    """
+    if not events:
+        return []
+    started = time.perf_counter()
+    results = model.process_batch([e[2] for e in events], labels=[e[3] for e in events])
+    if timings is not None:
+        # The detector works on the whole batch; attribute its time evenly to the events
+        per_event = (time.perf_counter() - started) / len(events)
+        timings['detect'].extend([per_event] * len(events))
+    detections = []
+    for (ip, interarrival, features, label, location), (score, attack_type, feature_importance) in zip(events, results):
+        # Log top features for this anomaly
+        top_features = list(feature_importance.items())[:5]
+        logger.info("Top contributing features: %s", top_features)
+
+        # The detector already retrained the classifier on any mismatch with the heuristic label
+        if attack_type.lower() != label.lower():
+            RELABELS.labels(attack_type, label).inc()
+            logger.info("Auto-updated classifier: changed %s to %s for log from %s",
+                        attack_type, label, ip)
+        detections.append({
+            'ip': ip,
+            'location': location,
+            'score': score,
+            'predicted_type': attack_type,
+            'attack_type': label,
+            'interarrival': interarrival,
+            'top_features': top_features,
+        })
+    return detections
+
+def score_logs(logs: List[Dict[str, Any]], fe, model, ip_state: IPStateStore,
+               timings: Optional[Dict[str, List[float]]] = None) -> List[Dict[str, Any]]:
+    """
+    Extract features for a batch of logs and run them through the detector.
+    Interarrival times and heuristic labels are computed per log in arrival order, and the
+    detector relabels each event before classifying the next, exactly as in per-log processing.
+    Returns one detection dict per successfully processed log, with the heuristic label as
+    its attack type.
+    If `timings` is given, per-event seconds spent in feature extraction and detection are
+    appended to its 'features' and 'detect' lists.
+    """
+    return detect_events(extract_events(logs, fe, ip_state, timings), model, timings)
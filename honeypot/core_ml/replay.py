@@ -0,0 +1,246 @@
+import argparse
+import heapq
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from checkpoint import dump_snapshot, load_checkpoint
+from coalescing import MODES, EventCoalescer
+from Feature import FeatureExtractor
+from ip_state import IPStateStore
+from log_formats import NORMALIZERS, read_events
+from logging_setup import configure_logging
+from main import SHARED_PREPROCESSING, THRESHOLD, respond
+from model import AdaptiveAttackDetector
+from Performance_Checker import PerformanceMonitor
+from pipeline import score_logs, to_epoch
+from response import ResponseEngine
+from response_sink import create_sink
+from sharding import ShardModelSet
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('features', 'detect', 'respond', 'total')
+
+def merge_events(paths: List[str], fmt: str = 'auto') -> Iterator[Dict[str, Any]]:
+    """
+    Events from every file in timestamp order. Each file is read lazily and is expected to be
+    in time order already, as honeypot logs and exports are.
+    """
+    return heapq.merge(*(read_events(path, fmt) for path in paths), key=lambda event: event['timestamp'])
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def latency_summary(timings: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    """
+    Per-stage latency percentiles in milliseconds.
+    """
+    summary = {}
+    for stage in STAGES:
+        values = sorted(timings.get(stage, []))
+        summary[stage] = {
+            'count': len(values),
+            'mean_ms': 1000 * sum(values) / len(values) if values else 0.0,
+            'p50_ms': 1000 * percentile(values, 50),
+            'p90_ms': 1000 * percentile(values, 90),
+            'p99_ms': 1000 * percentile(values, 99),
+            'max_ms': 1000 * (values[-1] if values else 0.0),
+        }
+    return summary
+
+class Pacer:
+    """
+    Sleeps so that events are released at `speed` times the rate they were recorded.
+    A speed of 0 replays as fast as possible.
+    """
+    def __init__(self, speed: float = 0.0):
+        self.speed = speed
+        self._origin = None
+
+    def wait(self, timestamp: str) -> None:
+        if self.speed <= 0:
+            return
+        event_time = to_epoch(timestamp)
+        if self._origin is None:
+            self._origin = (event_time, time.monotonic())
+            return
+        due = self._origin[1] + (event_time - self._origin[0]) / self.speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+def _batches(events: Iterable[Dict[str, Any]], batch_size: int, pacer: Pacer, limit: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for count, event in enumerate(events, 1):
+        pacer.wait(event['timestamp'])
+        batch.append(event)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+        if limit and count >= limit:
+            break
+    if batch:
+        yield batch
+
+def _coalesced(batches: Iterator[List[Dict[str, Any]]], coalescer) -> Iterator[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+    # A frozen arrival clock leaves closing to event time, so windows close the same way at any speed
+    for batch in batches:
+        yield batch, coalescer.add_many(batch, now=0.0)
+    yield [], coalescer.flush()
+
+def replay(events: Iterable[Dict[str, Any]], fe, model, responder, monitor, ip_state: IPStateStore,
+           speed: float = 0.0, batch_size: int = 1, limit: int = 0, coalescer=None) -> Dict[str, Any]:
+    """
+    Run recorded events through the live feature -> detector -> response path and return
+    throughput, per-stage latency percentiles and every detection.
+    With a coalescer, batches are merged by it first and its counts are added to the result.
+    `model` may be a ShardModelSet, to score each log with its shard's detector.
+    """
+    timings = {stage: [] for stage in STAGES}
+    detections = []
+    events_read = 0
+    busy = 0.0
+    started = time.perf_counter()
+    batches = _batches(events, batch_size, Pacer(speed), limit)
+    if coalescer is not None:
+        batches = _coalesced(batches, coalescer)
+    else:
+        batches = ((batch, batch) for batch in batches)
+    for batch, logs in batches:
+        events_read += len(batch)
+        batch_started = time.perf_counter()
+        if not logs:
+            scored = []
+        elif isinstance(model, ShardModelSet):
+            scored = model.score_logs(logs, fe, ip_state, timings=timings)
+        else:
+            scored = score_logs(logs, fe, model, ip_state, timings=timings)
+        if scored:
+            respond_started = time.perf_counter()
+            respond(scored, responder, monitor)
+            timings['respond'].extend([(time.perf_counter() - respond_started) / len(scored)] * len(scored))
+            detections.extend(scored)
+        elapsed = time.perf_counter() - batch_started
+        busy += elapsed
+        # Every event in a batch waits for the whole batch
+        timings['total'].extend([elapsed] * len(batch))
+    wall = time.perf_counter() - started
+    result = {
+        'events': events_read,
+        'detections': len(detections),
+        'wall_seconds': wall,
+        'busy_seconds': busy,
+        'events_per_second': events_read / wall if wall > 0 else 0.0,
+        'busy_events_per_second': events_read / busy if busy > 0 else 0.0,
+        'latency': latency_summary(timings),
+        'attack_types': dict(Counter(d['attack_type'] for d in detections)),
+        'predicted_types': dict(Counter(d['predicted_type'] for d in detections)),
+        'top_ips': Counter(d['ip'] for d in detections).most_common(10),
+        'detection_list': detections,
+    }
+    if coalescer is not None:
+        result['coalescing'] = coalescer.summary()
+    return result
+
+def print_summary(result: Dict[str, Any], out=sys.stdout) -> None:
+    print(f"Replayed {result['events']} events -> {result['detections']} detections "
+          f"in {result['wall_seconds']:.2f}s ({result['events_per_second']:.1f} events/s wall, "
+          f"{result['busy_events_per_second']:.1f} events/s busy)", file=out)
+    print(f"{'stage':<10}{'count':>9}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)", file=out)
+    for stage, s in result['latency'].items():
+        print(f"{stage:<10}{s['count']:>9}{s['mean_ms']:>10.3f}{s['p50_ms']:>10.3f}"
+              f"{s['p90_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['max_ms']:>10.3f}", file=out)
+    print(f"Attack types: {result['attack_types']}", file=out)
+    print(f"Predicted types: {result['predicted_types']}", file=out)
+    print(f"Top source IPs: {result['top_ips']}", file=out)
+    if 'coalescing' in result:
+        c = result['coalescing']
+        print(f"Coalescing: {c['events_in']} events -> {c['events_out']} scored "
+              f"({c['reduction']:.1%} fewer, {c['passed_through']} passed through)", file=out)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay recorded honeypot events through the detection pipeline.")
+    parser.add_argument('paths', nargs='+', help="JSONL, JSON array or CSV files (records, mongoexport or Heralding logs)")
+    parser.add_argument('--format', default='auto', choices=['auto'] + sorted(NORMALIZERS),
+                        help="input format (default: detect from the first event of each file)")
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help="replay at this multiple of recorded time; 0 = as fast as possible (default)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default 0)")
+    parser.add_argument('--batch-size', type=int, default=1, help="events per pipeline batch (default 1)")
+    parser.add_argument('--limit', type=int, default=0, help="stop after this many events (default: all)")
+    parser.add_argument('--coalesce-window', type=float, default=0.0,
+                        help="merge command-less events per source IP, protocol and port over this many "
+                             "seconds of event time before scoring (default 0, off)")
+    parser.add_argument('--coalesce-mode', default='tumbling', choices=MODES, help="coalescing window type (default tumbling)")
+    parser.add_argument('--model', help="start from this model checkpoint instead of a new model")
+    parser.add_argument('--save-model', help="save the model here after the replay")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="score with one model per source IP shard, as NUM_SHARDS does; --model and "
+                             "--save-model then name the model.pkl the model.shardN.pkl files sit beside (default 1)")
+    parser.add_argument('--responses', default='replay_responses.jsonl', help="response log written during the replay")
+    parser.add_argument('--detections', help="write every detection here as JSON lines")
+    parser.add_argument('--summary-json', help="write the summary here as JSON")
+    parser.add_argument('--report', help="render the performance report to this PNG")
+    parser.add_argument('--log-level', default='WARNING', help="log level (default WARNING)")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    configure_logging("replay.log", level=args.log_level.upper())
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    if args.shards > 1 and args.model:
+        model = ShardModelSet.load(args.model, args.shards)
+        logger.info("Loaded %d shard models beside %s", args.shards, args.model)
+    elif args.shards > 1:
+        model = ShardModelSet([AdaptiveAttackDetector(threshold=THRESHOLD, shared_preprocessing=SHARED_PREPROCESSING)
+                               for _ in range(args.shards)])
+    elif args.model:
+        model = load_checkpoint(args.model, AdaptiveAttackDetector.from_state_dict)
+        logger.info("Loaded model from %s", args.model)
+    else:
+        model = AdaptiveAttackDetector(threshold=THRESHOLD, shared_preprocessing=SHARED_PREPROCESSING)
+    fe = FeatureExtractor()
+    responder = ResponseEngine(sink=create_sink('jsonl', args.responses))
+    monitor = PerformanceMonitor(report_path=args.report or 'monitoring_report.png')
+    ip_state = IPStateStore()
+
+    try:
+        result = replay(merge_events(args.paths, args.format), fe, model, responder, monitor, ip_state,
+                        speed=args.speed, batch_size=args.batch_size, limit=args.limit,
+                        coalescer=EventCoalescer(args.coalesce_window, args.coalesce_mode) if args.coalesce_window > 0 else None)
+    finally:
+        responder.close()
+    detections = result.pop('detection_list')
+
+    print_summary(result)
+    if args.detections:
+        with open(args.detections, 'w', encoding='utf-8') as f:
+            for detection in detections:
+                f.write(json.dumps(detection, default=str) + "\n")
+    if args.summary_json:
+        with open(args.summary_json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    if args.report:
+        monitor.generate_report()
+    if args.save_model and isinstance(model, ShardModelSet):
+        model.save(args.save_model)
+    elif args.save_model:
+        with open(args.save_model, 'wb') as f:
+            f.write(dump_snapshot(model))
+    return result
+
+if __name__ == "__main__":
+    main()
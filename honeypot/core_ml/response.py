@@ -1,19 +1,27 @@
 import logging
+import time
 from datetime import datetime
-import numpy as np
 from collections import defaultdict
-import csv
-import os
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
+
+from response_sink import ResponseSink, CSVResponseSink
+from enforcement import EnforcementEngine
+from telemetry import DETERMINE_RESPONSE, stage
 
 logger = logging.getLogger(__name__)
 
+PROTECTION_INSTRUCTIONS = {
+    'brute_force': "Temporarily block the IP and require captcha verification to mitigate rapid brute force attempts.",
+    'command_injection': "Permanently block the IP and initiate deep network inspection to prevent command injection and potential malware.",
+    'suspicious': "Monitor the IP activity closely and analyze further to determine if additional actions are necessary."
+}
+
 class ResponseEngine:
     """
     Decides and logs responses to detected attacks, with adaptive thresholds and strategies.
     """
-    def __init__(self, initial_thresholds: Optional[Dict[str, float]] = None, learning_rate: float = 0.1):
-        logging.basicConfig(level=logging.INFO)
+    def __init__(self, initial_thresholds: Optional[Dict[str, float]] = None, learning_rate: float = 0.1,
+                 sink: Optional[ResponseSink] = None, enforcer: Optional[EnforcementEngine] = None):
         self.logger = logging.getLogger(__name__)
         default_thresholds = {'brute_force': 0.7, 'command_injection': 0.9, 'suspicious': 0.5}
         thresholds = initial_thresholds or default_thresholds
@@ -42,16 +50,54 @@ class ResponseEngine:
         }
         self.learning_rate = learning_rate
         self.feedback_memory = defaultdict(list)
+        # Non-alert responses are written through a buffered background sink
+        self.sink = sink or CSVResponseSink("malicious_attempts.csv")
+        # Block actions are also handed to the enforcement engine, if any
+        self.enforcer = enforcer
         self.logger.info("ResponseEngine initialized successfully")
 
     def determine_response(self, attack_type: str, confidence: float, context: Optional[Dict[str, Any]] = None) -> List[str]:
         """
         Determine the appropriate response for a detected attack, given its type, confidence, and context.
         """
+        started = time.perf_counter()
+        actions, row = self._decide(attack_type, confidence, context)
+        if row is not None:
+            self.sink.write(row)
+        if self.enforcer is not None and context and context.get('ip'):
+            self.enforcer.submit(context['ip'], actions)
+        stage(DETERMINE_RESPONSE).observe(time.perf_counter() - started)
+        return actions
+
+    def determine_responses(self, detections: List[Tuple[str, float, Optional[Dict[str, Any]]]]) -> List[List[str]]:
+        """
+        Determine responses for a batch of (attack_type, confidence, context) detections.
+        Decisions are made in order, as with determine_response, and all resulting rows
+        are handed to the response sink together.
+        """
+        all_actions = []
+        rows = []
+        timing = stage(DETERMINE_RESPONSE)
+        for attack_type, confidence, context in detections:
+            started = time.perf_counter()
+            actions, row = self._decide(attack_type, confidence, context)
+            timing.observe(time.perf_counter() - started)
+            all_actions.append(actions)
+            if row is not None:
+                rows.append(row)
+        if rows:
+            self.sink.write_many(rows)
+        if self.enforcer is not None:
+            self.enforcer.submit_many([(context['ip'], actions) for (_, _, context), actions
+                                       in zip(detections, all_actions) if context and context.get('ip')])
+        return all_actions
+
+    def _decide(self, attack_type: str, confidence: float,
+                context: Optional[Dict[str, Any]]) -> Tuple[List[str], Optional[Dict[str, Any]]]:
         try:
             if attack_type not in self.strategies:
                 self.logger.warning("Unknown attack type: %s", attack_type)
-                return ['alert']
+                return ['alert'], None
             strategy = self.strategies[attack_type]
             self.logger.info("Determining response for %s with confidence %.2f", attack_type, confidence)
             effective_threshold = self._adjust_threshold(attack_type, confidence)
@@ -61,18 +107,17 @@ class ResponseEngine:
             else:
                 actions = ['alert']
                 self.logger.info("Low confidence, issuing alert for %s", attack_type)
-            self._log_response(attack_type, confidence, actions, context)
-            return actions
+            return actions, self._log_response(attack_type, confidence, actions, context)
         except Exception as e:
             self.logger.error("Error determining response: %s", e)
-            return ['alert']
+            return ['alert'], None
 
     def _adjust_threshold(self, attack_type: str, current_confidence: float) -> float:
         strategy = self.strategies[attack_type]
         success_history = strategy['success_history']
         if len(success_history) < 5:
             return strategy['threshold']
-        success_rate = np.mean(success_history[-5:])
+        success_rate = sum(success_history[-5:]) / 5
         self.logger.debug("Success rate for %s: %.2f", attack_type, success_rate)
         if success_rate < 0.5:
             adjusted_threshold = max(0.1, strategy['threshold'] - self.learning_rate)
@@ -116,42 +161,33 @@ class ResponseEngine:
             self.logger.info("Added alert to suspicious strategy", attack_type)
         strategy['learned_response'] = strategy['actions'].copy()
 
-    def _log_response(self, attack_type: str, confidence: float, actions: List[str], context: Optional[Dict[str, Any]]) -> None:
-        log_entry = {
-            'timestamp': datetime.now(),
+    def _log_response(self, attack_type: str, confidence: float, actions: List[str],
+                      context: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Response logged: %s", {
+                'timestamp': datetime.now(),
+                'attack_type': attack_type,
+                'confidence': confidence,
+                'actions': actions,
+                'context': context or {}
+            })
+        # Only log to the sink if actions != ['alert']
+        if actions == ['alert']:
+            return None
+        context = context or {}
+        return {
+            'ip': context.get("ip", "Unknown"),
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'attack_type': attack_type,
-            'confidence': confidence,
-            'actions': actions,
-            'context': context or {}
+            'location': context.get("location", "Unknown"),
+            'top_features': str(context.get("top_features", [])),
+            'recommended_steps': PROTECTION_INSTRUCTIONS.get(attack_type, ", ".join(actions)),
         }
-        self.logger.info("Response logged: %s", log_entry)
-        # Only log to CSV if actions != ['alert']
-        if actions != ['alert']:
-            ip = context.get("ip", "Unknown") if context else "Unknown"
-            location = context.get("location", "Unknown") if context else "Unknown"
-            top_features = context.get("top_features", []) if context else []
-            timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            protection_instructions = {
-                'brute_force': "Temporarily block the IP and require captcha verification to mitigate rapid brute force attempts.",
-                'command_injection': "Permanently block the IP and initiate deep network inspection to prevent command injection and potential malware.",
-                'suspicious': "Monitor the IP activity closely and analyze further to determine if additional actions are necessary."
-            }
-            recommended_steps = protection_instructions.get(attack_type, ", ".join(actions))
-            csv_filename = "malicious_attempts.csv"
-            file_exists = os.path.isfile(csv_filename)
-            try:
-                with open(csv_filename, "a", newline="") as csvfile:
-                    writer = csv.writer(csvfile)
-                    if not file_exists:
-                        writer.writerow(["IP", "Time", "Attack Type", "Location", "Top Features", "Recommended Steps"])
-                    writer.writerow([ip, timestamp_str, attack_type, location, str(top_features), recommended_steps])
-                self.logger.info("Malicious attempt logged to CSV with recommended steps and top features.")
-            except Exception as csv_err:
-                self.logger.error("Error writing to CSV: %s", csv_err)
-
-
-
-
-
-
 
+    def close(self) -> None:
+        """
+        Flush and close the response sink and enforcement engine.
+        """
+        self.sink.close()
+        if self.enforcer is not None:
+            self.enforcer.close()
@@ -0,0 +1,204 @@
+import atexit
+import csv
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from telemetry import SINK_WRITE, stage
+
+logger = logging.getLogger(__name__)
+
+# Column keys of a response row, and their CSV header names
+COLUMNS = ['ip', 'time', 'attack_type', 'location', 'top_features', 'recommended_steps']
+CSV_HEADER = ["IP", "Time", "Attack Type", "Location", "Top Features", "Recommended Steps"]
+
+_STOP = object()
+
+class ResponseSink:
+    """
+    Buffered, rotating sink for logged responses.
+    Rows are queued by the caller and written by a background thread that keeps one file open
+    and flushes every `flush_rows` rows or `flush_interval` seconds, whichever comes first.
+    The file is rotated to a timestamped name once it exceeds `max_bytes` or is older than
+    `rotate_seconds` (0 disables either), keeping `backup_count` rotated files.
+    close() drains every queued row before returning, and is also run at interpreter exit.
+    """
+    suffix = ''
+
+    def __init__(self, path: str, flush_rows: int = 500, flush_interval: float = 1.0,
+                 max_bytes: int = 0, rotate_seconds: float = 0, backup_count: int = 5):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.rows_written = 0
+        self._queue = queue.Queue()
+        self._opened_at = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"{type(self).__name__}-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._queue.put(row)
+
+    def write_many(self, rows: List[Dict[str, Any]]) -> None:
+        for row in rows:
+            self._queue.put(row)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        buffer = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(buffer)
+                self._close_file()
+                return
+            if item is not None:
+                buffer.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if buffer and (len(buffer) >= self.flush_rows or time.monotonic() >= deadline):
+                self._flush(buffer)
+                buffer = []
+                deadline = None
+
+    def _flush(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        try:
+            if self._opened_at is None:
+                self._open_file()
+                self._opened_at = time.monotonic()
+            started = time.perf_counter()
+            self._write_rows(rows)
+            stage(SINK_WRITE).observe(time.perf_counter() - started)
+            self.rows_written += len(rows)
+            logger.debug("Wrote %d response rows to %s", len(rows), self.path)
+            if self._rotation_due():
+                self._rotate()
+        except Exception as e:
+            logger.error("Error writing %d response rows to %s: %s", len(rows), self.path, e)
+
+    def _rotation_due(self) -> bool:
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.monotonic() - self._opened_at >= self.rotate_seconds
+
+    def _rotate(self) -> None:
+        self._close_file()
+        root, ext = os.path.splitext(self.path)
+        os.replace(self.path, f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{ext}")
+        rotated = sorted(glob.glob(f"{glob.escape(root)}-*{ext}"), reverse=True)
+        for old in rotated[self.backup_count:]:
+            os.remove(old)
+        logger.info("Rotated response log %s", self.path)
+
+    def _close_file(self) -> None:
+        if self._opened_at is not None:
+            self._close_handle()
+            self._opened_at = None
+
+    # Format-specific hooks
+    def _open_file(self) -> None:
+        raise NotImplementedError
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def _close_handle(self) -> None:
+        raise NotImplementedError
+
+class CSVResponseSink(ResponseSink):
+    """
+    Appends rows to a CSV file with the original malicious_attempts.csv columns.
+    """
+    def _open_file(self) -> None:
+        self._file = open(self.path, "a", newline="")
+        self._writer = csv.writer(self._file)
+        if self._file.tell() == 0:
+            self._writer.writerow(CSV_HEADER)
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        self._writer.writerows([[row[c] for c in COLUMNS] for row in rows])
+        self._file.flush()
+
+    def _close_handle(self) -> None:
+        self._file.close()
+
+class JSONLResponseSink(ResponseSink):
+    """
+    Appends one JSON object per row.
+    """
+    def _open_file(self) -> None:
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        self._file.write("".join(json.dumps(row, default=str) + "\n" for row in rows))
+        self._file.flush()
+
+    def _close_handle(self) -> None:
+        self._file.close()
+
+class ParquetResponseSink(ResponseSink):
+    """
+    Writes each flush as a Parquet row group. Requires pyarrow. A Parquet file cannot be
+    appended to once closed, so every open starts a new file and the previous one is rotated.
+    """
+    def __init__(self, path: str, **kwargs):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("ParquetResponseSink requires pyarrow (pip install pyarrow)") from e
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._schema = pyarrow.schema([(c, pyarrow.string()) for c in COLUMNS])
+        super().__init__(path, **kwargs)
+
+    def _open_file(self) -> None:
+        if os.path.exists(self.path):
+            self._rotate()
+        self._writer = self._pq.ParquetWriter(self.path, self._schema)
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        columns = {c: [str(row[c]) for row in rows] for c in COLUMNS}
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+
+    def _rotation_due(self) -> bool:
+        # Size is only known once the footer is written, so rotate on time alone
+        return bool(self.rotate_seconds) and time.monotonic() - self._opened_at >= self.rotate_seconds
+
+    def _close_handle(self) -> None:
+        self._writer.close()
+
+SINKS = {
+    'csv': CSVResponseSink,
+    'jsonl': JSONLResponseSink,
+    'parquet': ParquetResponseSink,
+}
+
+def create_sink(fmt: str, path: str, **kwargs) -> ResponseSink:
+    if fmt not in SINKS:
+        raise ValueError(f"Unknown response sink format '{fmt}', expected one of {sorted(SINKS)}")
+    return SINKS[fmt](path, **kwargs)
@@ -0,0 +1,131 @@
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+class ResumeTokenStore:
+    """
+    Durable home for the change stream resume token.
+    update() is called after every processed batch but only writes every `every_updates` calls
+    or `every_seconds` seconds, whichever comes first; flush() writes the latest token now.
+    After a crash at most that many batches are read again; after a clean shutdown, none.
+    """
+    def __init__(self, every_updates: int = 100, every_seconds: float = 5.0):
+        self.every_updates = every_updates
+        self.every_seconds = every_seconds
+        self._token = None
+        self._updates = 0
+        self._last_write = time.monotonic()
+
+    def update(self, token: Any) -> None:
+        if token is None:
+            return
+        self._token = token
+        self._updates += 1
+        if self._updates >= self.every_updates or time.monotonic() - self._last_write >= self.every_seconds:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._updates:
+            return
+        try:
+            self._write(self._token)
+            self._updates = 0
+            self._last_write = time.monotonic()
+        except Exception as e:
+            logger.error("Error saving change stream resume token: %s", e)
+
+    def load(self) -> Optional[Any]:
+        try:
+            return self._read()
+        except Exception as e:
+            logger.warning("Could not load change stream resume token: %s", e)
+            return None
+
+    def clear(self) -> None:
+        self._token = None
+        self._updates = 0
+        try:
+            self._delete()
+        except Exception as e:
+            logger.error("Error clearing change stream resume token: %s", e)
+
+    # Storage hooks
+    def _read(self) -> Optional[Any]:
+        raise NotImplementedError
+
+    def _write(self, token: Any) -> None:
+        raise NotImplementedError
+
+    def _delete(self) -> None:
+        raise NotImplementedError
+
+class FileResumeTokenStore(ResumeTokenStore):
+    """
+    Keeps the token in a local file, replaced atomically on every write.
+    """
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def _read(self) -> Optional[Any]:
+        from bson import json_util
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json_util.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _write(self, token: Any) -> None:
+        from bson import json_util
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json_util.dumps(token))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _delete(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class MongoResumeTokenStore(ResumeTokenStore):
+    """
+    Keeps the token in a document of a MongoDB collection, so any host running the detector
+    against the same cluster resumes from it.
+    """
+    def __init__(self, collection, key: str = 'records', **kwargs):
+        super().__init__(**kwargs)
+        self.collection = collection
+        self.key = key
+
+    def _read(self) -> Optional[Any]:
+        doc = self.collection.find_one({'_id': self.key})
+        return doc['token'] if doc else None
+
+    def _write(self, token: Any) -> None:
+        self.collection.replace_one(
+            {'_id': self.key},
+            {'_id': self.key, 'token': token, 'updated': datetime.now(timezone.utc)},
+            upsert=True)
+
+    def _delete(self) -> None:
+        self.collection.delete_one({'_id': self.key})
+
+class NullResumeTokenStore(ResumeTokenStore):
+    """
+    Keeps nothing: every start reads the change stream from the present, as before.
+    """
+    def _read(self) -> Optional[Any]:
+        return None
+
+    def _write(self, token: Any) -> None:
+        pass
+
+    def _delete(self) -> None:
+        pass
@@ -0,0 +1,128 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (raw features, heuristic label or None)
+Sample = Tuple[Dict[str, Any], Optional[str]]
+
+class ShadowRetrainer:
+    """
+    Retrains a detector from scratch after concept drift without pausing the stream.
+    The live detector feeds every event to observe(), which keeps the last `buffer_size` of them
+    in a ring buffer. on_drift() marks a retrain as due; the next poll() with at least
+    `min_events` buffered starts a background thread that builds a fresh shadow detector with
+    `build()` and warms it on a copy of the buffer, then on the events that arrived meanwhile,
+    while the live detector keeps scoring and learning. Once the shadow has caught up, poll() on
+    the live thread hands it to `swap()` between two events, so nothing ever scores against a
+    half-trained model. If the stream outpaces the shadow's catch-up, the swap happens anyway and
+    only the newest `max_catch_up` of the remaining events are replayed into it on the live
+    thread; the rest are skipped. Drift reported within `cooldown` events of the last retrain is
+    ignored, giving the new detector's drift detectors time to settle.
+    The shadow trains in a thread of the same process, so it shares the GIL with scoring:
+    throughput dips while it trains, but events are never held back.
+    """
+    def __init__(self, build: Callable[[], Any], swap: Callable[[Any], None], buffer_size: int = 5000,
+                 min_events: int = 500, cooldown: Optional[int] = None, max_catch_up: int = 64):
+        self.build = build
+        self.swap = swap
+        self.recent: deque = deque(maxlen=buffer_size)
+        self.min_events = min(min_events, buffer_size)
+        self.cooldown = buffer_size if cooldown is None else cooldown
+        self.max_catch_up = max_catch_up
+        self.stats = {'drifts': 0, 'ignored': 0, 'retrains': 0, 'swaps': 0, 'failed': 0, 'skipped': 0}
+        self._due = False
+        self._since_retrain = self.cooldown
+        self._thread: Optional[threading.Thread] = None
+        # Events seen while the shadow trains, handed over to it as they arrive
+        self._backlog: queue.SimpleQueue = queue.SimpleQueue()
+        self._ready = threading.Event()
+        self._shadow = None
+        self._started = 0.0
+
+    def observe(self, features: Dict[str, Any], label: Optional[str] = None) -> None:
+        sample = (features, label)
+        self.recent.append(sample)
+        self._since_retrain += 1
+        if self._thread is not None:
+            self._backlog.put(sample)
+
+    def on_drift(self) -> None:
+        self.stats['drifts'] += 1
+        if self._thread is not None or self._since_retrain < self.cooldown:
+            self.stats['ignored'] += 1
+            return
+        self._due = True
+
+    def poll(self) -> bool:
+        """
+        Start a due retrain, or swap in a finished shadow. Called on the live thread between
+        events; returns True when a shadow was swapped in.
+        """
+        if self._thread is not None:
+            return self._ready.is_set() and self._finish()
+        if self._due and len(self.recent) >= self.min_events:
+            self._start()
+        return False
+
+    def summary(self) -> Dict[str, Any]:
+        return dict(self.stats, buffered=len(self.recent), training=self._thread is not None)
+
+    def _start(self) -> None:
+        self._due = False
+        self._since_retrain = 0
+        self._ready.clear()
+        self._started = time.monotonic()
+        self.stats['retrains'] += 1
+        samples = list(self.recent)
+        self._thread = threading.Thread(target=self._train, args=(samples,), name="shadow-retrain", daemon=True)
+        self._thread.start()
+        logger.warning("Concept drift: training a shadow detector on the last %d events", len(samples))
+
+    def _train(self, samples: List[Sample]) -> None:
+        try:
+            shadow = self.build()
+            for features, label in samples:
+                shadow.warm_one(features, label)
+            # Catch up with the stream in passes, for as long as each pass shortens the backlog
+            backlog = self._backlog.qsize()
+            while backlog > self.max_catch_up:
+                for _ in range(backlog):
+                    features, label = self._backlog.get()
+                    shadow.warm_one(features, label)
+                previous, backlog = backlog, self._backlog.qsize()
+                if backlog >= previous:
+                    break
+            self._shadow = shadow
+        except Exception as e:
+            logger.error("Shadow retraining failed: %s", e)
+            self._shadow = None
+        self._ready.set()
+
+    def _finish(self) -> bool:
+        self._thread.join()
+        self._thread = None
+        shadow, self._shadow = self._shadow, None
+        # Events that arrived after the worker's last catch-up; only the newest few are replayed here
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._backlog.get_nowait())
+            except queue.Empty:
+                break
+        if shadow is None:
+            self.stats['failed'] += 1
+            return False
+        caught_up = remaining[-self.max_catch_up:] if self.max_catch_up > 0 else []
+        self.stats['skipped'] += len(remaining) - len(caught_up)
+        for features, label in caught_up:
+            shadow.warm_one(features, label)
+        self.swap(shadow)
+        self.stats['swaps'] += 1
+        logger.warning("Swapped in the retrained detector after %.1fs (%d events caught up on swap, %d skipped)",
+                       time.monotonic() - self._started, len(caught_up), len(remaining) - len(caught_up))
+        return True
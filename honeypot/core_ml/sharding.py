@@ -0,0 +1,318 @@
+import logging
+import multiprocessing as mp
+import os
+import queue
+import time
+import zlib
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from checkpoint import ModelCheckpointer, dump_snapshot, load_checkpoint
+from Feature import FeatureExtractor
+from ip_state import IPStateStore
+from logging_setup import configure_worker_logging, forward_worker_logs
+from model import AdaptiveAttackDetector
+from pipeline import score_logs
+from telemetry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Shards send their metrics to the parent's registry at most this often, in seconds
+METRICS_FORWARD_SECONDS = 1.0
+
+class ShardError(RuntimeError):
+    """
+    A detector shard process has exited; sharded detection cannot continue without it.
+    """
+
+def shard_for(ip: str, num_shards: int) -> int:
+    """
+    Stable shard index for a source IP. crc32 is used instead of hash() so the mapping
+    is the same in every process and across restarts.
+    """
+    return zlib.crc32(ip.encode('utf-8')) % num_shards
+
+def shard_path(path: str, shard: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+def partition(logs: List[Dict[str, Any]], num_shards: int) -> List[List[Dict[str, Any]]]:
+    """
+    Split logs into one list per shard by source IP, keeping arrival order within each.
+    """
+    parts = [[] for _ in range(num_shards)]
+    for log in logs:
+        parts[shard_for(str(log.get('source_ip', 'unknown')), num_shards)].append(log)
+    return parts
+
+def _load_detector(paths: List[str], threshold: float, shared_preprocessing: bool = True,
+                   latency_budget_ms: Optional[float] = None) -> AdaptiveAttackDetector:
+    for path in paths:
+        try:
+            detector = load_checkpoint(path, AdaptiveAttackDetector.from_state_dict)
+            detector.set_latency_budget(latency_budget_ms)
+            return detector
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            logger.warning("Error loading saved model from %s: %s", path, str(e))
+    return AdaptiveAttackDetector(threshold=threshold, shared_preprocessing=shared_preprocessing,
+                                  latency_budget_ms=latency_budget_ms)
+
+def _shard_worker(shard: int, config: Dict[str, Any], inbox, outbox, log_queue) -> None:
+    """
+    Worker process loop: owns the feature extractor, detector and per-IP state for one shard.
+    A shard starts from its own checkpoint, falling back to the shared single-process model.
+    """
+    configure_worker_logging(log_queue, level=config['log_level'], burst=config['log_sample_burst'],
+                             interval=config['log_sample_interval'])
+    model_path = shard_path(config['model_path'], shard)
+    try:
+        # Shards checkpoint only when the parent asks, so the triggers are disabled here
+        checkpointer = ModelCheckpointer(model_path, keep=config['checkpoint_keep'],
+                                         compress=config['checkpoint_compress'], every_events=0, every_seconds=0)
+        fe = FeatureExtractor()
+        detector = _load_detector([model_path, config['model_path']], config['threshold'],
+                                   config['shared_preprocessing'], config.get('latency_budget_ms'))
+        detector.set_retraining(config.get('retrain_buffer_size', 0), config.get('retrain_min_events', 500))
+        ip_state = IPStateStore(max_entries=config['ip_state_max_entries'], ttl=config['ip_state_ttl'],
+                                max_memory_mb=config['ip_state_max_memory_mb'])
+        ip_state_path = shard_path(config['ip_state_path'], shard) if config.get('ip_state_path') else None
+        if ip_state_path:
+            ip_state.restore(ip_state_path)
+    except Exception as e:
+        logger.critical("Shard %d failed to start: %s", shard, e)
+        raise
+
+    def checkpoint():
+        try:
+            checkpointer.save(detector)
+            if ip_state_path:
+                ip_state.snapshot(ip_state_path)
+        except Exception as e:
+            logger.error("Shard %d failed to checkpoint: %s", shard, e)
+
+    def forward_metrics():
+        # Cumulative, so the parent just keeps the latest snapshot from each shard
+        outbox.put(('metrics', shard, REGISTRY.snapshot()))
+
+    last_forward = time.monotonic()
+    while True:
+        command, payload = inbox.get()
+        if command == 'logs':
+            # Sent even when empty: it tells the parent this batch is done
+            outbox.put(('detections', shard, score_logs(payload, fe, detector, ip_state)))
+            if time.monotonic() - last_forward >= METRICS_FORWARD_SECONDS:
+                forward_metrics()
+                last_forward = time.monotonic()
+        elif command == 'checkpoint':
+            checkpoint()
+            forward_metrics()
+            outbox.put(('checkpointed', shard, model_path))
+        elif command == 'stop':
+            checkpoint()
+            checkpointer.close()
+            forward_metrics()
+            outbox.put(('stopped', shard, model_path))
+            return
+
+class ShardedDetector:
+    """
+    Runs detection in N worker processes, hash-partitioned by source IP.
+    Every log from a given IP goes to the same worker, so per-IP interarrival and labelling
+    stay correct while scoring scales across cores. Detections from all shards come back on
+    a single queue for the response and monitoring stage in the parent process, along with
+    each shard's metrics, which are merged into the parent's telemetry REGISTRY.
+    Each shard answers every part it is sent, so a resume token handed to submit() is only
+    returned by committable() once all shards have scored the logs up to it. A shard that
+    exits raises ShardError on the next submit() instead of leaving ingest blocked on its inbox.
+    """
+    def __init__(self, num_shards: int, config: Dict[str, Any], queue_size: int = 64,
+                 put_timeout: float = 1.0):
+        self.num_shards = num_shards
+        self.config = config
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self._workers = []
+        self._inboxes = []
+        self._outbox = None
+        self._log_listener = None
+        # Batch numbers each shard still owes an answer for, shards left per batch, and
+        # (batch, token) not yet returned by committable()
+        self._unanswered: List[Deque[int]] = [deque() for _ in range(num_shards)]
+        self._outstanding: Dict[int, int] = {}
+        self._tokens: Deque[Tuple[int, Any]] = deque()
+        self._seq = 0
+
+    def start(self) -> None:
+        ctx = mp.get_context('spawn')
+        self._outbox = ctx.Queue()
+        # Workers log through the parent so all shards share one log file and rate limit
+        log_queue = ctx.Queue()
+        self._log_listener = forward_worker_logs(log_queue)
+        for shard in range(self.num_shards):
+            # Bounded inboxes apply backpressure to ingest when a shard falls behind
+            inbox = ctx.Queue(maxsize=self.queue_size)
+            worker = ctx.Process(target=_shard_worker, args=(shard, self.config, inbox, self._outbox, log_queue),
+                                 name=f"detector-shard-{shard}", daemon=True)
+            worker.start()
+            self._inboxes.append(inbox)
+            self._workers.append(worker)
+        logger.info("Started %d detector shards", self.num_shards)
+
+    def submit(self, logs: List[Dict[str, Any]], token: Any = None) -> None:
+        """
+        Partition logs by source IP and send each shard its part, preserving arrival order per IP.
+        `token` is the source position just after the logs, for committable().
+        """
+        self._check_workers()
+        self._seq += 1
+        for shard, part in enumerate(partition(logs, self.num_shards)):
+            if part:
+                self._put(shard, ('logs', part))
+                self._unanswered[shard].append(self._seq)
+                self._outstanding[self._seq] = self._outstanding.get(self._seq, 0) + 1
+        if token is not None:
+            self._tokens.append((self._seq, token))
+
+    def committable(self) -> Any:
+        """
+        The newest token submitted whose logs every shard has answered for, or None if there is no
+        new one since the last call.
+        """
+        oldest_open = min(self._outstanding) if self._outstanding else self._seq + 1
+        token = None
+        while self._tokens and self._tokens[0][0] < oldest_open:
+            token = self._tokens.popleft()[1]
+        return token
+
+    def _put(self, shard: int, message) -> None:
+        # A full inbox of a dead shard would block forever, so keep checking it is alive
+        while True:
+            try:
+                self._inboxes[shard].put(message, timeout=self.put_timeout)
+                return
+            except queue.Full:
+                self._check_worker(shard)
+
+    def _check_workers(self) -> None:
+        for shard in range(len(self._workers)):
+            self._check_worker(shard)
+
+    def _check_worker(self, shard: int) -> None:
+        worker = self._workers[shard]
+        if not worker.is_alive():
+            logger.critical("Detector shard %d exited with code %s", shard, worker.exitcode)
+            raise ShardError(f"Detector shard {shard} exited with code {worker.exitcode}")
+
+    def _answered(self, shard: int) -> None:
+        seq = self._unanswered[shard].popleft()
+        self._outstanding[seq] -= 1
+        if not self._outstanding[seq]:
+            del self._outstanding[seq]
+
+    def collect(self, timeout: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Return detections that have arrived from any shard, waiting up to timeout for the first one.
+        """
+        detections = []
+        block = timeout > 0
+        while True:
+            try:
+                kind, shard, payload = self._outbox.get(block=block, timeout=timeout if block else None)
+            except queue.Empty:
+                return detections
+            block = False
+            if kind == 'detections':
+                detections.extend(payload)
+                self._answered(shard)
+            elif kind == 'metrics':
+                REGISTRY.merge(f"shard{shard}", payload)
+            else:
+                logger.info("Shard %d %s (%s)", shard, kind, payload)
+
+    def checkpoint(self) -> None:
+        """
+        Ask every shard to save its detector and per-IP state. ShardModelSet loads the saved
+        detectors back, e.g. for `replay.py --shards`.
+        """
+        for shard in range(self.num_shards):
+            self._put(shard, ('checkpoint', None))
+
+    def stop(self, timeout: float = 60.0) -> List[Dict[str, Any]]:
+        """
+        Checkpoint and stop all shards, returning any detections still in flight.
+        """
+        running = 0
+        for shard, worker in enumerate(self._workers):
+            try:
+                if worker.is_alive():
+                    self._put(shard, ('stop', None))
+                    running += 1
+            except ShardError:
+                continue
+        detections = []
+        stopped = 0
+        while stopped < running:
+            try:
+                kind, shard, payload = self._outbox.get(timeout=timeout)
+            except queue.Empty:
+                logger.error("Timed out waiting for detector shards to stop")
+                break
+            if kind == 'detections':
+                detections.extend(payload)
+                self._answered(shard)
+            elif kind == 'metrics':
+                REGISTRY.merge(f"shard{shard}", payload)
+            elif kind == 'stopped':
+                stopped += 1
+        for worker in self._workers:
+            worker.join(timeout=5)
+        self._log_listener.stop()
+        return detections
+
+class ShardModelSet:
+    """
+    The detectors of a sharded deployment, used together in one process (see `replay.py --shards`).
+    River's trees cannot be merged into a single model, so each log is scored by the detector of
+    the shard its source IP maps to, as ShardedDetector would route it.
+    """
+    def __init__(self, detectors: List[AdaptiveAttackDetector]):
+        self.detectors = detectors
+
+    @classmethod
+    def load(cls, model_path: str, num_shards: int) -> 'ShardModelSet':
+        """
+        Load the `num_shards` checkpoints saved beside `model_path`. Raises FileNotFoundError if
+        any is missing, as a fresh model in its place would score that shard's IPs untrained.
+        """
+        detectors = []
+        for shard in range(num_shards):
+            path = shard_path(model_path, shard)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No checkpoint for detector shard {shard} at {path}")
+            detectors.append(load_checkpoint(path, AdaptiveAttackDetector.from_state_dict))
+        return cls(detectors)
+
+    def save(self, model_path: str) -> None:
+        """
+        Save each detector beside `model_path`, where load() and the shard processes look for it.
+        """
+        for shard, detector in enumerate(self.detectors):
+            with open(shard_path(model_path, shard), 'wb') as f:
+                f.write(dump_snapshot(detector))
+
+    def detector_for(self, ip: str) -> AdaptiveAttackDetector:
+        return self.detectors[shard_for(ip, len(self.detectors))]
+
+    def score_logs(self, logs: List[Dict[str, Any]], fe, ip_state: IPStateStore,
+                   timings: Optional[Dict[str, List[float]]] = None) -> List[Dict[str, Any]]:
+        """
+        score_logs() with each shard's part of the batch going to that shard's detector.
+        Detections are grouped by shard, in arrival order within each.
+        """
+        detections = []
+        for detector, part in zip(self.detectors, partition(logs, len(self.detectors))):
+            if part:
+                detections.extend(score_logs(part, fe, detector, ip_state, timings=timings))
+        return detections
@@ -0,0 +1,345 @@
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from log_formats import NORMALIZERS, detect_format
+from log_tail import TailFollower
+from resume_tokens import NullResumeTokenStore, ResumeTokenStore
+
+logger = logging.getLogger(__name__)
+
+Batch = Tuple[List[Dict[str, Any]], Any]
+
+# Server errors meaning a resume token can no longer be used: the oplog has moved past it
+# (ChangeStreamHistoryLost, ChangeStreamFatalError) or it is malformed (InvalidResumeToken)
+_STALE_TOKEN_CODES = {260, 280, 286}
+
+class LogSource:
+    """
+    Where the detector's logs come from.
+    batches() yields (logs, token) pairs, where the token marks the position just after the batch.
+    Once a batch has been processed the caller passes its token to commit(), so a restarted
+    source can continue after it instead of replaying or skipping logs.
+    While no logs arrive, batches() yields an empty batch ([], None) at least about once a second,
+    so a caller reading it on another thread (see idle_ticks) can stop it between batches.
+    """
+    def batches(self, resume_token: Any = None) -> Iterator[Batch]:
+        raise NotImplementedError
+
+    def commit(self, token: Any) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+class MongoChangeStreamSource(LogSource):
+    """
+    Logs inserted into the records collection, read from its change stream.
+    Committed tokens go to `token_store`, and a source started without a token resumes from
+    the stored one. If the stored token has expired, reading restarts from the present.
+    """
+    def __init__(self, db, batch_size: int = 1, max_linger: float = 0.5, max_await_ms: Optional[int] = None,
+                 token_store: Optional[ResumeTokenStore] = None):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_linger = max_linger
+        self.max_await_ms = max_await_ms
+        self.token_store = token_store or NullResumeTokenStore()
+
+    def batches(self, resume_token: Any = None) -> Iterator[Batch]:
+        """
+        Yield (logs, resume_token) for each batch read from the change stream, skipping malformed entries.
+        """
+        if resume_token is None:
+            resume_token = self.token_store.load()
+            if resume_token is not None:
+                logger.info("Resuming change stream from the saved resume token.")
+        # pymongo is only imported when MongoDB is actually used
+        from pymongo.errors import OperationFailure
+        try:
+            yield from self._batches(resume_token)
+        except OperationFailure as e:
+            if resume_token is None or e.code not in _STALE_TOKEN_CODES:
+                raise
+            logger.error("Saved resume token is no longer valid (%s); events since it are lost. "
+                         "Reading from the present.", e)
+            self.token_store.clear()
+            yield from self._batches(None)
+
+    def _batches(self, resume_token: Any) -> Iterator[Batch]:
+        # Batches of one are yielded as soon as they arrive; the batched stream also reports idle round-trips
+        changes = self.db.stream_log_batches(resume_token, self.batch_size, self.max_linger,
+                                             max_await_ms=self.max_await_ms)
+        for batch in changes:
+            if not batch:
+                yield [], None
+                continue
+            logs = []
+            for change in batch:
+                if change is None:
+                    logger.warning("Received None from stream, skipping.")
+                    continue
+                if not isinstance(change, dict):
+                    logger.error("Unexpected data structure from stream_logs: %s", type(change))
+                    continue
+                log = change.get('log')
+                resume_token = change.get('token')
+                if log is None:
+                    logger.warning("Received log entry with missing 'log' field: %s", change)
+                    continue
+                logs.append(log)
+            yield logs, resume_token
+
+    def commit(self, token: Any) -> None:
+        self.token_store.update(token)
+
+    def close(self) -> None:
+        self.token_store.flush()
+
+class FileTailSource(LogSource):
+    """
+    Follows local log files as they are written, normalizing each event to the records schema.
+    Read offsets are committed to `state_path` (if given), so a restart continues where the last
+    processed batch ended. A partial batch is yielded once its oldest event has waited `max_linger`.
+    Given a resume token, batches() first moves each file back to the position in it, so logs read
+    after that batch but never handed on are read again.
+    """
+    def __init__(self, paths: List[str], fmt: str = 'auto', state_path: Optional[str] = None,
+                 batch_size: int = 100, max_linger: float = 0.5, poll_interval: float = 0.2):
+        if fmt != 'auto' and fmt not in NORMALIZERS:
+            raise ValueError(f"Unknown log format '{fmt}', expected 'auto' or one of {sorted(NORMALIZERS)}")
+        self.fmt = fmt
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self.max_linger = max_linger
+        self.poll_interval = poll_interval
+        state = self._load_state()
+        self.followers = [TailFollower(path, **state.get(path, {})) for path in paths]
+        self._normalizers: Dict[str, Callable] = {}
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning("Ignoring unreadable source state %s: %s", self.state_path, e)
+            return {}
+
+    def _normalize(self, path: str, raw: Dict[str, Any]) -> Dict[str, Any]:
+        normalize = self._normalizers.get(path)
+        if normalize is None:
+            fmt = detect_format(raw) if self.fmt == 'auto' else self.fmt
+            normalize = self._normalizers[path] = NORMALIZERS[fmt]
+            logger.info("Following %s as %s events", path, fmt)
+        return normalize(raw)
+
+    def _positions(self) -> Dict[str, Dict[str, Any]]:
+        return {f.path: {'offset': f.offset, 'inode': f.inode} for f in self.followers}
+
+    def _rewind(self, positions: Dict[str, Dict[str, Any]]) -> None:
+        for follower in self.followers:
+            position = positions.get(follower.path)
+            if position is None or (position['offset'], position['inode']) == (follower.offset, follower.inode):
+                continue
+            follower.close()
+            follower.offset, follower.inode = position['offset'], position['inode']
+
+    def batches(self, resume_token: Any = None) -> Iterator[Batch]:
+        if resume_token:
+            self._rewind(resume_token)
+        batch = []
+        deadline = None
+        while True:
+            read = 0
+            for follower in self.followers:
+                for raw, _, offset, _ in follower.read():
+                    read += 1
+                    try:
+                        batch.append(self._normalize(follower.path, raw))
+                    except Exception as e:
+                        logger.warning("Skipping unreadable event at offset %d of %s: %s", offset, follower.path, e)
+            if batch and deadline is None:
+                deadline = time.monotonic() + self.max_linger
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                # Files are read whole lines at a time, so a batch can exceed batch_size
+                yield batch, self._positions()
+                batch = []
+                deadline = None
+            elif not read:
+                time.sleep(self.poll_interval)
+                if not batch:
+                    yield [], None
+
+    def commit(self, token: Any) -> None:
+        if not self.state_path or not token:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(token, f)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            logger.error("Error saving source state to %s: %s", self.state_path, e)
+
+    def close(self) -> None:
+        for follower in self.followers:
+            follower.close()
+
+class HeraldingFileSource(FileTailSource):
+    """
+    Tails the files Heralding writes next to the sensor: session_json_log_file (one event per
+    session) and/or authentication_log_file (one event per login attempt).
+    """
+    def __init__(self, paths: Optional[List[str]] = None, **kwargs):
+        super().__init__(paths or ['log_session.json'], **kwargs)
+
+class JSONLFileSource(FileTailSource):
+    """
+    Tails a local JSONL file of events already in the records schema, e.g. from logsrunner.
+    """
+    def __init__(self, paths: Optional[List[str]] = None, **kwargs):
+        kwargs.setdefault('fmt', 'record')
+        super().__init__(paths or ['events.jsonl'], **kwargs)
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                self.server.events.put(json.loads(line))
+            except ValueError as e:
+                logger.warning("Skipping unreadable event from %s: %s", self.client_address[0], e)
+
+class _LineServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class SocketSource(LogSource):
+    """
+    Accepts newline-delimited JSON events over TCP, e.g. from a forwarder on the sensor or `nc`.
+    Events are normalized like file events. The queue is bounded, so a slow detector pushes back
+    on senders instead of growing memory. There is no resume position: events sent while the
+    detector is down are lost.
+    """
+    def __init__(self, address: str = '127.0.0.1:5140', fmt: str = 'auto', batch_size: int = 100,
+                 max_linger: float = 0.5, queue_size: int = 10000):
+        host, port = address.rsplit(':', 1)
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.max_linger = max_linger
+        self._server = _LineServer((host, int(port)), _LineHandler)
+        self._server.events = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="socket-source", daemon=True)
+        self._thread.start()
+        logger.info("Listening for events on %s", address)
+
+    def batches(self, resume_token: Any = None) -> Iterator[Batch]:
+        events = self._server.events
+        while True:
+            try:
+                raw_events = [events.get(timeout=1.0)]
+            except queue.Empty:
+                yield [], None
+                continue
+            deadline = time.monotonic() + self.max_linger
+            while len(raw_events) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    raw_events.append(events.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            logs = []
+            for raw in raw_events:
+                try:
+                    fmt = detect_format(raw) if self.fmt == 'auto' else self.fmt
+                    logs.append(NORMALIZERS[fmt](raw))
+                except Exception as e:
+                    logger.warning("Skipping unreadable event: %s", e)
+            yield logs, None
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+_END = object()
+
+def idle_ticks(batches: Iterator[Batch], interval: float) -> Iterator[Batch]:
+    """
+    Pass batches through, and yield ([], None) whenever none has arrived for `interval` seconds.
+    Sources block until logs arrive, so they are read on a daemon thread here to let the caller
+    run time-driven work while idle, such as closing coalescing windows.
+    Errors from the source are raised in the caller. Closing the returned generator stops the
+    reader and waits for it, so the source can be read again right after; the reader notices
+    between batches, which sources yield at least about once a second even while idle.
+    """
+    handoff: queue.Queue = queue.Queue(maxsize=1)
+    stopped = threading.Event()
+
+    def read():
+        try:
+            for batch in batches:
+                if not batch[0] and batch[1] is None and not stopped.is_set():
+                    # The source's own idle batch; the caller gets ticks on its own schedule
+                    continue
+                while not stopped.is_set():
+                    try:
+                        handoff.put(batch, timeout=interval)
+                        break
+                    except queue.Full:
+                        continue
+                if stopped.is_set():
+                    return
+            item = _END
+        except Exception as e:
+            item = e
+        finally:
+            if stopped.is_set() and hasattr(batches, 'close'):
+                batches.close()
+        while not stopped.is_set():
+            try:
+                handoff.put(item, timeout=interval)
+                return
+            except queue.Full:
+                continue
+
+    reader = threading.Thread(target=read, name="source-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            try:
+                item = handoff.get(timeout=interval)
+            except queue.Empty:
+                yield [], None
+                continue
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        reader.join()
+
+SOURCES = {
+    'mongo': MongoChangeStreamSource,
+    'heralding': HeraldingFileSource,
+    'jsonl': JSONLFileSource,
+    'socket': SocketSource,
+}
+
+def create_source(name: str, **kwargs) -> LogSource:
+    if name not in SOURCES:
+        raise ValueError(f"Unknown log source '{name}', expected one of {sorted(SOURCES)}")
+    return SOURCES[name](**kwargs)
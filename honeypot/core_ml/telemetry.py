@@ -0,0 +1,332 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds; spans a sub-millisecond ensemble score up to a slow model save
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    """
+    A metric and its children, one per combination of label values. Counters and histograms can
+    also carry the latest snapshot() of the same metric in other processes (see Registry.merge),
+    which is added in when rendering.
+    """
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        self._remote: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+
+    def labels(self, *values: str):
+        """
+        The child for one combination of label values, created on first use.
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Any]:
+        """
+        The current state of every child, as plain values that can be pickled to another process.
+        """
+        return {values: self._state(child) for values, child in list(self._children.items())}
+
+    def set_remote(self, source: str, snapshot: Dict[Tuple[str, ...], Any]) -> None:
+        self._remote[source] = snapshot
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        merged = self.snapshot()
+        for snapshot in list(self._remote.values()):
+            for values, state in snapshot.items():
+                merged[values] = self._combine(merged[values], state) if values in merged else state
+        for values, state in sorted(merged.items()):
+            lines.extend(self._render_state(values, state))
+        return lines
+
+    def _state(self, child) -> Any:
+        raise NotImplementedError
+
+    def _combine(self, a, b) -> Any:
+        raise NotImplementedError
+
+    def _render_state(self, values: Tuple[str, ...], state) -> List[str]:
+        raise NotImplementedError
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def value(self, *values: str) -> float:
+        child = self._children.get(values)
+        return child.value if child is not None else 0.0
+
+    def _state(self, child):
+        return child.value
+
+    def _combine(self, a, b):
+        return a + b
+
+    def _render_state(self, values, state):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(state)}"]
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Per-bucket (not cumulative) counts; the last one is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _state(self, child):
+        with child._lock:
+            return list(child.counts), child.sum
+
+    def _combine(self, a, b):
+        return [x + y for x, y in zip(a[0], b[0])], a[1] + b[1]
+
+    def _render_state(self, values, state):
+        counts, total = state
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Gauge(_Metric):
+    """
+    A value read when metrics are rendered, from `function()` or from the last set().
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Optional[Callable[[], Optional[float]]] = None):
+        super().__init__(name, documentation)
+        self.function = function
+        self._value: Optional[float] = None
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def render(self) -> List[str]:
+        try:
+            value = self.function() if self.function is not None else self._value
+        except Exception as e:
+            logger.debug("Gauge %s failed: %s", self.name, e)
+            value = None
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if value is not None:
+            lines.append(f"{self.name} {_format_value(value)}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict[str, Dict[Tuple[str, ...], Any]]:
+        """
+        Counters and histograms of this process by name, for merge() in another process.
+        Gauges describe the process that renders them and are left out.
+        """
+        return {m.name: m.snapshot() for m in self.metrics if not isinstance(m, Gauge)}
+
+    def merge(self, source: str, snapshot: Dict[str, Dict[Tuple[str, ...], Any]]) -> None:
+        """
+        Include the latest snapshot() from `source` (e.g. a worker process) in what is rendered here,
+        replacing the previous one from the same source.
+        """
+        by_name = {m.name: m for m in self.metrics}
+        for name, metric_snapshot in snapshot.items():
+            if name in by_name:
+                by_name[name].set_remote(source, metric_snapshot)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+EVENTS_RECEIVED = REGISTRY.register(Counter(
+    'flytrap_events_received_total', "Logs read from the log source."))
+EVENTS_PROCESSED = REGISTRY.register(Counter(
+    'flytrap_events_processed_total', "Detections scored and responded to."))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'flytrap_stage_seconds', "Time spent per call in each pipeline stage.", ('stage',)))
+DRIFT_EVENTS = REGISTRY.register(Counter(
+    'flytrap_drift_events_total', "Concept drift detections, per drift detector.", ('detector',)))
+RELABELS = REGISTRY.register(Counter(
+    'flytrap_relabels_total', "Detections whose predicted type the classifier was retrained away from.",
+    ('predicted', 'heuristic')))
+EVENT_LAG = REGISTRY.register(Gauge(
+    'flytrap_event_lag_seconds', "Now minus the timestamp of the newest log received."))
+
+# Stage names for STAGE_SECONDS
+RECEIVE = 'receive'
+TRANSFORM = 'transform'
+ENSEMBLE_SCORE = 'ensemble_score'
+ENSEMBLE_LEARN = 'ensemble_learn'
+CLASSIFIER_PREDICT = 'classifier_predict'
+CLASSIFIER_LEARN = 'classifier_learn'
+DETERMINE_RESPONSE = 'determine_response'
+SINK_WRITE = 'sink_write'
+MODEL_SNAPSHOT = 'model_snapshot'
+SAVE_MODEL = 'save_model'
+
+def stage(name: str) -> _HistogramChild:
+    """
+    The latency histogram of one stage, for `stage(name).observe(seconds)`.
+    """
+    return STAGE_SECONDS.labels(name)
+
+def resident_memory_bytes() -> Optional[float]:
+    # /proc gives the current RSS on Linux; elsewhere fall back to the peak from getrusage
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+REGISTRY.register(Gauge('flytrap_process_resident_memory_bytes', "Resident memory of this process.",
+                        resident_memory_bytes))
+
+def observe_batches(batches: Iterable[Tuple[List[Dict[str, Any]], Any]]) -> Iterator[Tuple[List[Dict[str, Any]], Any]]:
+    """
+    Pass (logs, token) batches through while recording the time spent receiving each, the
+    number of logs and the lag of the newest one. Closing it closes `batches`.
+    """
+    # Imported here so the metrics server itself needs nothing from the pipeline
+    from pipeline import to_epoch
+    receive = stage(RECEIVE)
+    iterator = iter(batches)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                logs, token = next(iterator)
+            except StopIteration:
+                return
+            if logs:
+                receive.observe(time.perf_counter() - started)
+                EVENTS_RECEIVED.inc(len(logs))
+                try:
+                    EVENT_LAG.set(time.time() - to_epoch(logs[-1]['timestamp']))
+                except Exception:
+                    pass
+            yield logs, token
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+
+def start_metrics_server(port: int, address: str = '127.0.0.1', registry: Registry = REGISTRY):
+    """
+    Serve `registry` in Prometheus text format at http://address:port/metrics from a daemon
+    thread. Call shutdown() on the returned server to stop it.
+    """
+    # http.server is only imported when metrics are served
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format, *args)
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", address, server.server_address[1])
+    return server
@@ -0,0 +1,188 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+sys.path.insert(0, HERE)
+
+from geoip_fixture import write_test_mmdb
+from logsrunner import generate_fake_log
+
+logger = logging.getLogger(__name__)
+
+STAGES = (
+    'transform', 'process_log', 'train_classifier', 'determine_response',
+    'monitor_update', 'generate_report', 'save_model',
+)
+
+def _timed(fn, repeat):
+    # Best of `repeat` runs: the least disturbed measurement of the same work
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _result(seconds, ops):
+    return {
+        'seconds': seconds,
+        'ops': ops,
+        'per_op_us': 1e6 * seconds / ops if ops else 0.0,
+        'ops_per_sec': ops / seconds if seconds > 0 else 0.0,
+    }
+
+def run_size(size, repeat, seed, workdir):
+    """
+    Time every stage on `size` generated logs and return {stage: result}.
+    Stateful stages start from a fresh object on every repeat so each run does the same work.
+    """
+    from Feature import FeatureExtractor
+    from checkpoint import ModelCheckpointer
+    from ip_state import IPStateStore
+    from model import AdaptiveAttackDetector
+    from Performance_Checker import PerformanceMonitor
+    from pipeline import compute_interarrival, heuristic_label
+    from response import ResponseEngine
+    from response_sink import create_sink
+
+    random.seed(seed)
+    logs = [generate_fake_log('benchmark') for _ in range(size)]
+    fe = FeatureExtractor()
+    ip_state = IPStateStore()
+    features, labels = [], []
+    for log in logs:
+        _, interarrival = compute_interarrival(log, ip_state)
+        f = fe.transform(log)
+        f['interarrival_time'] = interarrival
+        features.append(f)
+        labels.append(heuristic_label(f, interarrival))
+
+    results = {}
+    results['transform'] = _result(_timed(lambda: [fe.transform(log) for log in logs], repeat), size)
+
+    def process_log():
+        model = AdaptiveAttackDetector()
+        for f in features:
+            model.process_log(f)
+    results['process_log'] = _result(_timed(process_log, repeat), size)
+
+    results['train_classifier'] = _result(
+        _timed(lambda: AdaptiveAttackDetector().train_classifier(features, labels), repeat), size)
+
+    contexts = [{'ip': log['source_ip'], 'location': 'Unknown', 'top_features': []} for log in logs]
+    def determine_response():
+        responder = ResponseEngine(sink=create_sink('jsonl', os.path.join(workdir, 'responses.jsonl')))
+        for label, context in zip(labels, contexts):
+            responder.determine_response(label, 0.9, context)
+        responder.close()
+    results['determine_response'] = _result(_timed(determine_response, repeat), size)
+
+    scores = [random.random() for _ in range(size)]
+    monitor = PerformanceMonitor(report_path=os.path.join(workdir, 'report.png'))
+    def monitor_update():
+        for score in scores:
+            monitor.update(score, True)
+    results['monitor_update'] = _result(_timed(monitor_update, repeat), size)
+    results['generate_report'] = _result(_timed(monitor.generate_report, repeat), 1)
+
+    model = AdaptiveAttackDetector()
+    for f, label in zip(features, labels):
+        model.process_log(f)
+        model.train_classifier([f], [label])
+    checkpointer = ModelCheckpointer(os.path.join(workdir, 'model.pkl'), keep=1, every_events=0, every_seconds=0)
+    results['save_model'] = _result(_timed(lambda: checkpointer.save(model, wait=True), repeat), 1)
+    checkpointer.close()
+    return results
+
+def run(sizes, repeat, seed):
+    workdir = tempfile.mkdtemp(prefix='flytrap-bench-')
+    # FeatureExtractor reads GEOIP_PATH/GeoLite2-City.mmdb
+    write_test_mmdb(os.path.join(workdir, 'GeoLite2-City.mmdb'))
+    os.environ['GEOIP_PATH'] = workdir
+    results = {stage: {} for stage in STAGES}
+    try:
+        for size in sizes:
+            logger.info("Benchmarking %d logs", size)
+            for stage, result in run_size(size, repeat, seed, workdir).items():
+                results[stage][str(size)] = result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': sizes,
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+def compare(current, baseline, threshold):
+    """
+    Return the (stage, size, ratio) entries whose time per op grew by more than `threshold`
+    (0.2 = 20%) relative to the baseline. Stages or sizes missing from either side are skipped.
+    """
+    regressions = []
+    for stage, sizes in current['results'].items():
+        for size, result in sizes.items():
+            base = baseline['results'].get(stage, {}).get(size)
+            if not base or not base['per_op_us']:
+                continue
+            ratio = result['per_op_us'] / base['per_op_us']
+            flag = 'REGRESSION' if ratio > 1 + threshold else ''
+            print(f"{stage:<20}{size:>8}{base['per_op_us']:>14.2f}{result['per_op_us']:>14.2f}{ratio:>9.2f}x  {flag}")
+            if flag:
+                regressions.append((stage, size, ratio))
+    return regressions
+
+def print_results(current):
+    print(f"{'stage':<20}{'size':>8}{'us/op':>14}{'ops/s':>14}")
+    for stage, sizes in current['results'].items():
+        for size, result in sizes.items():
+            print(f"{stage:<20}{size:>8}{result['per_op_us']:>14.2f}{result['ops_per_sec']:>14.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage pipeline microbenchmarks with regression gates.")
+    parser.add_argument('--sizes', default='500,2000,5000', help="comma-separated numbers of logs (default 500,2000,5000)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage; the fastest is kept (default 3)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the generated logs (default 0)")
+    parser.add_argument('--save', help="write the results to this JSON file, e.g. to record a new baseline")
+    parser.add_argument('--compare', help="baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="fail when a stage is this much slower per op than the baseline (default 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    current = run([int(s) for s in args.sizes.split(',')], args.repeat, args.seed)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+    if not args.compare:
+        print_results(current)
+        return 0
+
+    with open(args.compare, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"{'stage':<20}{'size':>8}{'base us/op':>14}{'now us/op':>14}{'ratio':>10}")
+    regressions = compare(current, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}")
+        return 1
+    print("No regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
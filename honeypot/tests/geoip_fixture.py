@@ -0,0 +1,105 @@
+import ipaddress
+import struct
+import time
+
+# Networks in the documentation ranges that logsrunner.generate_ip draws from
+DEFAULT_NETWORKS = {
+    '192.0.2.0/24': ('CN', 'Beijing'),
+    '198.51.100.0/24': ('RU', 'Moscow'),
+    '203.0.113.0/25': ('US', 'Ashburn'),
+}
+
+_METADATA_MARKER = b'\xab\xcd\xefMaxMind.com'
+
+def _control(type_id, size):
+    # Control byte(s) for a data field: type in the top 3 bits (or an extended type byte), then the size
+    if size < 29:
+        size_bits, extra = size, b''
+    elif size < 285:
+        size_bits, extra = 29, bytes([size - 29])
+    else:
+        size_bits, extra = 30, struct.pack('>H', size - 285)
+    if type_id <= 7:
+        return bytes([(type_id << 5) | size_bits]) + extra
+    return bytes([size_bits, type_id - 7]) + extra
+
+def _encode(value, uint_type=6):
+    if isinstance(value, str):
+        data = value.encode('utf-8')
+        return _control(2, len(data)) + data
+    if isinstance(value, dict):
+        return _control(7, len(value)) + b''.join(_encode(k) + _encode(v) for k, v in value.items())
+    if isinstance(value, list):
+        return _control(11, len(value)) + b''.join(_encode(v) for v in value)
+    if isinstance(value, int):
+        data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+        return _control(uint_type, len(data)) + data
+    raise TypeError(f"Cannot encode {type(value).__name__} in an MMDB data section")
+
+def _city_record(country, city):
+    return {
+        'city': {'names': {'en': city}},
+        'country': {'iso_code': country, 'names': {'en': country}},
+    }
+
+def write_test_mmdb(path, networks=None):
+    """
+    Write a small IPv4 GeoIP2-City-style MaxMind DB mapping each network to (country, city).
+    Only what FeatureExtractor reads is included. Addresses outside the networks are not found.
+    """
+    networks = networks or DEFAULT_NETWORKS
+    data = b''
+    offsets = {}
+    # Search tree nodes as [left, right]; each record is ('node', index), ('data', offset) or None
+    nodes = [[None, None]]
+    for cidr, (country, city) in networks.items():
+        net = ipaddress.ip_network(cidr)
+        if (country, city) not in offsets:
+            offsets[(country, city)] = len(data)
+            data += _encode(_city_record(country, city))
+        bits = int(net.network_address)
+        node = 0
+        for depth in range(net.prefixlen):
+            bit = (bits >> (31 - depth)) & 1
+            if depth == net.prefixlen - 1:
+                nodes[node][bit] = ('data', offsets[(country, city)])
+                break
+            child = nodes[node][bit]
+            if child is None or child[0] != 'node':
+                nodes.append([None, None])
+                nodes[node][bit] = ('node', len(nodes) - 1)
+            node = nodes[node][bit][1]
+
+    node_count = len(nodes)
+    tree = bytearray()
+    for left, right in nodes:
+        for record in (left, right):
+            if record is None:
+                value = node_count
+            elif record[0] == 'node':
+                value = record[1]
+            else:
+                value = node_count + 16 + record[1]
+            tree += value.to_bytes(3, 'big')
+
+    metadata = {
+        'binary_format_major_version': 2,
+        'binary_format_minor_version': 0,
+        'build_epoch': int(time.time()),
+        'database_type': 'GeoIP2-City',
+        'description': {'en': 'Flytrap benchmark test database'},
+        'ip_version': 4,
+        'languages': ['en'],
+        'node_count': node_count,
+        'record_size': 24,
+    }
+    encoded_metadata = b''.join(
+        _encode(k) + _encode(v, uint_type=9 if k == 'build_epoch' else 5 if k != 'node_count' else 6)
+        for k, v in metadata.items())
+    with open(path, 'wb') as f:
+        f.write(bytes(tree))
+        f.write(b'\x00' * 16)
+        f.write(data)
+        f.write(_METADATA_MARKER)
+        f.write(_control(7, len(metadata)) + encoded_metadata)
+    return path
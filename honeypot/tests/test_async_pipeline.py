@@ -0,0 +1,94 @@
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+
+from async_pipeline import AsyncPipeline
+from ip_state import IPStateStore
+from sources import LogSource
+
+def log(i, ip='10.0.0.1'):
+    return {'source_ip': ip, 'timestamp': f"2025-01-01T00:00:{i:02d}", 'commands': []}
+
+class ListSource(LogSource):
+    def __init__(self, batches):
+        self._batches = batches
+        self.committed = []
+        self.commit_threads = set()
+
+    def batches(self, resume_token=None):
+        yield from self._batches
+
+    def commit(self, token):
+        self.committed.append(token)
+        self.commit_threads.add(threading.current_thread().name)
+
+class FakeExtractor:
+    def transform(self, log_entry, timestamp=None, enrichment=None):
+        if log_entry.get('bad'):
+            raise ValueError("unreadable")
+        return {'failed': 1.0}
+
+    def enrich(self, ip):
+        return {'country_risk': 0.5, 'location': "Unknown"}
+
+class FailingModel:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.batches = 0
+
+    def process_batch(self, features, labels=None):
+        self.batches += 1
+        if self.batches == self.fail_on:
+            raise RuntimeError("model failed")
+        return [(0.9, 'brute_force', {}) for _ in features]
+
+class NoCheckpoints:
+    def maybe_save(self, model, new_events):
+        return False
+
+def run(batches, model=None):
+    source = ListSource(batches)
+    responded = []
+    respond_threads = set()
+
+    def respond(detections):
+        responded.append(len(detections))
+        respond_threads.add(threading.current_thread().name)
+
+    pipeline = AsyncPipeline(source, FakeExtractor(), model or FailingModel(), IPStateStore(ttl=1e9), NoCheckpoints(),
+                             respond=respond, metrics_interval=0)
+    asyncio.run(pipeline.run())
+    return pipeline, source, responded, respond_threads
+
+class TestAsyncPipeline(unittest.TestCase):
+    def test_every_batch_is_committed_in_order(self):
+        pipeline, source, responded, _ = run([([log(i)], f"t{i}") for i in range(5)])
+        self.assertEqual(source.committed, ['t0', 't1', 't2', 't3', 't4'])
+        self.assertEqual(responded, [1] * 5)
+        self.assertEqual(pipeline.failed_batches, 0)
+
+    def test_no_commit_past_a_failed_batch(self):
+        pipeline, source, responded, _ = run([([log(i)], f"t{i}") for i in range(5)], model=FailingModel(fail_on=3))
+        self.assertEqual(source.committed, ['t0', 't1'])
+        # Later batches are still scored and responded to
+        self.assertEqual(responded, [1] * 4)
+        self.assertEqual(pipeline.failed_batches, 1)
+
+    def test_logs_dropped_inside_a_batch_do_not_stop_commits(self):
+        _, source, responded, _ = run([([log(0), dict(log(1), bad=True)], 't0'), ([log(2)], 't1')])
+        self.assertEqual(source.committed, ['t0', 't1'])
+        self.assertEqual(responded, [1, 1])
+
+    def test_respond_and_commit_run_off_the_event_loop(self):
+        _, source, _, respond_threads = run([([log(0)], 't0')])
+        main = threading.current_thread().name
+        self.assertTrue(respond_threads and main not in respond_threads)
+        self.assertTrue(source.commit_threads and main not in source.commit_threads)
+
+if __name__ == "__main__":
+    unittest.main()
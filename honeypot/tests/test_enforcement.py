@@ -0,0 +1,121 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+
+from enforcement import (PERM_BLOCK, TEMP_BLOCK, Block, EnforcementEngine, IpsetFileBackend, MemoryBlockBackend,
+                         NftFileBackend)
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+class EngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryBlockBackend()
+        self.engine = EnforcementEngine(self.backend, window=0.2, temp_block_seconds=600, prefix_v4=24)
+
+    def tearDown(self):
+        self.engine.close()
+
+class TestBlocking(EngineTestCase):
+    # These drive the engine's bookkeeping directly with a fake clock; its thread stays idle
+    # because nothing is queued
+    def test_repeated_temp_blocks_are_one_add(self):
+        for i in range(100):
+            self.engine._block(f"198.51.100.{i % 5}", TEMP_BLOCK, now=0.0)
+        self.assertEqual(self.engine._adds, {'198.51.100.0/24': Block('198.51.100.0/24', 600)})
+        self.assertEqual(self.engine.stats['added'], 1)
+        self.assertEqual(self.engine.stats['coalesced'], 99)
+
+    def test_perm_block_upgrades_a_temp_block(self):
+        self.engine._block('198.51.100.7', TEMP_BLOCK, now=0.0)
+        self.engine._block('198.51.100.8', PERM_BLOCK, now=1.0)
+        self.assertIsNone(self.engine.active['198.51.100.0/24'])
+        self.assertEqual(list(self.engine._adds.values()), [Block('198.51.100.0/24', None)])
+        # The temp block's expiry no longer applies
+        self.engine._expire(1000.0)
+        self.assertIn('198.51.100.0/24', self.engine.active)
+        self.engine._block('198.51.100.9', TEMP_BLOCK, now=2.0)
+        self.assertIsNone(self.engine.active['198.51.100.0/24'])
+
+    def test_expiry_and_reblock(self):
+        self.engine._block('198.51.100.7', TEMP_BLOCK, now=0.0)
+        self.engine._flush()
+        self.engine._expire(599.0)
+        self.assertIn('198.51.100.0/24', self.engine.active)
+        self.engine._expire(600.0)
+        self.assertNotIn('198.51.100.0/24', self.engine.active)
+        self.assertEqual(list(self.engine._removes), ['198.51.100.0/24'])
+        self.engine._flush()
+        self.assertEqual(self.backend.blocked, {})
+
+        self.engine._block('198.51.100.7', TEMP_BLOCK, now=601.0)
+        self.assertEqual(self.engine.active['198.51.100.0/24'], 1201.0)
+        self.engine._flush()
+        self.assertEqual(self.backend.blocked, {'198.51.100.0/24': 600})
+        self.assertEqual(self.engine.stats['expired'], 1)
+
+    def test_block_expiring_before_its_flush_is_never_applied(self):
+        self.engine._block('198.51.100.7', TEMP_BLOCK, now=0.0)
+        self.engine._expire(600.0)
+        self.assertEqual(self.engine._adds, {})
+        self.assertEqual(self.engine._removes, {})
+
+    def test_invalid_ip_is_ignored(self):
+        self.engine._block('not-an-ip', TEMP_BLOCK, now=0.0)
+        self.assertEqual(self.engine.active, {})
+
+class TestEngineThread(EngineTestCase):
+    def test_one_flush_per_window(self):
+        for i in range(50):
+            self.engine.submit_many([(f"203.0.113.{i}", ['alert', TEMP_BLOCK]), ('192.0.2.1', ['alert'])])
+        self.engine.submit('2001:db8::1', [PERM_BLOCK])
+        self.assertTrue(wait_for(lambda: self.backend.updates == 1))
+        time.sleep(0.3)
+        self.assertEqual(self.backend.updates, 1)
+        self.assertEqual(self.backend.blocked, {'203.0.113.0/24': 600, '2001:db8::1/128': None})
+        self.assertEqual(self.engine.stats['actions'], 51)
+
+    def test_close_drains_pending_adds(self):
+        engine = EnforcementEngine(MemoryBlockBackend(), window=60.0)
+        engine.submit('198.51.100.7', [TEMP_BLOCK])
+        engine.close()
+        self.assertEqual(engine.backend.blocked, {'198.51.100.7/32': 600})
+        self.assertEqual(engine.backend.updates, 1)
+
+class TestFileBackends(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'blocklist.rules')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self, seq):
+        with open(f"{self.path}.{seq:010d}", encoding='utf-8') as f:
+            return f.read()
+
+    def test_each_update_is_its_own_file(self):
+        backend = IpsetFileBackend(self.path)
+        backend.apply([Block('198.51.100.7/32', 600), Block('2001:db8::/64', None)], [])
+        backend.apply([], ['198.51.100.7/32'])
+        backend.apply([Block('203.0.113.1/32', 600)], [])
+        self.assertEqual(self.read(1), "add flytrap_temp 198.51.100.7/32 timeout 600\nadd flytrap6_perm 2001:db8::/64\n")
+        self.assertEqual(self.read(2), "add flytrap_temp 203.0.113.1/32 timeout 600\n")
+        self.assertEqual(sorted(os.listdir(self.dir.name)), ['blocklist.rules.0000000001', 'blocklist.rules.0000000002'])
+
+    def test_numbering_continues_after_a_restart(self):
+        IpsetFileBackend(self.path).apply([Block('198.51.100.7/32', 600)], [])
+        backend = NftFileBackend(self.path)
+        backend.apply([Block('198.51.100.8/32', 600)], [])
+        self.assertEqual(self.read(2), "add element inet filter flytrap_temp { 198.51.100.8/32 timeout 600s }\n")
+
+if __name__ == "__main__":
+    unittest.main()
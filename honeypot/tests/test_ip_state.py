@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+
+from ip_state import IPStateStore, IPStateWriter
+
+class TestIPStateWriter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'ip_state.pkl')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_background_save_round_trips(self):
+        store = IPStateStore(ttl=1e9)
+        store.interarrival('10.0.0.1', 100.0, 0.0)
+        store.interarrival('10.0.0.1', 130.0, 0.0)
+        store.interarrival('10.0.0.2', 120.0, 0.0)
+        IPStateWriter(self.path).save(store, wait=True)
+
+        restored = IPStateStore(ttl=1e9)
+        self.assertTrue(restored.restore(self.path))
+        self.assertEqual(restored.get('10.0.0.1'), store.get('10.0.0.1'))
+        self.assertEqual(len(restored), 2)
+
+    def test_snapshot_is_taken_at_save_time(self):
+        store = IPStateStore(ttl=1e9)
+        store.interarrival('10.0.0.1', 100.0, 0.0)
+        writer = IPStateWriter(self.path)
+        writer.save(store)
+        store.interarrival('10.0.0.3', 140.0, 0.0)
+        writer.flush()
+
+        restored = IPStateStore(ttl=1e9)
+        restored.restore(self.path)
+        self.assertNotIn('10.0.0.3', restored)
+
+    def test_restore_without_snapshot(self):
+        self.assertFalse(IPStateStore().restore(self.path))
+
+if __name__ == "__main__":
+    unittest.main()
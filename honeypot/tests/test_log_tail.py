@@ -0,0 +1,180 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+from log_tail import TailFollower
+
+def line(n):
+    return (json.dumps({'n': n}) + '\n').encode('utf-8')
+
+def numbers(results):
+    return [doc['n'] for doc, _, _, _ in results]
+
+class TailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'events.jsonl')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def append(self, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    def rotate(self):
+        os.rename(self.path, self.path + '.1')
+
+class TestTailFollower(TailTestCase):
+    def test_partial_line_waits_for_its_newline(self):
+        follower = TailFollower(self.path)
+        self.append(line(1) + line(2)[:5])
+        self.assertEqual(numbers(follower.read()), [1])
+        self.append(line(2)[5:])
+        results = follower.read()
+        self.assertEqual(numbers(results), [2])
+        self.assertEqual(results[-1][2], len(line(1) + line(2)))
+        self.assertEqual(follower.offset, os.path.getsize(self.path))
+
+    def test_backlog_is_read_in_bounded_chunks(self):
+        self.append(b''.join(line(n) for n in range(100)))
+        follower = TailFollower(self.path, chunk_size=64)
+        seen, calls = [], 0
+        while len(seen) < 100:
+            results = follower.read()
+            calls += 1
+            self.assertLessEqual(sum(len(raw) + 1 for _, raw, _, _ in results), 64 + len(line(99)))
+            seen.extend(numbers(results))
+        self.assertEqual(seen, list(range(100)))
+        self.assertGreater(calls, 10)
+
+    def test_line_longer_than_a_chunk_is_carried_over(self):
+        long_line = (json.dumps({'n': 1, 'pad': 'x' * 500}) + '\n').encode('utf-8')
+        self.append(long_line + line(2))
+        follower = TailFollower(self.path, chunk_size=64)
+        seen = []
+        for _ in range(20):
+            seen.extend(numbers(follower.read()))
+        self.assertEqual(seen, [1, 2])
+
+    def test_rotation_finishes_the_old_file_first(self):
+        follower = TailFollower(self.path)
+        self.append(line(1))
+        follower.read()
+        old_inode = follower.inode
+        self.append(line(2))
+        self.rotate()
+        self.append(line(3))
+        results = follower.read()
+        self.assertEqual(numbers(results), [2])
+        # Positions of lines from the old file keep the old inode
+        self.assertEqual(results[0][3], old_inode)
+        results = follower.read()
+        self.assertEqual(numbers(results), [3])
+        self.assertNotEqual(results[0][3], old_inode)
+        self.assertEqual(results[0][2], len(line(3)))
+
+    def test_rotation_waits_until_the_old_file_is_read(self):
+        follower = TailFollower(self.path, chunk_size=32)
+        self.append(line(0))
+        seen = numbers(follower.read())
+        self.append(b''.join(line(n) for n in range(1, 10)))
+        self.rotate()
+        self.append(line(99))
+        for _ in range(30):
+            seen.extend(numbers(follower.read()))
+        self.assertEqual(seen, list(range(10)) + [99])
+
+    def test_truncated_file_is_read_again(self):
+        follower = TailFollower(self.path)
+        self.append(line(1) + line(2))
+        follower.read()
+        with open(self.path, 'wb') as f:
+            f.write(line(3))
+        self.assertEqual(numbers(follower.read()), [])
+        self.assertEqual(numbers(follower.read()), [3])
+
+    def test_resume_from_saved_position(self):
+        self.append(line(1) + line(2))
+        first = TailFollower(self.path)
+        first.read()
+        first.close()
+        self.append(line(3))
+        resumed = TailFollower(self.path, offset=first.offset, inode=first.inode)
+        self.assertEqual(numbers(resumed.read()), [3])
+
+    def test_saved_position_of_a_replaced_file_starts_over(self):
+        self.append(line(1) + line(2))
+        first = TailFollower(self.path)
+        first.read()
+        first.close()
+        self.rotate()
+        self.append(line(3))
+        resumed = TailFollower(self.path, offset=first.offset, inode=first.inode)
+        self.assertEqual(numbers(resumed.read()), [3])
+
+def record(n):
+    return (json.dumps({'n': n, 'source_ip': '10.0.0.1', 'timestamp': f"2025-01-01T00:00:0{n}"}) + '\n').encode('utf-8')
+
+class TestFileTailSource(TailTestCase):
+    def test_resume_token_rewinds_past_unhandled_batches(self):
+        from sources import FileTailSource
+        source = FileTailSource([self.path], fmt='record', max_linger=0.0, poll_interval=0.01)
+        self.append(record(1) + record(2))
+        batches = source.batches()
+        logs, token = next(batches)
+        self.assertEqual([log['n'] for log in logs], [1, 2])
+        # Read, but never handed on before the reader was stopped
+        self.append(record(3))
+        self.assertEqual([log['n'] for log in next(batches)[0]], [3])
+        batches.close()
+
+        batches = source.batches(token)
+        self.assertEqual([log['n'] for log in next(batches)[0]], [3])
+        batches.close()
+
+    def test_idle_source_yields_empty_batches(self):
+        from sources import FileTailSource
+        source = FileTailSource([self.path], fmt='record', poll_interval=0.01)
+        batches = source.batches()
+        self.assertEqual(next(batches), ([], None))
+        batches.close()
+
+class _Inserted:
+    def __init__(self, ids):
+        self.inserted_ids = ids
+
+class _Collection:
+    # Stands in for a pymongo collection: keeps what insert_many() was given
+    def __init__(self):
+        self.docs = []
+
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(docs)
+        return _Inserted([doc['_id'] for doc in docs])
+
+class TestTailIngester(TailTestCase):
+    def test_flush_after_rotation_saves_the_old_file_position(self):
+        from mongo_handler import TailIngester
+        state_path = os.path.join(self.dir.name, 'ingest_state.json')
+        ingester = TailIngester(_Collection(), [self.path], state_path, batch_size=2, max_linger=3600)
+        self.append(line(1))
+        ingester.poll()
+        old_inode = ingester.followers[0].inode
+        self.append(line(2) + line(3))
+        self.rotate()
+        self.append(line(4))
+        # Line 2 fills the batch after the follower has already noticed the rotation; line 3 is still unsent
+        ingester.poll()
+        with open(state_path) as f:
+            saved = json.load(f)[self.path]
+        self.assertEqual(saved, {'offset': len(line(1) + line(2)), 'inode': old_inode})
+
+if __name__ == "__main__":
+    unittest.main()
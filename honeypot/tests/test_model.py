@@ -0,0 +1,177 @@
+import os
+import pickle
+import random
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+
+from river import anomaly, drift, preprocessing, tree
+
+from checkpoint import SNAPSHOT_MAGIC, dump_snapshot, load_checkpoint
+from model import AdaptiveAttackDetector, MemberStats
+
+def make_detector(latency_budget_ms=None, members=4):
+    # Built from state with HalfSpaceTrees members only, so the test does not depend on
+    # which other anomaly detectors the installed river provides
+    detectors = [anomaly.HalfSpaceTrees(n_trees=5, seed=i) for i in range(members)]
+    detector = AdaptiveAttackDetector.from_state_dict({
+        'version': AdaptiveAttackDetector.STATE_VERSION,
+        'threshold': 0.0,
+        'scaler': preprocessing.StandardScaler(),
+        'detectors': detectors,
+        'classifier': tree.HoeffdingTreeClassifier(),
+        'classifier_scaler': None,
+        'drift_detectors': [drift.ADWIN()],
+        'member_stats': [MemberStats(f"HalfSpaceTrees[{i}]") for i in range(members)],
+        'latency_budget': None,
+        '_events': 0,
+        'feature_importance': {},
+    })
+    detector.set_latency_budget(latency_budget_ms)
+    return detector
+
+def event(rng, shift=0.0):
+    return {'failed': rng.gauss(shift, 1), 'duration': rng.gauss(shift, 1), 'commands': rng.gauss(shift, 1)}
+
+class TestMemberStats(unittest.TestCase):
+    def test_normalize_within_own_range(self):
+        stats = MemberStats('m')
+        self.assertEqual(stats.normalize(0.4), 0.4)
+        self.assertEqual(stats.normalize(0.8), 1.0)
+        self.assertEqual(stats.normalize(0.4), 0.0)
+        self.assertAlmostEqual(stats.normalize(0.6), 0.5, places=2)
+
+    def test_an_outlier_fades_from_the_range(self):
+        rng = random.Random(3)
+        stats = MemberStats('m')
+        for _ in range(1000):
+            stats.normalize(rng.uniform(0.4, 0.6))
+        before = stats.scale(0.58)
+        stats.normalize(50.0)
+        self.assertLess(stats.scale(0.58), 0.01)
+        for _ in range(10000):
+            stats.normalize(rng.uniform(0.4, 0.6))
+        self.assertAlmostEqual(stats.scale(0.58), before, delta=0.1)
+
+    def test_scale_does_not_change_the_range(self):
+        stats = MemberStats('m')
+        stats.normalize(0.2)
+        stats.normalize(0.6)
+        bounds = (stats.score_min, stats.score_max)
+        self.assertEqual(stats.scale(0.9), 1.0)
+        self.assertAlmostEqual(stats.scale(0.4), 0.5, places=2)
+        self.assertEqual((stats.score_min, stats.score_max), bounds)
+
+    def test_old_pickles_get_an_empty_range(self):
+        stats = MemberStats.__new__(MemberStats)
+        stats.__setstate__({'name': 'm', 'active': True})
+        self.assertEqual(stats.normalize(0.3), 0.3)
+
+class TestEnsembleScore(unittest.TestCase):
+    def test_scores_vary_with_members_parked(self):
+        rng = random.Random(0)
+        detector = make_detector(latency_budget_ms=0.001)
+        scores = [detector.process_log(event(rng, shift=5.0 if i % 7 == 0 else 0.0))[0] for i in range(600)]
+        active = [stats for stats in detector.member_stats if stats.active]
+        self.assertEqual(len(active), AdaptiveAttackDetector.MIN_ACTIVE_MEMBERS)
+        late = scores[-200:]
+        self.assertGreater(len(set(round(s, 6) for s in late)), 10)
+        self.assertTrue(all(0.0 <= s <= 1.0 for s in late))
+
+    def test_score_one_has_no_side_effects(self):
+        rng = random.Random(4)
+        detector = make_detector(latency_budget_ms=0.001)
+        for _ in range(200):
+            detector.process_log(event(rng))
+        before = [stats.__getstate__() for stats in detector.member_stats]
+        scores = [detector.score_one(event(rng, shift=5.0)) for _ in range(20)]
+        self.assertEqual([stats.__getstate__() for stats in detector.member_stats], before)
+        self.assertTrue(all(0.0 <= s <= 1.0 for s in scores))
+
+    def test_two_members_do_not_collapse_to_half(self):
+        rng = random.Random(1)
+        detector = make_detector(members=2)
+        scores = [detector.process_log(event(rng))[0] for _ in range(300)]
+        self.assertNotEqual(set(scores[-100:]), {0.5})
+
+class TestAdopt(unittest.TestCase):
+    def trained(self, shift, n=100, labels=False):
+        rng = random.Random(5)
+        detector = make_detector()
+        events = [event(rng, shift) for _ in range(n)]
+        detector.process_batch(events, labels=['brute_force'] * n if labels else None)
+        return detector
+
+    def test_kept_classifier_keeps_its_scaler(self):
+        detector = self.trained(0.0)
+        detector.set_retraining(buffer_size=50, min_events=10)
+        rng = random.Random(6)
+        for _ in range(20):
+            detector.process_log(event(rng))
+        classifier, scaler = detector.classifier, detector.scaler
+        shadow = self.trained(10.0)
+        detector._adopt(shadow)
+        self.assertIs(detector.classifier, classifier)
+        self.assertIs(detector.classifier_scaler, scaler)
+        self.assertIs(detector.scaler, shadow.scaler)
+
+        probe = event(rng)
+        self.assertEqual(detector._scale_for_classifier(probe), scaler.transform_one(probe))
+        self.assertNotEqual(detector._scale_for_classifier(probe), detector._scale(probe))
+        detector.process_log(probe)
+        # The kept scaler goes on learning with its classifier
+        self.assertEqual(scaler.counts['failed'], 121)
+
+    def test_labeled_retrain_replaces_classifier_and_scaler(self):
+        detector = self.trained(0.0)
+        detector.classifier_scaler = detector.scaler
+        detector.set_retraining(buffer_size=50, min_events=10)
+        rng = random.Random(7)
+        detector.process_batch([event(rng) for _ in range(20)], labels=['brute_force'] * 20)
+        shadow = self.trained(10.0, labels=True)
+        detector._adopt(shadow)
+        self.assertIs(detector.classifier, shadow.classifier)
+        self.assertIsNone(detector.classifier_scaler)
+
+class TestStateDict(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'model.pkl')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def save(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def test_snapshot_round_trip(self):
+        rng = random.Random(2)
+        detector = make_detector()
+        detector.process_batch([event(rng) for _ in range(100)], labels=['brute_force'] * 100)
+        state = detector.state_dict()
+        self.assertEqual(set(state), set(AdaptiveAttackDetector.STATE_FIELDS) | {'version'})
+        self.assertNotIn('metric', state)
+
+        self.save(dump_snapshot(detector))
+        restored = load_checkpoint(self.path, AdaptiveAttackDetector.from_state_dict)
+        self.assertIsNone(restored.retrainer)
+        self.assertEqual(restored._events, detector._events)
+        self.assertEqual(restored.feature_importance, detector.feature_importance)
+        events = [event(rng, shift=3.0) for _ in range(20)]
+        self.assertEqual(restored.process_batch(events), detector.process_batch(events))
+
+    def test_version_1_snapshots_still_load(self):
+        state = make_detector().state_dict()
+        del state['classifier_scaler']
+        state.update(version=1, metric=None)
+        self.save(SNAPSHOT_MAGIC + pickle.dumps(state))
+        restored = load_checkpoint(self.path, AdaptiveAttackDetector.from_state_dict)
+        self.assertFalse(hasattr(restored, 'metric'))
+        self.assertIsNone(restored.classifier_scaler)
+
+if __name__ == "__main__":
+    unittest.main()
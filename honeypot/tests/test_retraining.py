@@ -0,0 +1,120 @@
+import os
+import sys
+import threading
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+
+from retraining import ShadowRetrainer
+
+class StubShadow:
+    def __init__(self, gate=None):
+        self.warmed = []
+        self.gate = gate
+
+    def warm_one(self, features, label=None):
+        if self.gate is not None:
+            self.gate.wait()
+        self.warmed.append(features['n'])
+
+class RetrainerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.swapped = []
+        self.shadows = []
+
+    def build(self, gate=None):
+        def build():
+            shadow = StubShadow(gate)
+            self.shadows.append(shadow)
+            return shadow
+        return build
+
+    def retrainer(self, build=None, **kwargs):
+        kwargs.setdefault('buffer_size', 10)
+        kwargs.setdefault('min_events', 5)
+        return ShadowRetrainer(build or self.build(), self.swapped.append, **kwargs)
+
+    def observe(self, retrainer, numbers):
+        for n in numbers:
+            retrainer.observe({'n': n}, None)
+
+    def finish(self, retrainer):
+        self.assertTrue(retrainer._ready.wait(2.0))
+        return retrainer.poll()
+
+class TestShadowRetrainer(RetrainerTestCase):
+    def test_retrain_and_swap(self):
+        retrainer = self.retrainer()
+        self.observe(retrainer, range(3))
+        retrainer.on_drift()
+        # Not enough events buffered yet
+        self.assertFalse(retrainer.poll())
+        self.assertIsNone(retrainer._thread)
+        self.observe(retrainer, range(3, 12))
+        self.assertFalse(retrainer.poll())
+        self.assertTrue(self.finish(retrainer))
+        self.assertEqual(self.swapped, self.shadows)
+        self.assertEqual(self.swapped[0].warmed, list(range(2, 12)))
+        self.assertEqual(retrainer.summary()['swaps'], 1)
+        self.assertFalse(retrainer.summary()['training'])
+
+    def test_drift_during_cooldown_is_ignored(self):
+        retrainer = self.retrainer(cooldown=20)
+        self.observe(retrainer, range(10))
+        retrainer.on_drift()
+        retrainer.poll()
+        self.finish(retrainer)
+        self.observe(retrainer, range(10, 25))
+        retrainer.on_drift()
+        self.assertFalse(retrainer.poll())
+        self.assertIsNone(retrainer._thread)
+        self.observe(retrainer, range(25, 30))
+        retrainer.on_drift()
+        retrainer.poll()
+        self.assertTrue(self.finish(retrainer))
+        self.assertEqual(retrainer.stats['ignored'], 1)
+        self.assertEqual(retrainer.stats['retrains'], 2)
+
+    def test_drift_while_training_is_ignored(self):
+        gate = threading.Event()
+        retrainer = self.retrainer(build=self.build(gate))
+        self.observe(retrainer, range(10))
+        retrainer.on_drift()
+        retrainer.poll()
+        retrainer.on_drift()
+        gate.set()
+        self.finish(retrainer)
+        self.assertEqual(retrainer.stats['ignored'], 1)
+
+    def test_failed_build_keeps_the_live_detector(self):
+        def build():
+            raise RuntimeError("out of memory")
+
+        retrainer = self.retrainer(build=build)
+        self.observe(retrainer, range(10))
+        retrainer.on_drift()
+        retrainer.poll()
+        self.assertFalse(self.finish(retrainer))
+        self.assertEqual(self.swapped, [])
+        self.assertEqual(retrainer.stats['failed'], 1)
+        self.assertIsNone(retrainer._thread)
+
+    def test_events_during_training_are_caught_up(self):
+        gate = threading.Event()
+        retrainer = self.retrainer(build=self.build(gate), max_catch_up=3)
+        self.observe(retrainer, range(10))
+        retrainer.on_drift()
+        retrainer.poll()
+        # Arrive while the shadow is still warming on the buffer, so the worker replays them
+        self.observe(retrainer, range(10, 20))
+        gate.set()
+        self.assertTrue(retrainer._ready.wait(2.0))
+        # Arrive after the worker's last pass; only the newest max_catch_up are replayed on swap
+        self.observe(retrainer, range(20, 30))
+        self.assertTrue(retrainer.poll())
+        self.assertEqual(self.swapped[0].warmed, list(range(20)) + [27, 28, 29])
+        self.assertEqual(retrainer.stats['skipped'], 7)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import queue
+import sys
+import tempfile
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+sys.path.insert(0, HERE)
+
+from geoip_fixture import write_test_mmdb
+from test_model import make_detector
+
+from checkpoint import dump_snapshot
+from Feature import FeatureExtractor
+from ip_state import IPStateStore
+from sharding import ShardError, ShardModelSet, ShardedDetector, partition, shard_for, shard_path
+
+IPS = ['198.51.100.7', '192.0.2.1', '203.0.113.9', '198.51.100.20', '192.0.2.77']
+
+def log(ip, second=0):
+    return {
+        'source_ip': ip,
+        'timestamp': f'2025-01-01T03:00:{second:02d}',
+        'duration': 30,
+        'auth_attempts': {'failed': 3, 'success': 0},
+        'commands': ['uname -a'],
+    }
+
+class FakeWorker:
+    def __init__(self):
+        self.alive = True
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.alive
+
+def fake_sharded(num_shards=2, queue_size=8):
+    # Inboxes and workers stand in for the shard processes, so only the parent's bookkeeping runs
+    sharded = ShardedDetector(num_shards, {}, queue_size=queue_size, put_timeout=0.05)
+    sharded._inboxes = [queue.Queue(maxsize=queue_size) for _ in range(num_shards)]
+    sharded._workers = [FakeWorker() for _ in range(num_shards)]
+    return sharded
+
+class TestPartition(unittest.TestCase):
+    def test_each_ip_goes_to_its_shard_in_order(self):
+        logs = [log(ip, i) for i, ip in enumerate(IPS * 2)]
+        parts = partition(logs, 3)
+        self.assertEqual(sum(len(p) for p in parts), len(logs))
+        for shard, part in enumerate(parts):
+            self.assertTrue(all(shard_for(l['source_ip'], 3) == shard for l in part))
+            self.assertEqual(part, [l for l in logs if l in part])
+
+class TestShardedDetector(unittest.TestCase):
+    def test_submit_sends_each_shard_its_part(self):
+        sharded = fake_sharded()
+        logs = [log(ip) for ip in IPS]
+        sharded.submit(logs, token='t1')
+        for shard, part in enumerate(partition(logs, 2)):
+            if part:
+                self.assertEqual(sharded._inboxes[shard].get_nowait(), ('logs', part))
+            self.assertTrue(sharded._inboxes[shard].empty())
+
+    def test_token_committable_once_every_shard_answered(self):
+        sharded = fake_sharded()
+        shards = [s for s, part in enumerate(partition([log(ip) for ip in IPS], 2)) if part]
+        self.assertEqual(len(shards), 2)
+        sharded.submit([log(ip) for ip in IPS], token='t1')
+        sharded.submit([log(ip) for ip in IPS], token='t2')
+        self.assertIsNone(sharded.committable())
+        sharded._answered(shards[0])
+        self.assertIsNone(sharded.committable())
+        sharded._answered(shards[1])
+        self.assertEqual(sharded.committable(), 't1')
+        self.assertIsNone(sharded.committable())
+        for shard in shards:
+            sharded._answered(shard)
+        self.assertEqual(sharded.committable(), 't2')
+
+    def test_batches_without_logs_commit_behind_earlier_ones(self):
+        sharded = fake_sharded()
+        sharded.submit([log(IPS[0])], token='t1')
+        sharded.submit([], token='t2')
+        self.assertIsNone(sharded.committable())
+        sharded._answered(shard_for(IPS[0], 2))
+        self.assertEqual(sharded.committable(), 't2')
+
+    def test_submit_raises_when_a_shard_has_exited(self):
+        sharded = fake_sharded()
+        sharded._workers[1].alive = False
+        sharded._workers[1].exitcode = 1
+        with self.assertRaises(ShardError):
+            sharded.submit([log(ip) for ip in IPS], token='t1')
+        self.assertTrue(all(inbox.empty() for inbox in sharded._inboxes))
+
+    def test_full_inbox_of_a_dead_shard_raises(self):
+        sharded = fake_sharded(queue_size=1)
+        shard = shard_for(IPS[0], 2)
+        sharded.submit([log(IPS[0])])
+        # The shard dies with its inbox full, after submit() checked it
+        sharded._workers[shard].alive = False
+        sharded._check_workers = lambda: None
+        with self.assertRaises(ShardError):
+            sharded.submit([log(IPS[0])])
+
+class TestShardProcesses(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.env = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        self.dir.cleanup()
+
+    def test_shard_that_fails_to_start_raises_shard_error(self):
+        # Without GEOIP_PATH the shard's FeatureExtractor fails and the process exits
+        os.environ.pop('GEOIP_PATH', None)
+        config = {
+            'threshold': 0.0, 'model_path': os.path.join(self.dir.name, 'model.pkl'),
+            'shared_preprocessing': True, 'checkpoint_keep': 1, 'checkpoint_compress': 0,
+            'ip_state_max_entries': 100, 'ip_state_max_memory_mb': 0, 'ip_state_ttl': 60,
+            'ip_state_path': None, 'log_level': 'CRITICAL', 'log_sample_burst': 0, 'log_sample_interval': 0,
+        }
+        sharded = ShardedDetector(1, config)
+        sharded.start()
+        try:
+            sharded._workers[0].join(timeout=60)
+            self.assertFalse(sharded._workers[0].is_alive())
+            with self.assertRaises(ShardError):
+                sharded.submit([log(IPS[0])], token='t1')
+            self.assertIsNone(sharded.committable())
+        finally:
+            self.assertEqual(sharded.stop(timeout=1), [])
+
+class TestShardModelSet(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        write_test_mmdb(os.path.join(self.dir.name, 'GeoLite2-City.mmdb'))
+        self.env = dict(os.environ)
+        os.environ['GEOIP_PATH'] = self.dir.name
+        self.model_path = os.path.join(self.dir.name, 'model.pkl')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        self.dir.cleanup()
+
+    def test_load_raises_on_a_missing_shard(self):
+        with open(shard_path(self.model_path, 0), 'wb') as f:
+            f.write(dump_snapshot(make_detector()))
+        with self.assertRaises(FileNotFoundError):
+            ShardModelSet.load(self.model_path, 2)
+
+    def test_save_and_load_round_trip(self):
+        models = ShardModelSet([make_detector(), make_detector()])
+        models.save(self.model_path)
+        self.assertTrue(os.path.exists(shard_path(self.model_path, 1)))
+        loaded = ShardModelSet.load(self.model_path, 2)
+        self.assertEqual(len(loaded.detectors), 2)
+
+    def test_each_log_is_scored_by_its_shard(self):
+        models = ShardModelSet([make_detector(), make_detector()])
+        logs = [log(ip, i) for i, ip in enumerate(IPS * 2)]
+        detections = models.score_logs(logs, FeatureExtractor(), IPStateStore(ttl=1e9))
+        self.assertEqual(len(detections), len(logs))
+        for shard, part in enumerate(partition(logs, 2)):
+            self.assertEqual(models.detectors[shard]._events, len(part))
+        self.assertIs(models.detector_for(IPS[0]), models.detectors[shard_for(IPS[0], 2)])
+
+if __name__ == "__main__":
+    unittest.main()
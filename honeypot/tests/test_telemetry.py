@@ -0,0 +1,60 @@
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'core_ml'))
+
+from telemetry import Counter, Gauge, Histogram, Registry
+
+def make_registry():
+    registry = Registry()
+    counter = registry.register(Counter('test_events_total', "Events.", ('kind',)))
+    histogram = registry.register(Histogram('test_seconds', "Time.", ('stage',), buckets=(0.1, 1.0)))
+    registry.register(Gauge('test_gauge', "A gauge.", lambda: 3))
+    return registry, counter, histogram
+
+class TestRegistry(unittest.TestCase):
+    def test_render(self):
+        registry, counter, histogram = make_registry()
+        counter.labels('a').inc(2)
+        histogram.labels('score').observe(0.05)
+        histogram.labels('score').observe(0.5)
+        text = registry.render()
+        self.assertIn('test_events_total{kind="a"} 2', text)
+        self.assertIn('test_seconds_bucket{stage="score",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{stage="score",le="+Inf"} 2', text)
+        self.assertIn('test_seconds_count{stage="score"} 2', text)
+        self.assertIn('test_gauge 3', text)
+
+    def test_rendering_does_not_change_state(self):
+        registry, counter, _ = make_registry()
+        counter.labels('a').inc()
+        self.assertEqual(registry.render(), registry.render())
+
+    def test_worker_snapshots_are_summed(self):
+        parent, counter, histogram = make_registry()
+        counter.labels('a').inc(1)
+        worker, worker_counter, worker_histogram = make_registry()
+        worker_counter.labels('a').inc(2)
+        worker_counter.labels('b').inc(5)
+        worker_histogram.labels('score').observe(0.05)
+        snapshot = worker.snapshot()
+        self.assertNotIn('test_gauge', snapshot)
+        parent.merge('shard0', snapshot)
+        text = parent.render()
+        self.assertIn('test_events_total{kind="a"} 3', text)
+        self.assertIn('test_events_total{kind="b"} 5', text)
+        self.assertIn('test_seconds_count{stage="score"} 1', text)
+
+    def test_newer_snapshot_replaces_older(self):
+        parent, _, _ = make_registry()
+        worker, worker_counter, _ = make_registry()
+        worker_counter.labels('a').inc(2)
+        parent.merge('shard0', worker.snapshot())
+        worker_counter.labels('a').inc(2)
+        parent.merge('shard0', worker.snapshot())
+        self.assertIn('test_events_total{kind="a"} 4', parent.render())
+
+if __name__ == "__main__":
+    unittest.main()